@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the SNMP personality discovery.
+
+A stub stands in for the SNMP agents: it answers a sysDescr for every host
+after a fixed delay, the time of a get over the network. The host list is
+discovered with a growing number of worker processes, then once more from
+the on-disk cache, and the matching of the compiled sys_descr rules is
+timed against searching the uncompiled patterns of PERSONALITIES, as
+Cling did before.
+
+No device nor Net-SNMP is needed.
+
+Usage:
+
+    python benchmarks/bench_discovery.py [--hosts N] [--delay SECONDS]
+"""
+
+import optparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cling
+from cling.cli import PERSONALITIES
+from cling.discovery import compile_rules, match_personality
+
+SYS_DESCRS = [
+    'Cisco IOS Software, C3750E Software (C3750E-UNIVERSALK9-M), '
+    'Version 15.0(2)SE5, RELEASE SOFTWARE (fc1)',
+    'Cisco IOS XR Software (Cisco ASR9K Series), Version 5.3.4',
+    'Arista Networks EOS version 4.20.1F running on an Arista DCS-7050SX',
+    'Juniper Networks, Inc. mx480 internet router, kernel JUNOS 15.1R6.7',
+    'Palo Alto Networks PA-5000 series firewall',
+    'Linux fw1 2.6.18-92cpx86_64 #1 SMP',
+]
+
+
+class stub(object):
+    """sysDescr query answering after delay seconds"""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def __call__(self, hostname):
+        time.sleep(self.delay)
+        return SYS_DESCRS[int(hostname.split('-')[1]) % len(SYS_DESCRS)]
+
+
+def previous(sys_descr):
+    '''The matching as it was done before compile_rules()'''
+
+    for personality in PERSONALITIES:
+        if personality == 'generic':
+            continue
+        if re.search(PERSONALITIES[personality]['sys_descr'], sys_descr,
+                     flags=re.I):
+            return personality
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--hosts', type='int', default=200,
+                      help='number of hosts (default: 200)')
+    parser.add_option('--delay', type='float', default=0.05,
+                      help='seconds per SNMP get (default: 0.05)')
+    opts, args = parser.parse_args()
+
+    hostnames = ['host-%d' % i for i in range(opts.hosts)]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(tmpdir, 'discovery.json')
+        for num_workers in (1, 4, 16):
+            if os.path.exists(cache_path):
+                os.unlink(cache_path)
+            finder = cling.Discovery(cache_path=cache_path,
+                                     num_workers=num_workers,
+                                     query=stub(opts.delay))
+            start = time.time()
+            results = finder.discover(hostnames)
+            print('%2d workers  %7.3f s' % (num_workers, time.time() - start))
+            assert len(results) == opts.hosts
+        finder = cling.Discovery(cache_path=cache_path, query=stub(60))
+        start = time.time()
+        assert finder.discover(hostnames) == results
+        print('cached      %7.3f s' % (time.time() - start))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    rules = compile_rules()
+    repeat = 10000
+    for name, func, args in (('previous', previous, ()),
+                             ('compiled', match_personality, (rules,))):
+        start = time.time()
+        for i in range(repeat):
+            for sys_descr in SYS_DESCRS:
+                func(sys_descr, *args)
+        print('%s matching  %7.3f us per sysDescr' % (
+            name, (time.time() - start) * 1e6 / repeat / len(SYS_DESCRS)))
+
+
+if __name__ == '__main__':
+    main()
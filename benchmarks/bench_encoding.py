@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cost of the pexpect_ng text mode.
+
+A child writes a transcript of --size MB to its pty, interface descriptions
+with non-ASCII characters in UTF-8 among them, and finishes with a cli
+prompt the parent waits for with spawn.expect(). Modes:
+
+    bytes           encoding=None, before is bytes
+    utf-8 unread    encoding='utf-8', before is never read, so never decoded
+    utf-8           encoding='utf-8', before is read (decoded once)
+    latin-1         encoding='latin-1', before is read
+
+The patterns are matched on the raw bytes in every mode, so the text modes
+only add the decoding of before when it is read.
+
+Usage:
+
+    python benchmarks/bench_encoding.py [--size MB]
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cling import pexpect_ng as pexpect
+from cling.cli import PROMPT_LOOKBACK
+
+PROMPT = b'router1#'
+
+LINE = (u'Gi1/0/%d   up   up   Lien vers b\xe2timent %d — \xe9tage 2\n'
+        .encode('utf-8'))
+
+FAKE_DEVICE = r'''
+import os, sys
+size = int(sys.argv[1])
+line = %r
+block = b''.join(line.replace(b'%%d', str(i).encode('ascii'))
+                 for i in range(4096))
+written = 0
+while written < size:
+    os.write(1, block)
+    written += len(block)
+os.write(1, %r)
+sys.stdin.readline()
+''' % (LINE, PROMPT)
+
+MODES = [
+    ('bytes', None, True),
+    ('utf-8 unread', 'utf-8', False),
+    ('utf-8', 'utf-8', True),
+    ('latin-1', 'latin-1', True),
+]
+
+
+def bench_pty(size, encoding, read_before):
+    child = pexpect.spawn(sys.executable, ['-c', FAKE_DEVICE, str(size)],
+                          timeout=600, maxread=64000, encoding=encoding)
+    child.searchlookback = PROMPT_LOOKBACK
+    start = time.time()
+    child.expect(re.compile(u'[#>\\$%] ?$'))
+    if read_before:
+        child.before
+    elapsed = time.time() - start
+    child.sendline()
+    child.close()
+    return elapsed
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=50,
+                      help='transcript size in MB (default: 50)')
+    opts, args = parser.parse_args()
+
+    size = opts.size * 1024 * 1024
+
+    print('pty, %d MB transcript' % opts.size)
+    for name, encoding, read_before in MODES:
+        elapsed = bench_pty(size, encoding, read_before)
+        print('  %-14s %8.3f s %8.1f MB/s' % (
+            name, elapsed, opts.size / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the pexpect_ng receive buffer.
+
+A child process stands in for a device: it writes a synthetic
+"show ip bgp"-like transcript of the requested size to its pty and finishes
+with a cli prompt. The parent waits for the prompt with spawn.expect(), as
+Cling does (searchlookback=cling.cli.PROMPT_LOOKBACK) and with
+searchwindowsize set, and reports the time taken and the resulting
+throughput.
+
+The in-memory part feeds the same transcript, chunk by chunk, through the
+old "incoming = incoming + c" loop with a full regex rescan and through
+receive_buffer, to show how both scale with the output size.
+
+Usage:
+
+    python benchmarks/bench_expect_buffer.py [--size MB] [--chunk BYTES]
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cling import pexpect_ng as pexpect
+from cling.cli import PROMPT_LOOKBACK
+
+PROMPT = b'router1#'
+
+LINE = b'*> 10.%d.%d.0/24      192.0.2.1       0    100      0 65000 i\n'
+
+FAKE_DEVICE = r'''
+import os, sys
+size = int(sys.argv[1])
+line = %r
+block = b''.join(line %% (i %% 256, i // 256 %% 256) for i in range(4096))
+written = 0
+while written < size:
+    os.write(1, block)
+    written += len(block)
+os.write(1, %r)
+sys.stdin.readline()
+''' % (LINE, PROMPT)
+
+
+def transcript(size):
+    block = b''.join(LINE % (i % 256, i // 256 % 256) for i in range(4096))
+    return block * (size // len(block) + 1) + PROMPT
+
+
+def bench_pty(size, searchwindowsize):
+    child = pexpect.spawn(sys.executable, ['-c', FAKE_DEVICE, str(size)],
+                          timeout=600, maxread=64000)
+    child.searchwindowsize = searchwindowsize
+    child.searchlookback = PROMPT_LOOKBACK
+    start = time.time()
+    child.expect(re.compile(r'[#>\$%] ?$'))
+    elapsed = time.time() - start
+    received = len(child.before) + len(child.after)
+    child.sendline()
+    child.close()
+    return elapsed, received
+
+
+def naive_loop(data, chunk, pattern):
+    incoming = b''
+    for i in range(0, len(data), chunk):
+        incoming = incoming + data[i:i + chunk]
+        m = pattern.search(incoming, 0)
+        if m and m.end() == len(data):
+            return m.start()
+
+
+def buffer_loop(data, chunk, pattern):
+    incoming = pexpect.receive_buffer()
+    searcher = pexpect.searcher_re([pattern], lookback=PROMPT_LOOKBACK)
+    for i in range(0, len(data), chunk):
+        incoming.append(data[i:i + chunk])
+        if incoming.search(searcher) >= 0 and searcher.end == len(data):
+            return searcher.start
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=50,
+                      help='transcript size in MB (default: 50)')
+    parser.add_option('--chunk', type='int', default=4096,
+                      help='chunk size of the in-memory runs (default: 4096)')
+    opts, args = parser.parse_args()
+
+    size = opts.size * 1024 * 1024
+
+    print('pty, %d MB transcript' % opts.size)
+    for searchwindowsize in (None, 5):
+        elapsed, received = bench_pty(size, searchwindowsize)
+        print('  searchwindowsize=%-5s %8.3f s %8.1f MB/s' % (
+            searchwindowsize, elapsed, received / elapsed / 1024 / 1024))
+
+    # A pattern that does not match in the middle of the output, so the
+    # naive loop has to rescan everything every time.
+    pattern = re.compile(br'router1#$')
+    print('in-memory, %d byte chunks' % opts.chunk)
+    for mb in (1, 2, 4):
+        data = transcript(mb * 1024 * 1024)
+        results = []
+        for loop in (naive_loop, buffer_loop):
+            start = time.time()
+            loop(data, opts.chunk, pattern)
+            results.append(time.time() - start)
+        print('  %2d MB  naive %8.3f s  receive_buffer %8.3f s' % (
+            mb, results[0], results[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the command output post-processing in Cling.
+
+Every command's output goes through the magic tag check and the removal of
+the echoed command and of the cli prompt. This times the current code,
+Cling._parse_meta_command() and Cling._clean_output(), against the previous
+implementation (one re.search() per magic tag, a regex built from the
+command to strip the echo and a '[^\\n]*?$' substitution to strip the
+prompt) on a 1k-line and a 1M-line output.
+
+No device is needed, Cling is only instantiated, not logged in.
+
+Usage:
+
+    python benchmarks/bench_output_cleaning.py [--repeat N]
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cling
+
+COMMAND = 'show ip route'
+
+LINE = 'B    10.%d.%d.0/24 [20/0] via 192.0.2.1, 2w1d, GigabitEthernet0/1\r\n'
+
+
+def output(lines):
+    return COMMAND + '\r\n' + ''.join(
+        LINE % (i % 256, i // 256 % 256) for i in range(lines)) + 'router1'
+
+
+def previous(personality, command, out):
+    '''The post-processing as it was done before _parse_meta_command() and
+    _clean_output() on slice offsets'''
+
+    for tag in (r'^<sleep (\d+)>$', r'^<send>(.+)$', r'^<force_exec>(.+)$',
+                r'^<ignore_err>(.+)$', r'^<send_line>(.+)$'):
+        if re.search(tag, command, flags=re.I):
+            return None
+    if personality == 'tmos':
+        out = re.sub(r'.%s' % chr(8), '', out)
+    out = re.sub(r'%s.*?\r\n' % re.escape(command), '', out)
+    out = re.sub('[^\n]*?$', '', out)
+    return out
+
+
+def current(ch, command, out):
+    tag, argument = ch._parse_meta_command(command)
+    if tag is not None:
+        return None
+    return ch._clean_output(command, out)
+
+
+def timed(repeat, func, *args):
+    start = time.time()
+    for i in range(repeat):
+        result = func(*args)
+    return (time.time() - start) / repeat, result
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--repeat', type='int', default=0,
+                      help='runs per output size (default: 1000 for 1k '
+                           'lines, 1 for 1M lines)')
+    opts, args = parser.parse_args()
+
+    for personality in ('ios', 'tmos'):
+        ch = cling.Cling(hostname='bench', personality=personality)
+        print('personality %s' % personality)
+        for lines, repeat in ((1000, 1000), (1000000, 1)):
+            out = output(lines)
+            repeat = opts.repeat or repeat
+            t_prev, r_prev = timed(repeat, previous, personality, COMMAND,
+                                   out)
+            t_cur, r_cur = timed(repeat, current, ch, COMMAND, out)
+            assert r_prev == r_cur
+            print('  %7d lines  previous %10.6f s  current %10.6f s' % (
+                lines, t_prev, t_cur))
+
+
+if __name__ == '__main__':
+    main()
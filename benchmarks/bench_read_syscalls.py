@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+Syscall count of the pexpect_ng read loop.
+
+A local echo child stands in for a device: every line sent to it is echoed
+back followed by a cli prompt. The parent runs the requested number of
+send/expect round trips and a bulk transfer, and counts the select(),
+read() and waitpid() calls made along the way, with spawn.lazyreap on
+(Linux default: EOF comes from read(), the child is only waited for when no
+data comes in) and off (the child is checked with waitpid() before every
+read, as on other platforms).
+
+The calls are counted by wrapping the os and select functions pexpect_ng
+uses. To see every syscall of the process instead, run a single mode under
+strace:
+
+    strace -c -f python benchmarks/bench_read_syscalls.py --mode lazy
+
+Usage:
+
+    python benchmarks/bench_read_syscalls.py [--lines N] [--size MB]
+                                             [--mode both|lazy|eager]
+"""
+
+import optparse
+import os
+import re
+import select
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cling import pexpect_ng as pexpect
+from cling.cli import PROMPT_LOOKBACK
+
+PROMPT = b'router1#'
+
+ECHO_CHILD = r'''
+import os, sys
+prompt = %r
+os.write(1, prompt)
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    if line.startswith('bulk '):
+        size = int(line.split()[1])
+        block = b'x' * 79 + b'\n'
+        os.write(1, block * (size // len(block)))
+    os.write(1, prompt)
+''' % PROMPT
+
+COUNTED = [(os, 'read'), (os, 'waitpid'), (select, 'select')]
+
+
+class counter(object):
+    """Wraps the functions in COUNTED and counts their calls"""
+
+    def __init__(self):
+        self.counts = dict((name, 0) for module, name in COUNTED)
+        self.saved = []
+
+    def wrap(self, module, name):
+        func = getattr(module, name)
+
+        def counted(*args, **kwargs):
+            self.counts[name] += 1
+            return func(*args, **kwargs)
+
+        self.saved.append((module, name, func))
+        setattr(module, name, counted)
+
+    def __enter__(self):
+        for module, name in COUNTED:
+            self.wrap(module, name)
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, name, func in self.saved:
+            setattr(module, name, func)
+
+
+def run(lazyreap, lines, size):
+    child = pexpect.spawn(sys.executable, ['-c', ECHO_CHILD], timeout=60)
+    child.fixeddelays = False
+    child.lazyreap = lazyreap
+    child.searchlookback = PROMPT_LOOKBACK
+    prompt = re.compile(re.escape(PROMPT) + b'$')
+    child.expect(prompt)
+
+    results = []
+    with counter() as c:
+        start = time.time()
+        for i in range(lines):
+            child.sendline('line %d' % i)
+            child.expect(prompt)
+        results.append((time.time() - start, dict(c.counts)))
+    with counter() as c:
+        start = time.time()
+        child.sendline('bulk %d' % size)
+        child.expect(prompt)
+        received = len(child.before)
+        results.append((time.time() - start, dict(c.counts)))
+
+    child.sendeof()
+    child.expect(pexpect.EOF)
+    child.close()
+    return results, received
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--lines', type='int', default=1000,
+                      help='send/expect round trips (default: 1000)')
+    parser.add_option('--size', type='int', default=20,
+                      help='bulk transfer size in MB (default: 20)')
+    parser.add_option('--mode', choices=['both', 'lazy', 'eager'],
+                      default='both',
+                      help='both (default), lazy or eager reaping')
+    opts, args = parser.parse_args()
+
+    size = opts.size * 1024 * 1024
+    modes = {'both': [True, False], 'lazy': [True], 'eager': [False]}
+
+    for lazyreap in modes[opts.mode]:
+        results, received = run(lazyreap, opts.lines, size)
+        print('lazyreap=%s' % lazyreap)
+        (t_lines, lines), (t_bulk, bulk) = results
+        print('  %d round trips  %7.3f s  per round trip: %s' % (
+            opts.lines, t_lines, '  '.join(
+                '%s %.1f' % (name, float(lines[name]) / opts.lines)
+                for module, name in COUNTED)))
+        print('  %d MB bulk      %7.3f s  per MB: %s' % (
+            opts.size, t_bulk, '  '.join(
+                '%s %.1f' % (name, float(bulk[name]) * 1024 * 1024 / received)
+                for module, name in COUNTED)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+Replays a recorded session many times, the way a parser or the error
+handling is load tested without devices.
+
+A session is recorded against benchmarks/fake_device.py (or --recording is
+replayed as is): login, a short command, a large output and a command
+failing with the personality's error. The recording is then replayed
+--sessions times by --workers threads, as fast as possible or at
+--speed times the recorded pace, and every replayed output is checked
+against the recorded one. Reported: sessions/s, commands/s, MB/s of
+output and errors raised.
+
+Usage:
+
+    python benchmarks/bench_replay.py [--personality ios] [--size MB]
+        [--sessions N] [--workers N] [--speed FACTOR] [--recording PATH]
+"""
+
+import optparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cling
+
+FAKE_DEVICE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fake_device.py')
+
+COMMANDS = ['show version', 'show bytes %d', 'no such command']
+
+
+def session(opts, **kwargs):
+    return cling.Cling(
+        hostname='router1', username='admin', password='secret',
+        personality=opts.personality,
+        ssh_path='%s %s' % (sys.executable, FAKE_DEVICE),
+        extra_ssh_params='--personality %s' % opts.personality,
+        pexpect_timeout=600, **kwargs)
+
+
+def run(ch, opts):
+    '''Returns the outputs of COMMANDS, the error message for the failing
+    one'''
+
+    outputs = []
+    for command in COMMANDS:
+        if '%d' in command:
+            command %= opts.size * 1024 * 1024
+        try:
+            outputs.append(ch.run_command(command))
+        except cling.Error as e:
+            outputs.append(str(e))
+    return outputs
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--personality', default='ios',
+                      help='fake device personality (default: ios)')
+    parser.add_option('--size', type='int', default=1,
+                      help='size of the large output in MB (default: 1)')
+    parser.add_option('--sessions', type='int', default=100,
+                      help='sessions replayed (default: 100)')
+    parser.add_option('--workers', type='int', default=4,
+                      help='threads replaying sessions (default: 4)')
+    parser.add_option('--speed', type='float', default=None,
+                      help='replay at the recorded pace divided by FACTOR '
+                           '(default: as fast as possible)')
+    parser.add_option('--recording',
+                      help='recording to replay, recorded from the fake '
+                           'device if not given')
+    opts, args = parser.parse_args()
+
+    path = opts.recording
+    if path is None:
+        fd, path = tempfile.mkstemp(suffix='.rec.gz')
+        os.close(fd)
+    ch = session(opts, record_path=None if opts.recording else path)
+    start = time.time()
+    ch.login()
+    expected = run(ch, opts)
+    ch.logout()
+    print('recorded in %.3f s, %d bytes: %s' % (
+        time.time() - start, os.path.getsize(path), path))
+
+    results = {'sessions': 0, 'mismatches': 0, 'errors': 0, 'bytes': 0}
+    lock = threading.Lock()
+    pending = list(range(opts.sessions))
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                pending.pop()
+            ch = session(opts, replay_path=path, replay_speed=opts.speed)
+            ch.login()
+            outputs = run(ch, opts)
+            ch.logout()
+            with lock:
+                results['sessions'] += 1
+                results['mismatches'] += outputs != expected
+                results['errors'] += sum(
+                    1 for o in outputs if 'Command error' in o)
+                results['bytes'] += sum(len(o) for o in outputs)
+
+    threads = [threading.Thread(target=worker) for i in range(opts.workers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    print('%d sessions in %.3f s: %.1f sessions/s, %.1f commands/s, '
+          '%.1f MB/s, %d errors, %d mismatches' % (
+              results['sessions'], elapsed, results['sessions'] / elapsed,
+              results['sessions'] * len(COMMANDS) / elapsed,
+              results['bytes'] / elapsed / 1024 / 1024, results['errors'],
+              results['mismatches']))
+    if not opts.recording:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
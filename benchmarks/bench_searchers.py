@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of multi-pattern searching in pexpect_ng.
+
+searcher_re and searcher_string look for each of their patterns in turn.
+This compares them with the single scan alternatives: all the regular
+expressions merged into one alternation of named groups (the group name
+telling which pattern matched), and the plain strings compiled into an
+Aho-Corasick automaton or into an alternation of the escaped strings.
+
+Both the whole transcript at once and the transcript fed through a
+receive_buffer chunk by chunk, as in spawn.expect_loop(), are timed for a
+growing number of patterns. The patterns are the kind a login or a
+confirmation dialog waits for, the transcript is routing table output that
+contains none of them until the final cli prompt.
+
+Usage:
+
+    python benchmarks/bench_searchers.py [--size MB] [--chunk BYTES]
+"""
+
+import optparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cling import pexpect_ng as pexpect
+
+PROMPT = b'router1#'
+
+LINE = b'B    10.%d.%d.0/24 [20/0] via 192.0.2.1, 2w1d, GigabitEthernet0/1\r\n'
+
+PATTERNS = [
+    br'[#>\$%] ?$',
+    br'[Pp]assword: ?',
+    br'\(yes/no\)\?',
+    br'[Pp]ermission denied',
+    br'Connection refused',
+    br'[Uu]sername: ?',
+    br'Host key verification failed',
+    br'No route to host',
+    br'Connection timed out',
+    br'Could not resolve hostname',
+    br'% ?Invalid input',
+    br'-+ ?[Mm]ore ?-+',
+    br'\[confirm\]',
+    br'\[y/n\]',
+    br'Press any key to continue',
+    br'syntax error',
+]
+
+STRINGS = [
+    PROMPT,
+    b'Password: ',
+    b'(yes/no)?',
+    b'Permission denied',
+    b'Connection refused',
+    b'Username: ',
+    b'Host key verification failed',
+    b'No route to host',
+    b'Connection timed out',
+    b'Could not resolve hostname',
+    b'% Invalid input',
+    b'--More--',
+    b'[confirm]',
+    b'[y/n]',
+    b'Press any key to continue',
+    b'syntax error',
+]
+
+
+class merged_re(object):
+    """searcher_re alternative: one alternation of named groups"""
+
+    def __init__(self, patterns, lookback=None):
+        self.lookback = lookback
+        self.regex = re.compile(b'|'.join(
+            b'(?P<p%d>%s)' % (n, p.pattern) for n, p in enumerate(patterns)))
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        if self.lookback is None:
+            searchstart = 0
+        else:
+            searchstart = max(0, len(buffer) - freshlen - self.lookback)
+        match = self.regex.search(buffer, searchstart)
+        if match is None or match.start() == len(buffer):
+            return -1
+        self.start, self.end = match.span()
+        return int(match.lastgroup[1:])
+
+
+class merged_string(object):
+    """searcher_string alternative: one alternation of the escaped strings"""
+
+    def __init__(self, strings):
+        self.regex = re.compile(b'|'.join(re.escape(s) for s in strings))
+        self.indexes = {}
+        for n, s in reversed(list(enumerate(strings))):
+            self.indexes[s] = n
+        self.maxlen = max(len(s) for s in strings)
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        searchstart = max(0, len(buffer) - freshlen - self.maxlen)
+        match = self.regex.search(buffer, searchstart)
+        if match is None:
+            return -1
+        self.start, self.end = match.span()
+        return self.indexes[bytes(match.group())]
+
+
+class aho_corasick(object):
+    """searcher_string alternative: an Aho-Corasick automaton that keeps its
+    state between searches, so that every byte is stepped over only once"""
+
+    def __init__(self, strings):
+        goto, fail, out = [{}], [0], [[]]
+        for n, s in enumerate(strings):
+            state = 0
+            for c in bytearray(s):
+                if c not in goto[state]:
+                    goto.append({})
+                    fail.append(0)
+                    out.append([])
+                    goto[state][c] = len(goto) - 1
+                state = goto[state][c]
+            out[state].append((n, len(s)))
+        queue = list(goto[0].values())
+        for state in queue:
+            for c, child in goto[state].items():
+                queue.append(child)
+                f = fail[state]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                fail[child] = goto[f].get(c, 0)
+                out[child] = out[child] + out[fail[child]]
+        self.goto, self.fail, self.out = goto, fail, out
+        self.pos = 0
+        self.state = 0
+
+    def search(self, buffer, freshlen, searchwindowsize=None):
+        goto, fail, out = self.goto, self.fail, self.out
+        if self.pos != len(buffer) - freshlen:
+            self.pos, self.state = len(buffer) - freshlen, 0
+        state = self.state
+        for pos in range(self.pos, len(buffer)):
+            c = buffer[pos]
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]:
+                index, length = min(out[state])
+                self.start, self.end = pos + 1 - length, pos + 1
+                self.pos, self.state = 0, 0
+                return index
+        self.pos, self.state = len(buffer), state
+        return -1
+
+
+def transcript(size):
+    block = b''.join(LINE % (i % 256, i // 256 % 256) for i in range(4096))
+    return bytearray((block * (size // len(block) + 1))[:size] + PROMPT)
+
+
+def whole(data, searcher):
+    return searcher.search(data, len(data))
+
+
+def streamed(data, searcher, chunk):
+    incoming = pexpect.receive_buffer()
+    for i in range(0, len(data), chunk):
+        incoming.append(data[i:i + chunk])
+        index = incoming.search(searcher)
+        if index >= 0:
+            return index
+    return -1
+
+
+def timed(func, *args):
+    start = time.time()
+    index = func(*args)
+    return time.time() - start, index
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--size', type='int', default=4,
+                      help='transcript size in MB (default: 4)')
+    parser.add_option('--chunk', type='int', default=4096,
+                      help='chunk size of the streamed runs (default: 4096)')
+    opts, args = parser.parse_args()
+
+    data = transcript(opts.size * 1024 * 1024)
+
+    print('regular expressions, %d MB transcript, %d byte chunks' % (
+        opts.size, opts.chunk))
+    for count in (1, 3, 5, 8, 16):
+        patterns = [re.compile(p) for p in PATTERNS[:count]]
+        results = []
+        for searcher in (pexpect.searcher_re, merged_re):
+            t_whole, i_whole = timed(whole, data, searcher(patterns))
+            t_streamed, i_streamed = timed(
+                streamed, data, searcher(patterns, 4096), opts.chunk)
+            assert i_whole == i_streamed == 0
+            results.extend((t_whole, t_streamed))
+        print('  %2d patterns  one by one %7.3f s / %7.3f s   '
+              'merged %7.3f s / %7.3f s' % tuple([count] + results))
+
+    print('plain strings, %d MB transcript, %d byte chunks' % (
+        opts.size, opts.chunk))
+    for count in (1, 3, 5, 8, 16):
+        strings = STRINGS[:count]
+        results = []
+        for searcher in (pexpect.searcher_string, merged_string,
+                         aho_corasick):
+            t_whole, i_whole = timed(whole, data, searcher(strings))
+            t_streamed, i_streamed = timed(
+                streamed, data, searcher(strings), opts.chunk)
+            assert i_whole == i_streamed == 0
+            results.extend((t_whole, t_streamed))
+        print('  %2d strings  find() %7.3f s / %7.3f s   '
+              'merged %7.3f s / %7.3f s   '
+              'aho-corasick %7.3f s / %7.3f s' % tuple([count] + results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark of Cling sessions against fake devices.
+
+benchmarks/fake_device.py is spawned in place of ssh, playing each of the
+requested personalities, and Cling logs in, runs short commands and pulls a
+large output, with each of the requested read loop settings
+(pexpect_read_loop_timeout; "none" is the event driven default). Reported
+per personality and setting:
+
+    login       average time of login(), spawn to the end of the init
+                commands
+    command     per-command latency of "show version", average, p50 and
+                p99
+    throughput  MB/s of "show bytes --size"
+
+--latency and --bandwidth shape the fake device's answers like a network
+would. With --transport socket, the sessions connect to fake devices
+listening on loopback ports (fake_device.py --listen) through
+cling.transport.SocketTransport, in process, instead of spawning one.
+With --keep-paging, the fake devices keep paging their output after the
+init commands, and the pager prompts are answered by Cling page by page.
+Everything runs locally, no device nor sshd is needed.
+
+Usage:
+
+    python benchmarks/bench_sessions.py [--personalities ios,junos,...]
+        [--read-loop-timeouts none,0.01] [--logins N] [--commands N]
+        [--size MB] [--latency SECONDS] [--bandwidth MB] [--auto]
+        [--transport spawn|socket] [--keep-paging]
+"""
+
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cling
+import cling.transport
+
+FAKE_DEVICE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fake_device.py')
+
+# first loopback port of the fake devices of --transport socket
+BASE_PORT = 22220
+
+
+def fake_device_args(personality, opts):
+    args = ['--personality', personality, '--latency', str(opts.latency),
+            '--bandwidth', str(opts.bandwidth)]
+    if opts.keep_paging:
+        args.append('--keep-paging')
+    return args
+
+
+def session(personality, read_loop_timeout, opts):
+    transport = None
+    if opts.transport == 'socket':
+        transport = cling.transport.SocketTransport(
+            opts.ports[personality])
+    return cling.Cling(
+        hostname='127.0.0.1', username='admin', password='secret',
+        personality='auto' if opts.auto else personality,
+        ssh_path='%s %s' % (sys.executable, FAKE_DEVICE),
+        extra_ssh_params=' '.join(fake_device_args(personality, opts)),
+        pexpect_timeout=600, pexpect_read_loop_timeout=read_loop_timeout,
+        transport=transport)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def bench(personality, read_loop_timeout, opts):
+    logins = []
+    for i in range(opts.logins):
+        ch = session(personality, read_loop_timeout, opts)
+        start = time.time()
+        ch.login()
+        logins.append(time.time() - start)
+        if ch.personality != personality:
+            raise cling.Error('%s: logged in as %s' % (
+                personality, ch.personality))
+        if i < opts.logins - 1:
+            ch.logout()
+
+    latencies = []
+    for i in range(opts.commands):
+        start = time.time()
+        ch.run_command('show version')
+        latencies.append(time.time() - start)
+
+    size = opts.size * 1024 * 1024
+    start = time.time()
+    received = len(ch.run_command('show bytes %d' % size))
+    elapsed = time.time() - start
+    ch.logout()
+
+    return (sum(logins) / len(logins), sum(latencies) / len(latencies),
+            percentile(latencies, 50), percentile(latencies, 99),
+            received / elapsed / 1024 / 1024)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--personalities', default='ios,junos,eos,tmos',
+                      help='fake device personalities (default: '
+                           'ios,junos,eos,tmos)')
+    parser.add_option('--read-loop-timeouts', default='none,0.01',
+                      help='pexpect_read_loop_timeout values, "none" for '
+                           'the event driven loop (default: none,0.01)')
+    parser.add_option('--logins', type='int', default=5,
+                      help='logins per setting (default: 5)')
+    parser.add_option('--commands', type='int', default=100,
+                      help='short commands per setting (default: 100)')
+    parser.add_option('--size', type='int', default=10,
+                      help='size of the large output in MB (default: 10)')
+    parser.add_option('--latency', type='float', default=0,
+                      help='fake device round trip in seconds (default: 0)')
+    parser.add_option('--bandwidth', type='float', default=0,
+                      help='fake device bandwidth in MB/s (default: '
+                           'unlimited)')
+    parser.add_option('--auto', action='store_true',
+                      help="log in with personality='auto'")
+    parser.add_option('--keep-paging', action='store_true',
+                      help="fake devices keep paging after the init "
+                           "commands, answered page by page")
+    parser.add_option('--transport', default='spawn',
+                      choices=['spawn', 'socket'],
+                      help='spawn a fake device per session, or connect to '
+                           'fake devices listening on loopback (default: '
+                           'spawn)')
+    opts, args = parser.parse_args()
+
+    servers = []
+    opts.ports = {}
+    if opts.transport == 'socket':
+        for i, personality in enumerate(opts.personalities.split(',')):
+            opts.ports[personality] = BASE_PORT + i
+            servers.append(subprocess.Popen(
+                [sys.executable, FAKE_DEVICE, '--listen',
+                 str(BASE_PORT + i)] + fake_device_args(personality, opts)))
+        time.sleep(1)
+    try:
+        run(opts)
+    finally:
+        for server in servers:
+            server.kill()
+            server.wait()
+
+
+def run(opts):
+
+    print('%-10s %-10s %10s %10s %10s %10s %12s' % (
+        'personality', 'read loop', 'login ms', 'cmd avg ms', 'p50 ms',
+        'p99 ms', 'MB/s'))
+    for personality in opts.personalities.split(','):
+        for value in opts.read_loop_timeouts.split(','):
+            read_loop_timeout = None if value == 'none' else float(value)
+            login, avg, p50, p99, rate = bench(personality,
+                                               read_loop_timeout, opts)
+            print('%-11s %-10s %10.1f %10.2f %10.2f %10.2f %12.1f' % (
+                personality, value, login * 1e3, avg * 1e3, p50 * 1e3,
+                p99 * 1e3, rate))
+
+
+if __name__ == '__main__':
+    main()
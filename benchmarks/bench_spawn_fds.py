@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Spawn latency of pexpect_ng against RLIMIT_NOFILE.
+
+After fork, the child closes the file descriptors it inherited from the
+parent before exec'ing ssh. The strategies compared:
+
+    loop         os.close() on every descriptor from 3 to RLIMIT_NOFILE, in
+                 Python (what spawn used to do)
+    closerange   os.closerange() up to RLIMIT_NOFILE, the same in C (the
+                 fallback of pexpect_ng._close_fds())
+    proc         close only the descriptors listed in /proc/self/fd
+    close_range  close_range(2), one syscall (Linux 5.9+)
+    default      pexpect_ng._close_fds(): close_range, /proc/self/fd,
+                 closerange, the first that works
+
+For every limit of --limits (the soft limit, the hard limit is raised to it
+if lower, which needs root and is capped by fs.nr_open) and every strategy,
+/bin/true is spawned --spawns times and waited for. The parent holds a
+descriptor at the top of the range, and one spawn per setting lists the
+child's /proc/self/fd to check that it was closed.
+
+Usage:
+
+    python benchmarks/bench_spawn_fds.py [--limits 1024,65536,1048576]
+        [--spawns N] [--strategies loop,closerange,proc,close_range,default]
+"""
+
+import optparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cling import pexpect_ng as pexpect
+
+DEFAULT = pexpect._close_fds
+
+
+def close_loop(low):
+    for fd in range(low, resource.getrlimit(resource.RLIMIT_NOFILE)[0]):
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def close_closerange(low):
+    os.closerange(low, resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+
+
+def close_proc(low):
+    for fd in os.listdir('/proc/self/fd'):
+        if int(fd) >= low:
+            try:
+                os.close(int(fd))
+            except OSError:
+                pass
+
+
+def close_close_range(low):
+    if pexpect._libc is None or pexpect._libc.syscall(
+            pexpect._NR_close_range, low,
+            pexpect.ctypes.c_uint(0xffffffff), 0) != 0:
+        # the child can't report it, make the spawn fail visibly
+        os._exit(127)
+
+
+STRATEGIES = {
+    'loop': close_loop,
+    'closerange': close_closerange,
+    'proc': close_proc,
+    'close_range': close_close_range,
+    'default': DEFAULT,
+}
+
+
+def child_fds():
+    '''Returns the descriptors open in a spawned child'''
+
+    child = pexpect.spawn('/bin/ls /proc/self/fd')
+    child.expect(pexpect.EOF)
+    child.close()
+    return [int(fd) for fd in child.before.split()]
+
+
+def bench(spawns):
+    start = time.time()
+    for i in range(spawns):
+        child = pexpect.spawn('/bin/true')
+        child.fixeddelays = False
+        child.expect(pexpect.EOF)
+        child.close()
+    return (time.time() - start) / spawns
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--limits', default='1024,65536,1048576',
+                      help='RLIMIT_NOFILE values (default: '
+                           '1024,65536,1048576)')
+    parser.add_option('--spawns', type='int', default=20,
+                      help='spawns per setting (default: 20)')
+    parser.add_option('--strategies',
+                      default='loop,closerange,proc,close_range,default',
+                      help='descriptor closing strategies (default: all)')
+    opts, args = parser.parse_args()
+
+    print('%-10s %-12s %12s %8s' % ('limit', 'strategy', 'spawn ms',
+                                     'leaked'))
+    for limit in [int(l) for l in opts.limits.split(',')]:
+        hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+        if hard != resource.RLIM_INFINITY:
+            hard = max(hard, limit)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        except (ValueError, OSError) as e:
+            print('%-10d cannot set the limit: %s' % (limit, e))
+            continue
+        high_fd = limit - 1
+        os.dup2(0, high_fd)
+        for name in opts.strategies.split(','):
+            pexpect._close_fds = STRATEGIES[name]
+            try:
+                leaked = high_fd in child_fds()
+                elapsed = bench(opts.spawns)
+            finally:
+                pexpect._close_fds = DEFAULT
+            print('%-10d %-12s %12.2f %8s' % (
+                limit, name, elapsed * 1e3, 'yes' if leaked else 'no'))
+        os.close(high_fd)
+
+
+if __name__ == '__main__':
+    main()
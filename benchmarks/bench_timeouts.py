@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive timeouts of cling.timeouts against a static pexpect_timeout.
+
+Sessions with a TimeoutModel run "show version" and a short "show slow"
+(lines a few hundredths of a second apart, as a traceroute) against
+benchmarks/fake_device.py until the model has learned the host, then:
+
+    learned     the timeout and stall timeout of each command class
+    long        a "show slow" several times longer than the learned ones,
+                which outlives its timeout and completes as output keeps
+                coming within the stall timeout
+    dead        time to give up on a device that stops answering after
+                login (fake_device.py --hang-after), with the learned
+                timeouts and with --static-timeout
+
+The model is saved to a temporary cache file by every logout and read
+back by the next session. Everything runs locally, no device nor sshd is
+needed.
+
+Usage:
+
+    python benchmarks/bench_timeouts.py [--runs N] [--latency SECONDS]
+        [--static-timeout SECONDS]
+"""
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cling
+from cling.cli import PERSONALITIES
+from cling.timeouts import LOGIN, TimeoutModel, command_class
+
+FAKE_DEVICE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fake_device.py')
+
+PERSONALITY = 'ios'
+
+COMMANDS = ['show version', 'show slow 5 0.02']
+
+LONG_COMMAND = 'show slow 150 0.02'
+
+
+def session(opts, timeouts, pexpect_timeout, hang_after=None):
+    args = ['--personality', PERSONALITY, '--latency', str(opts.latency)]
+    if hang_after is not None:
+        args += ['--hang-after', str(hang_after)]
+    return cling.Cling(
+        hostname='127.0.0.1', username='admin', password='secret',
+        personality=PERSONALITY,
+        ssh_path='%s %s' % (sys.executable, FAKE_DEVICE),
+        extra_ssh_params=' '.join(args),
+        pexpect_timeout=pexpect_timeout, max_login_attempts=1,
+        timeouts=timeouts)
+
+
+def time_to_give_up(opts, timeouts, pexpect_timeout):
+    hang_after = len(PERSONALITIES[PERSONALITY]['init'])
+    ch = session(opts, timeouts, pexpect_timeout, hang_after)
+    ch.login()
+    start = time.time()
+    try:
+        ch.run_command('show version')
+    except cling.Error:
+        pass
+    elapsed = time.time() - start
+    ch.logout()
+    return elapsed
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=10,
+                      help='learning sessions (default: 10)')
+    parser.add_option('--latency', type='float', default=0.005,
+                      help='fake device latency in seconds (default: 0.005)')
+    parser.add_option('--static-timeout', type='float', default=10,
+                      help='static pexpect_timeout (default: 10)')
+    opts, args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'timeouts.json')
+    try:
+        for run in range(opts.runs):
+            ch = session(opts, TimeoutModel(path), opts.static_timeout)
+            ch.login()
+            for command in COMMANDS:
+                ch.run_command(command)
+            ch.logout()
+
+        model = TimeoutModel(path)
+        print('learned after %d sessions' % opts.runs)
+        for klass in [LOGIN] + [command_class(c) for c in COMMANDS]:
+            timeout, stall = model.timeouts('127.0.0.1', klass,
+                                            opts.static_timeout)
+            stats = model.stats('127.0.0.1', klass)
+            if stats is None:
+                print('  %-14s not learned yet' % klass)
+                continue
+            print('  %-14s p50 %6.3f s  timeout %6.2f s  stall %6.2f s' % (
+                klass, stats['duration_p50'], timeout, stall or 0))
+
+        ch = session(opts, model, opts.static_timeout)
+        ch.login()
+        timeout = model.timeouts('127.0.0.1', command_class(LONG_COMMAND),
+                                 opts.static_timeout)[0]
+        start = time.time()
+        try:
+            ch.run_command(LONG_COMMAND)
+            result = 'completed'
+        except cling.Error:
+            result = 'timed out'
+        print('long "%s": %s in %.2f s, timeout %.2f s' % (
+            LONG_COMMAND, result, time.time() - start, timeout))
+        ch.logout()
+
+        print('dead device, time to give up')
+        print('  adaptive       %6.2f s' % time_to_give_up(
+            opts, TimeoutModel(path), opts.static_timeout))
+        print('  static         %6.2f s' % time_to_give_up(
+            opts, None, opts.static_timeout))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+"""
+Fake network device, spawned in place of ssh.
+
+It takes the ssh command line Cling builds (the -o/-i options and
+user@host are accepted, the rest are its own options, passed with
+Cling(extra_ssh_params=...)) and plays a device of the given personality
+on its tty: password prompt, banner, cli prompt, echo of the commands with
+\\r\\n line ends, paging until the personality's init commands have been
+run, and the personality's error message for unknown commands.
+
+    ch = cling.Cling(hostname='router1', username='admin', password='x',
+                     personality='ios',
+                     ssh_path='%s benchmarks/fake_device.py' % sys.executable,
+                     extra_ssh_params='--personality ios --latency 0.005')
+
+With --listen, it is a loopback server instead, playing a device for every
+connection to the port, in a thread, for Cling sessions without a process
+of their own:
+
+    python benchmarks/fake_device.py --listen 2222 --personality ios
+
+    ch = cling.Cling(hostname='127.0.0.1', username='admin', password='x',
+                     personality='ios',
+                     transport=cling.transport.SocketTransport(2222))
+
+Commands:
+
+    show version        version text of the personality, also answered
+                        to the other probes of personality='auto': show
+                        system info and cat /etc/os-release
+    show lines N        N lines of routing table
+    show bytes N        about N bytes of routing table
+    show slow N S       N lines of routing table, S seconds apart, as a
+                        traceroute
+    <init command>      any init command of the personality, turns paging off
+    exit, quit, logout  ends the session
+    anything else       error message of the personality
+
+Options:
+
+    --personality P     personality to play (default: ios)
+    --password S        password to accept (default: any)
+    --latency S         seconds before every answer, a network round trip
+    --bandwidth MB      output rate limit in MB/s (default: unlimited)
+    --page-lines N      lines per page while paging is on (default: 24)
+    --keep-paging       the init commands don't turn paging off, as on a
+                        device that rejects them
+    --hang-after N      stops answering after N commands, as a device that
+                        has died, the init commands count
+    --listen PORT       serve connections to PORT on 127.0.0.1
+"""
+
+import optparse
+import os
+import socket
+import sys
+import termios
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cling.cli import PERSONALITIES
+
+LINE = '*> 10.%d.%d.0/24      192.0.2.1       0    100      0 65000 i\r\n'
+
+IOS_ERROR = "          ^\r\n% Invalid input detected at '^' marker.\r\n"
+
+# personality: prompt, banner, show version, pager prompt, error message
+PROFILES = {
+    'generic': ('{host}$ ', '', 'Linux {host} 4.19.0', None,
+                '-bash: {command}: command not found\r\n'),
+    'ios': ('{host}#', '',
+            'Cisco IOS Software, C3750E Software (C3750E-UNIVERSALK9-M), '
+            'Version 15.0(2)SE5, RELEASE SOFTWARE (fc1)',
+            ' --More-- ', IOS_ERROR),
+    'iosxe': ('{host}#', '',
+              'Cisco IOS XE Software, Version 16.09.03\r\n'
+              'Cisco IOS Software [Fuji], ISR Software '
+              '(X86_64_LINUX_IOSD-UNIVERSALK9-M), Version 16.9.3',
+              ' --More-- ', IOS_ERROR),
+    'iosxr': ('RP/0/RSP0/CPU0:{host}#', '',
+              'Cisco IOS XR Software, Version 6.1.4', ' --More-- ',
+              "% Invalid input detected at '^' marker.\r\n"),
+    'eos': ('{host}#', '', 'Arista DCS-7050SX-64\r\nSoftware image version: '
+            '4.20.1F', ' --More-- ', '% Invalid input\r\n'),
+    'ironware': ('SSH@{host}#', '', 'Brocade NetIron MLX, IronWare '
+                 'Version V5.8.0T163', '--More--, next page: Space, next '
+                 'line: Return key, quit: Control-c', 'Invalid input -> '
+                 '{command}\r\n'),
+    'junos': ('{user}@{host}> ', '--- JUNOS 15.1R6.7 built 2017-06-26\r\n',
+              'Model: mx480\r\nJunos: 15.1R6.7', '---(more)---',
+              '                ^\r\nsyntax error, expecting <command>.\r\n'),
+    'panos': ('{user}@{host}> ', '', 'model: PA-5050\r\nsw-version: 8.1.3',
+              'lines 1-24 ', 'Invalid syntax.\r\n'),
+    'tmos': ('{user}@({host})(cfg-sync Standalone)(Active)(/Common)(tmos)# ',
+             '', 'Sys::Version\r\nMain Package\r\n  Product  BIG-IP\r\n  '
+             'Version  13.1.1', '---(less 24%)---',
+             'Syntax Error: "{command}" unexpected argument\r\n'),
+    'cumulus': ('{user}@{host}:~$ ', 'Welcome to Cumulus (R) Linux (R)\r\n',
+                'NAME="Cumulus Linux"', None,
+                '-bash: {command}: command not found\r\n'),
+}
+
+
+class Device(object):
+
+    def __init__(self, opts, user, host, fd_in=0, fd_out=1):
+        self.opts = opts
+        self.fd_in = fd_in
+        self.fd_out = fd_out
+        self.personality = opts.personality
+        prompt, banner, version, pager, error = PROFILES.get(
+            self.personality, PROFILES['ios'])
+        self.prompt = prompt.format(user=user, host=host)
+        self.banner = banner
+        self.version = version
+        self.pager = pager
+        self.error = error
+        traits = PERSONALITIES.get(self.personality, {})
+        self.init_commands = set(traits.get('init', []))
+        self.paging = pager is not None
+        # read ahead of the current line, a socket has no line discipline
+        self.pending = b''
+
+    def write(self, s):
+        data = s.encode('latin-1') if not isinstance(s, bytes) else s
+        while data:
+            n = os.write(self.fd_out, data)
+            data = data[n:]
+
+    def write_output(self, s):
+        '''Writes s at the configured bandwidth'''
+
+        if not self.opts.bandwidth:
+            self.write(s)
+            return
+        rate = self.opts.bandwidth * 1024 * 1024
+        for i in range(0, len(s), 4096):
+            chunk = s[i:i + 4096]
+            self.write(chunk)
+            time.sleep(len(chunk) / rate)
+
+    def readline(self):
+        while b'\n' not in self.pending:
+            c = os.read(self.fd_in, 1024)
+            if not c:
+                return None
+            self.pending += c
+        line, self.pending = self.pending.split(b'\n', 1)
+        return (line + b'\n').decode('latin-1')
+
+    def readchar(self):
+        if self.pending:
+            c, self.pending = self.pending[:1], self.pending[1:]
+            return c.decode('latin-1')
+        if not os.isatty(self.fd_in):
+            return os.read(self.fd_in, 1).decode('latin-1')
+        attr = termios.tcgetattr(self.fd_in)
+        raw = list(attr)
+        raw[3] &= ~termios.ICANON
+        raw[6] = list(raw[6])
+        raw[6][termios.VMIN] = 1
+        raw[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd_in, termios.TCSANOW, raw)
+        try:
+            return os.read(self.fd_in, 1).decode('latin-1')
+        finally:
+            termios.tcsetattr(self.fd_in, termios.TCSANOW, attr)
+
+    def page(self, lines):
+        '''Writes the output lines, a page at a time while paging is on'''
+
+        page_lines = self.opts.page_lines
+        if not self.paging or len(lines) <= page_lines:
+            self.write_output(''.join(lines))
+            return
+        pos = 0
+        while pos < len(lines):
+            self.write_output(''.join(lines[pos:pos + page_lines]))
+            pos += page_lines
+            if pos >= len(lines):
+                break
+            self.write(self.pager)
+            c = self.readchar()
+            self.write('\r' + ' ' * len(self.pager) + '\r')
+            if c in ('q', 'Q', '\x03'):
+                break
+            if c in ('\r', '\n'):
+                page_lines = 1
+            else:
+                page_lines = self.opts.page_lines
+
+    def login(self):
+        # the device echoes the commands itself and writes \r\n line ends
+        if os.isatty(self.fd_in):
+            attr = termios.tcgetattr(self.fd_in)
+            attr[1] &= ~termios.ONLCR
+            attr[3] &= ~termios.ECHO
+            termios.tcsetattr(self.fd_in, termios.TCSANOW, attr)
+        for attempt in range(3):
+            self.write('Password: ')
+            password = self.readline()
+            if password is None:
+                return False
+            self.write('\r\n')
+            if self.opts.password is None or \
+                    password.strip() == self.opts.password:
+                return True
+            self.write('Permission denied, please try again.\r\n')
+        self.write('Permission denied (publickey,password).\r\n')
+        return False
+
+    def answer(self, command):
+        if command.startswith('show lines '):
+            count = int(command.split()[2])
+            self.page([LINE % (i % 256, i // 256 % 256)
+                       for i in range(count)])
+        elif command.startswith('show bytes '):
+            count = int(command.split()[2]) // len(LINE % (0, 0))
+            self.page([LINE % (i % 256, i // 256 % 256)
+                       for i in range(count)])
+        elif command.startswith('show slow '):
+            count, delay = command.split()[2:4]
+            for i in range(int(count)):
+                time.sleep(float(delay))
+                self.write(LINE % (i % 256, i // 256 % 256))
+        elif command in ('show version', 'show system info',
+                         'cat /etc/os-release'):
+            self.page([line + '\r\n' for line in self.version.split('\r\n')])
+        elif command in self.init_commands:
+            self.paging = self.paging and self.opts.keep_paging
+        elif command:
+            self.write(self.error.format(command=command))
+
+    def run(self):
+        if not self.login():
+            return 255
+        self.write(self.banner + '\r\n' + self.prompt)
+        commands = 0
+        while True:
+            line = self.readline()
+            if line is None:
+                return 0
+            commands += 1
+            if self.opts.hang_after is not None and \
+                    commands > self.opts.hang_after:
+                continue
+            command = line.strip()
+            if self.opts.latency:
+                time.sleep(self.opts.latency)
+            self.write(command + '\r\n')
+            if command in ('exit', 'quit', 'logout'):
+                return 0
+            self.answer(command)
+            self.write(self.prompt)
+
+
+def serve(opts, user, host):
+    '''Plays a device for every connection to opts.listen'''
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', opts.listen))
+    server.listen(128)
+
+    def play(conn):
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            Device(opts, user, host, conn.fileno(), conn.fileno()).run()
+        except (OSError, socket.error):
+            pass
+        finally:
+            conn.close()
+
+    while True:
+        conn, address = server.accept()
+        thread = threading.Thread(target=play, args=(conn,))
+        thread.daemon = True
+        thread.start()
+
+
+def main():
+    parser = optparse.OptionParser()
+    # the ssh options Cling passes
+    parser.add_option('-o', action='append', default=[])
+    parser.add_option('-i')
+    parser.add_option('--personality', default='ios')
+    parser.add_option('--password')
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--bandwidth', type='float', default=0)
+    parser.add_option('--page-lines', type='int', default=24)
+    parser.add_option('--keep-paging', action='store_true')
+    parser.add_option('--hang-after', type='int')
+    parser.add_option('--listen', type='int')
+    opts, args = parser.parse_args()
+
+    user, host = 'admin', 'router1'
+    for arg in args:
+        if '@' in arg:
+            user, host = arg.split('@', 1)
+    if opts.listen:
+        serve(opts, user, host)
+    sys.exit(Device(opts, user, host).run())
+
+
+if __name__ == '__main__':
+    main()
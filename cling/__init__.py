@@ -2,7 +2,7 @@
 
 __version__ = '2.3.7'
 
-__all__ = ['Cling', 'Error', 'Reactor']
+__all__ = ['Cling', 'Discovery', 'Error', 'Reactor', 'SessionPool']
 
 
 class Error(Exception):
@@ -11,5 +11,7 @@ class Error(Exception):
     pass
 
 
-from cli import Cling
-from reactor import Reactor
+from .cli import Cling
+from .reactor import Reactor
+from .pool import SessionPool
+from .discovery import Discovery
@@ -0,0 +1,643 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio flavour of Cling.
+
+AsyncCling drives the same ssh command line, PERSONALITIES, prompt and
+error handlers as Cling, but instead of blocking in pexpect_ng.spawn the
+ssh process' pty is registered with an asyncio event loop. login(),
+run_command() and logout() return futures, so a single event loop can drive
+many sessions at once:
+
+    loop = asyncio.get_event_loop()
+    sessions = [cling.aio.AsyncCling(hostname=h, personality='ios', ...)
+                for h in hosts]
+    loop.run_until_complete(asyncio.gather(*[s.login() for s in sessions]))
+
+asyncio is used on Python 3, trollius (the asyncio backport) on Python 2.
+"""
+
+import errno
+import fcntl
+import functools
+import logging
+import os
+import pty
+import re
+import signal
+import struct
+import subprocess
+import termios
+import time
+
+from . import Error
+from . import log
+from . import pexpect_ng as pexpect
+from .cli import Cling, PAGER_WINDOW, PROMPT_LOOKBACK
+from .timeouts import LOGIN
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+# attempt to load asyncio or its Python 2 backport
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+__all__ = ['AsyncCling', 'AsyncSpawn']
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(NullHandler())
+
+
+class _Return(Exception):
+    '''Raised by a _coroutine generator to return a value'''
+
+    def __init__(self, value=None):
+        super(_Return, self).__init__(value)
+        self.value = value
+
+
+def _coroutine(method):
+    '''Turns a generator method that yields futures into a method returning
+    a future. The generator is resumed with each future's result (or has the
+    future's exception thrown into it) and finishes by raising _Return.
+
+    This keeps the code free of "yield from"/"await", which Python 2 does
+    not have, while the returned futures can be awaited on Python 3.'''
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        future = asyncio.Future(loop=self.loop)
+        gen = method(self, *args, **kwargs)
+
+        def step(value=None, exc=None):
+            try:
+                if exc is not None:
+                    waiting_on = gen.throw(exc)
+                else:
+                    waiting_on = gen.send(value)
+            except _Return as r:
+                future.set_result(r.value)
+            except StopIteration:
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                try:
+                    waiting_on.add_done_callback(wakeup)
+                except AttributeError:
+                    gen.close()
+                    future.set_exception(TypeError(
+                        '%s() yielded %r, not a future' % (
+                            method.__name__, waiting_on)))
+
+        def wakeup(waited):
+            try:
+                value = waited.result()
+            except Exception as e:
+                step(exc=e)
+            else:
+                step(value)
+
+        step()
+        return future
+    return wrapper
+
+
+def _sleep(loop, seconds):
+    '''Returns a future resolved after seconds. Unlike asyncio.sleep() it
+    is a future on every asyncio version, for _coroutine generators.'''
+
+    future = asyncio.Future(loop=loop)
+
+    def wakeup():
+        if not future.done():
+            future.set_result(None)
+
+    loop.call_later(seconds, wakeup)
+    return future
+
+
+def _make_controlling_tty():
+    '''Runs in the child between fork and exec, makes the pty slave (already
+    on stdin) the controlling terminal so that ssh can prompt for a password'''
+
+    os.setsid()
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+
+class AsyncSpawn(pexpect._codec_mixin):
+    '''Spawns a command on a pty and exposes the part of the pexpect_ng.spawn
+    contract used by Cling (send(), sendline(), expect(), close(), before,
+    after, buffer, timeout and searchwindowsize) on top of an event loop.
+
+    send() and sendline() return a future resolved once the data has been
+    written to the pty, what the pty can't take yet is written as it drains.
+    expect() returns a future resolved with 0 when the pattern is matched,
+    or failed with pexpect_ng.TIMEOUT or pexpect_ng.EOF. encoding and
+    codec_errors, and the stall_timeout and read_gap attributes, are those
+    of pexpect_ng.spawn.'''
+
+    def __init__(self, command, loop, timeout=30, maxread=2000,
+                 searchwindowsize=None, settle_timeout=0.01, encoding=None,
+                 codec_errors='strict'):
+        self.loop = loop
+        self.timeout = timeout
+        self.maxread = maxread
+        self.searchwindowsize = searchwindowsize
+        self.settle_timeout = settle_timeout
+        self.searchlookback = None
+        self.stall_timeout = None
+        self.read_gap = 0
+        self._set_encoding(encoding, codec_errors)
+        self.before = b''
+        self.match = None
+        self.flag_eof = False
+        self.closed = False
+
+        # data received and not matched yet
+        self._incoming = pexpect.receive_buffer()
+
+        # data sent and not written yet, and the future resolved once it is
+        self._outgoing = b''
+        self._drained = None
+
+        # expectation in progress, see expect()
+        self._future = None
+        self._searcher = None
+        self._searchwindowsize = searchwindowsize
+        self._last_read = None
+        self._timeout_handle = None
+        self._settle_handle = None
+
+        args = pexpect.split_command_line(command)
+        path = pexpect.which(args[0])
+        if path is None:
+            raise pexpect.ExceptionPexpect(
+                'The command was not found or was not executable: %s.'
+                % args[0])
+
+        master_fd, slave_fd = pty.openpty()
+        fcntl.ioctl(slave_fd, termios.TIOCSWINSZ,
+                    struct.pack('HHHH', 24, 80, 0, 0))
+        try:
+            self.proc = subprocess.Popen(
+                [path] + args[1:],
+                stdin=slave_fd, stdout=slave_fd, stderr=slave_fd,
+                preexec_fn=_make_controlling_tty, close_fds=True)
+        finally:
+            os.close(slave_fd)
+        self.pid = self.proc.pid
+        self.child_fd = master_fd
+
+        flags = fcntl.fcntl(master_fd, fcntl.F_GETFL)
+        fcntl.fcntl(master_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.loop.add_reader(master_fd, self._read_ready)
+
+    @property
+    def buffer(self):
+        return self._decode(self._incoming.getvalue())
+
+    def send(self, s):
+        '''Writes string to the child, returns a future resolved once it and
+        whatever was sent before it have been written'''
+
+        if self.closed or self.flag_eof:
+            raise pexpect.EOF('End Of File (EOF) in send().')
+        if self._drained is not None:
+            self._outgoing += self._encode(s)
+            return self._drained
+        drained = self._drained = asyncio.Future(loop=self.loop)
+        self._outgoing = self._encode(s)
+        self._write_ready()
+        if not drained.done():
+            # the pty is full, write the rest as it drains
+            self.loop.add_writer(self.child_fd, self._write_ready)
+        return drained
+
+    def sendline(self, s=''):
+        return self.send(self._encode(s) + pexpect._LINESEP)
+
+    def expect(self, pattern, timeout=-1, searchwindowsize=-1):
+        '''Waits for the compiled regular expression 'pattern' to be matched
+        in the input stream, returns a future'''
+
+        if self._future is not None:
+            raise pexpect.ExceptionPexpect('expect() already in progress')
+        if timeout == -1:
+            timeout = self.timeout
+        if searchwindowsize == -1:
+            searchwindowsize = self.searchwindowsize
+        self._searchwindowsize = searchwindowsize
+
+        self._future = asyncio.Future(loop=self.loop)
+        self._searcher = pexpect.searcher_re([self._bytes_pattern(pattern)],
+                                             self.searchlookback)
+        self._last_read = time.time()
+        if timeout is not None:
+            self._timeout_handle = self.loop.call_later(timeout, self._expire)
+        future = self._future
+        self._check()
+        return future
+
+    def close(self):
+        '''Closes the pty and terminates the child. Returns a future resolved
+        with the child's return code once it has been reaped.'''
+
+        if not self.closed:
+            self.closed = True
+            self._drain(pexpect.EOF('End Of File (EOF), closed.'))
+            self.loop.remove_reader(self.child_fd)
+            os.close(self.child_fd)
+            self.child_fd = -1
+            self._finish(pexpect.EOF('End Of File (EOF), closed.'))
+            self._exited = asyncio.Future(loop=self.loop)
+            if self.proc.poll() is None:
+                try:
+                    self.proc.send_signal(signal.SIGHUP)
+                except OSError:
+                    pass
+            self._reap(time.time() + 1)
+        return self._exited
+
+    def _reap(self, kill_time):
+        '''Polls for the child's exit without blocking the loop, sends
+        SIGKILL if it is still around after kill_time'''
+
+        if self.proc.poll() is not None:
+            self._exited.set_result(self.proc.returncode)
+            return
+        if time.time() > kill_time:
+            try:
+                self.proc.kill()
+            except OSError:
+                pass
+        self.loop.call_later(0.01, self._reap, kill_time)
+
+    def _expire(self):
+        '''Fails the expectation in progress with TIMEOUT, unless data came
+        within stall_timeout seconds'''
+
+        if self.stall_timeout is not None:
+            wait = self._last_read + self.stall_timeout - time.time()
+            if wait > 0:
+                self._timeout_handle = self.loop.call_later(wait, self._expire)
+                return
+        self._finish(pexpect.TIMEOUT('Timeout exceeded in expect().'))
+
+    def _write_ready(self):
+        '''Writes as much of the data sent as the pty takes, resolves the
+        send() future once all of it is written'''
+
+        try:
+            while self._outgoing:
+                n = os.write(self.child_fd, self._outgoing)
+                self._outgoing = self._outgoing[n:]
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            self._drain(pexpect.EOF('End Of File (EOF) in send().'))
+            return
+        self._drain()
+
+    def _drain(self, exc=None):
+        '''Resolves the send() future, if any'''
+
+        future = self._drained
+        if future is None:
+            return
+        if self.child_fd >= 0:
+            self.loop.remove_writer(self.child_fd)
+        self._drained = None
+        self._outgoing = b''
+        if exc is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exc)
+
+    def _read_ready(self):
+        try:
+            s = os.read(self.child_fd, self.maxread)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            s = b''  # Linux reports EIO once the child has gone
+        if not s:
+            self.flag_eof = True
+            self.loop.remove_reader(self.child_fd)
+            self._check()
+            self._finish(pexpect.EOF('End Of File (EOF) in read.'))
+            return
+
+        self._incoming.append(s)
+        if self._future is None:
+            return
+        now = time.time()
+        if now - self._last_read > self.read_gap:
+            self.read_gap = now - self._last_read
+        self._last_read = now
+        # only search once the child has been quiet for settle_timeout
+        if self._settle_handle is not None:
+            self._settle_handle.cancel()
+        if self.settle_timeout:
+            self._settle_handle = self.loop.call_later(
+                self.settle_timeout, self._check)
+        else:
+            self._check()
+
+    def _check(self):
+        self._settle_handle = None
+        if self._future is None:
+            return
+
+        searcher = self._searcher
+        if self._incoming.search(searcher, self._searchwindowsize) < 0:
+            if self.flag_eof:
+                self._finish(pexpect.EOF('End Of File (EOF) in read.'))
+            return
+
+        data = self._incoming.getvalue()
+        self.before = data[:searcher.start]
+        self.after = data[searcher.start:searcher.end]
+        self.match = searcher.match.re.match(data, searcher.start)
+        self._incoming = pexpect.receive_buffer(data[searcher.end:])
+        self._finish()
+
+    def _finish(self, exc=None):
+        '''Resolves the expectation in progress, if any'''
+
+        future = self._future
+        if future is None:
+            return
+        for handle in (self._timeout_handle, self._settle_handle):
+            if handle is not None:
+                handle.cancel()
+        self._future = self._searcher = None
+        self._timeout_handle = self._settle_handle = None
+        if exc is None:
+            future.set_result(0)
+        else:
+            self.before = self._incoming.getvalue()
+            self.after = exc.__class__
+            self.match = None
+            future.set_exception(exc)
+
+
+class AsyncCling(Cling):
+    '''Cling session driven by an event loop. Takes the same arguments as
+    Cling plus the event loop to use, login(), run_command() and logout()
+    return futures.'''
+
+    def __init__(self, *args, **kwargs):
+        loop = kwargs.pop('loop', None)
+        super(AsyncCling, self).__init__(*args, **kwargs)
+        if asyncio is None:
+            raise Error('%s: Failed to load asyncio' % self.hostname)
+        self.loop = loop or asyncio.get_event_loop()
+
+    def _spawn(self, command):
+        '''Spawns the shell command and returns AsyncSpawn child object'''
+        LOG.debug('%s: spawning "%s"' % (self.hostname, command))
+        child = AsyncSpawn(
+            command,
+            self.loop,
+            maxread=self.pexpect_maxread,
+            timeout=self.pexpect_timeout,
+            settle_timeout=self.pexpect_settle_timeout,
+            encoding=self.encoding,
+            codec_errors=self.codec_errors
+        )
+        child.searchlookback = PROMPT_LOOKBACK
+        return child
+
+    @_coroutine
+    def send(self, s='', hide_text=False):
+        '''Sends string to the child as Cling.send() does, the future is
+        resolved once it has been written'''
+
+        if hide_text:
+            log.payload(LOG, self.hostname, 'Sending', '***hidden***')
+        else:
+            log.payload(LOG, self.hostname, 'Sending', s.rstrip())
+
+        try:
+            yield self.child.send(s)
+        except pexpect.EOF:
+            raise Error('%s: child terminated [%s]' % (
+                self.hostname, self.child.before.rstrip()))
+
+    @_coroutine
+    def send_line(self, s='', hide_text=False):
+        '''Sends string + lineseparator to the child as Cling.send_line()
+        does, the future is resolved once it has been written'''
+
+        if hide_text:
+            log.payload(LOG, self.hostname, 'Sending', '***hidden***')
+        else:
+            log.payload(LOG, self.hostname, 'Sending', s)
+
+        try:
+            yield self.child.sendline(s)
+        except pexpect.EOF:
+            raise Error('%s: child terminated [%s]' % (
+                self.hostname, self.child.before.rstrip()))
+
+    @_coroutine
+    def _expect(self, pattern):
+        '''Waits for the pattern to be matched in the input stream
+        If no match has occured raises "timeout pattern matching" error
+        If child process dies raises "child terminated" error'''
+        LOG.debug('%s: expecting %s', self.hostname, pattern.pattern)
+        try:
+            if self.pager is None:
+                yield self.child.expect(pattern)
+            else:
+                yield self._expect_paged(pattern)
+        except pexpect.TIMEOUT:
+            raise Error(
+                '%s: timeout pattern matching, search buffer was "%s"' % (
+                    self.hostname, self.child.before)
+            )
+        except pexpect.EOF:
+            raise Error('%s: child terminated "%s"' % (
+                self.hostname, self.child.before.rstrip()))
+        log.payload(LOG, self.hostname, 'Before', self.child.before)
+        log.payload(LOG, self.hostname, 'After', self.child.after)
+
+    @_coroutine
+    def _expect_paged(self, pattern):
+        '''Waits for the pattern, answering the pager prompts received
+        before it, see Cling._expect_paged()'''
+
+        child = self.child
+        searchwindowsize = child.searchwindowsize
+        if searchwindowsize is not None:
+            searchwindowsize = max(searchwindowsize, PAGER_WINDOW)
+        either = re.compile('%s|%s' % (pattern.pattern, self.pager.pattern),
+                            pattern.flags | self.pager.flags)
+        pages = []
+        while True:
+            yield child.expect(either, searchwindowsize=searchwindowsize)
+            pages.append(self._clean_page(child.before, bool(pages)))
+            if not self.pager.search(child.after):
+                break
+            LOG.debug('%s: answering the pager', self.hostname)
+            yield self.send(self.pager_answer)
+        if len(pages) > 1:
+            child.before = ''.join(pages)
+
+    @_coroutine
+    def login(self):
+        for attempt in range(0, self.max_login_attempts):
+            try:
+                LOG.debug('%s: Attempt %s: Login to %s...' %
+                          (self.hostname, attempt, self.hostname))
+                yield self._dologin()
+                LOG.debug('%s: Done logging-in to %s' % (
+                    self.hostname, self.hostname))
+                return
+            except Error as e:
+                if self.child is not None:
+                    self.child.close()
+                if attempt >= self.max_login_attempts - 1:
+                    LOG.debug(
+                        '%s: All connection attempts to %s failed.' % (
+                            self.hostname, self.hostname))
+                    raise Error(str(e))
+                LOG.debug(
+                    '%s: connection to %s failed, %i attempt(s) left' % (
+                        self.hostname,
+                        self.hostname,
+                        self.max_login_attempts - 1 - attempt))
+                yield _sleep(self.loop, self.failed_login_retry_pause)
+
+    @_coroutine
+    def _dologin(self):
+        '''Spawns ssh, logins to the host and runs the intialisation
+        commands'''
+
+        if self.auto_personality:
+            self._set_personality('generic')
+
+        if self.control_sockets is not None:
+            # "ssh -O check" may take control_timeout seconds, off the loop
+            preauthenticated = yield self.loop.run_in_executor(
+                None, self._preauthenticated)
+        else:
+            preauthenticated = self._preauthenticated()
+        self.child = self._spawn(self._ssh_command())
+        start = self._adapt_timeouts([LOGIN])
+        login_text = ''
+
+        # if pub_key_auth is True, then we ignore the password prompt
+        if not self.pub_key_auth and not preauthenticated:
+            try:
+                yield self._expect(re.compile(r'password: ', re.I))
+            except Error as e:
+                raise Error(
+                    '%s: connection failed (%s)' % (self.hostname, e))
+            login_text = self.child.before
+            yield self.send_line(self.password, hide_text=True)
+
+        try:
+            yield self._expect(self.prompt)
+        except Error as e:
+            raise Error('%s: login failed (%s)' % (self.hostname, e))
+        login_text += self.child.before + self.child.after
+        self._learn_timeouts(LOGIN, start, len(login_text))
+
+        # personality auto discovery, as in Cling._dologin()
+        if self.auto_personality:
+            personality = self._match_fingerprint(login_text)
+            if personality is None:
+                yield self.send_line(self._probe_command(login_text))
+                yield self._expect(self._probe_prompt())
+                out = self.child.before
+                if not self.prompt.search(self.child.after):
+                    yield self.send('q')
+                    yield self._expect(self.prompt)
+                    out += self.child.before
+                personality = self._match_fingerprint(login_text + out)
+            self._apply_auto_personality(personality)
+
+        # Set search window size - how many chars to look back for a
+        # matching prompt
+        self.child.searchwindowsize = self.pexpect_searchwindowsize
+
+        # run the init commands
+        for s in self.init_commands:
+            yield self.run_command(s)
+
+    @_coroutine
+    def run_command(self, command, force_execute=False):
+        '''Sends a command + newline to child, waits for cli prompt to be
+        matched and returns output buffer minus the echoed command and cli
+        prompt. Magic command tags and the simulation mode are handled as in
+        Cling.run_command()'''
+
+        ignore_err = False
+        tag, argument = self._parse_meta_command(command)
+
+        if tag == 'sleep':
+            LOG.debug('%s: <sleeping for %s seconds>' % (
+                self.hostname, argument))
+            yield _sleep(self.loop, int(argument))
+            raise _Return('')
+
+        if tag == 'force_exec':
+            command = argument
+            LOG.debug('%s: Forcing exec of: "%s"' % (self.hostname, command))
+            force_execute = True
+            tag, argument = self._parse_meta_command(command)
+
+        if self.simulation and not force_execute:
+            LOG.debug('%s: Simulation-send: "%s"' % (self.hostname, command))
+            raise _Return('')
+
+        if tag == 'ignore_err':
+            command = argument
+            LOG.debug('%s: Ignoring possible errors on command: "%s"' % (
+                self.hostname, command))
+            ignore_err = True
+            tag, argument = self._parse_meta_command(command)
+
+        if tag in ('send', 'send_line'):
+            LOG.debug('%s: Send: "%s"' % (self.hostname, argument))
+            if tag == 'send':
+                yield self.send(argument)
+            else:
+                yield self.send_line(argument)
+            raise _Return('')
+
+        start = self._adapt_timeouts([command])
+        yield self.send_line(command)
+        yield self._expect(self.prompt)
+
+        out = self.child.before
+        self._learn_timeouts(command, start, len(out))
+        if not ignore_err:
+            self._catch_error(out)
+        raise _Return(self._clean_output(command, out))
+
+    @_coroutine
+    def logout(self):
+        '''Sends the exit commands to the terminal and closes the spawned
+        process'''
+        try:
+            for s in self.exit_commands:
+                yield self.send_line(s)
+        except Error:
+            pass
+        if self.child is not None:
+            yield self.child.close()
+        if self.timeouts is not None:
+            self.timeouts.save()
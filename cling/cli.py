@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import os
 import re
 import sys
 import time
 
 from . import Error
+from . import log
+from . import multiplex
 from . import pexpect_ng as pexpect
+from . import recording
+from . import transport as transports
+from .metrics import NULL_TIMER
+from .timeouts import LOGIN, command_class
 
 try:  # Python 2.7+
     from logging import NullHandler
@@ -20,49 +27,104 @@ __all__ = ['Cling']
 LOG = logging.getLogger(__name__)
 LOG.addHandler(NullHandler())
 
-# attempt to load netsnmp Python bindings,
-# this enables usage of personality auto discovery
-try:
-    import netsnmp
-except ImportError:
-    netsnmp = None
+# commands with a magic tag, see Cling._parse_meta_command()
+META_TAG = re.compile(
+    r'^<(?:(sleep) (\d+)>$|(send|force_exec|ignore_err|send_line)>(.+)$)',
+    flags=re.I)
+
+# <symbol><backspace> pairs, see the 'strip_backspaces' personality trait
+BACKSPACES = re.compile(r'.\x08')
+
+# pager prompts the probe command of personality='auto' may run into, the
+# init commands that turn paging off have not been run yet at that point
+PAGER = r'-{2,} ?\(?more\b[^\n]*$|(?:^|\n)lines \d+-\d+[^\n]*$'
+
+# what is left of an answered pager prompt at the start of the next page:
+# the prompt erased with backspaces, overwritten with spaces between
+# carriage returns or cleared with an ANSI erase to end of line
+PAGER_ERASE = re.compile(
+    r'(?:\x08+ +\x08+|\x08+|\r +\r|\r?\x1b\[K|\r(?!\n))+')
+
+# characters at the end of the output a pager prompt is looked for in,
+# whatever pexpect_searchwindowsize is
+PAGER_WINDOW = 128
+
+# how far back into output already searched a prompt match may start, see
+# pexpect_ng.spawn's searchlookback: prompts are short, and a long output
+# is then not searched again from the beginning after every read
+PROMPT_LOOKBACK = 4096
+
+# probe command of personality='auto', picked by the shape of the cli prompt
+# the device logged in with: the first regular expression that matches the
+# prompt line wins
+AUTO_PROBES = [
+    # junos and panos operational mode, user@host>
+    (re.compile(r'^[\w.-]+@[\w.-]+> ?$'), 'show system info'),
+    # linux shells
+    (re.compile(r'\$ ?$'), 'cat /etc/os-release'),
+    (re.compile(r''), 'show version'),
+]
 
 # PERSONALITIES define:
 #    - prompt to expect
 #    - list of the init commands to run upon login
 #    - list of the exit commands to run upon logout
 #    - pattern to match when using snmp for persn. auto discovery
+#    - optionally 'sys_descr_priority': patterns with a higher priority
+#      (0 by default) are tried first, see cling.discovery
+#    - optionally 'fingerprint': pattern to match against the login banner,
+#      the cli prompt and the output of a probe command when using 'auto'
+#      for persn. auto discovery, with 'fingerprint_priority' as above
+#    - optionally 'fixed_delays': True for devices that need pexpect's fixed
+#      sleeps before every send and when closing the session
+#    - optionally 'strip_backspaces': True for devices that insert
+#      <symbol><backspace> pairs in their output
+#    - optionally 'pager': pattern to match the pager prompt, answered with
+#      'pager_answer' (a space by default) whenever the device pages its
+#      output, eg. when the init commands are rejected or there are none
 PERSONALITIES = {
     'generic': {},
 
     'ios': {
         'init': ['terminal length 0'],
         'exit': ['exit'],
-        'sys_descr': r'cisco ios (?! xr |.*iosxe)'
+        'sys_descr': r'cisco ios (?! xr |.*iosxe)',
+        'fingerprint': (r'^cisco ios software|'
+                        r'cisco internetwork operating system'),
+        'fingerprint_priority': -1,
+        'pager': r' ?--more-- ?$'
     },
 
     'iosxe': {
         'init': ['terminal length 0'],
         'exit': ['exit'],
-        'sys_descr': r'iosxe'
+        'sys_descr': r'iosxe',
+        'fingerprint': r'cisco ios[ -]xe',
+        'pager': r' ?--more-- ?$'
     },
 
     'iosxr': {
         'init': ['terminal length 0'],
         'exit': ['exit'],
-        'sys_descr': r'cisco ios xr'
+        'sys_descr': r'cisco ios xr',
+        'fingerprint': r'cisco ios xr|^RP/\d+/\w+/CPU\d+:',
+        'pager': r' ?--more-- ?$'
     },
 
     'eos': {
         'init': ['terminal length 0'],
         'exit': ['exit'],
-        'sys_descr': r'arista'
+        'sys_descr': r'arista',
+        'fingerprint': r'arista',
+        'pager': r' ?--more-- ?$'
     },
 
     'ironware': {
         'init': ['skip-page-display'],
         'exit': ['exit', 'exit'],
-        'sys_descr': r'brocade|foundry'
+        'sys_descr': r'brocade|foundry',
+        'fingerprint': r'brocade|foundry|ironware',
+        'pager': r'--more--, next page: space[^\n]*$'
     },
 
     'junos': {
@@ -72,60 +134,79 @@ PERSONALITIES = {
             'set cli screen-width 0'
         ],
         'exit': ['exit'],
-        'sys_descr': r'junos'
+        'sys_descr': r'junos',
+        'fingerprint': r'junos',
+        'pager': r'---\(more(?: \d+%)?\)---$'
     },
 
     'webos': {
         'init': ['lines 0', 'verbose 1'],
         'exit': ['exit', 'n'],
-        'sys_descr': r'alteon'
+        'sys_descr': r'alteon',
+        'fingerprint': r'alteon'
     },
 
     'acos': {
         'init': ['terminal length 0'],
         'exit': ['exit', 'exit', 'y'],
-        'sys_descr': r'acos'
+        'sys_descr': r'acos',
+        'fingerprint': r'\bacos\b|a10 networks',
+        'pager': r' ?--more-- ?$'
     },
 
     'netscaler': {
         'exit': ['exit'],
-        'sys_descr': r'netscaler'
+        'sys_descr': r'netscaler',
+        'fingerprint': r'netscaler',
+        'pager': r' ?--more-- ?$'
     },
 
     'tmos': {
         'init': ['tmsh', 'modify cli preference pager disabled'],
         'exit': ['quit', 'exit'],
-        'sys_descr': r'\.f5'
+        'sys_descr': r'\.f5',
+        'strip_backspaces': True,
+        'fingerprint': r'\(tmos\)|big-?ip',
+        'pager': r'---\((?:less|more)(?: \d+%)?\)---$'
     },
 
     'panos': {
         'init': ['set cli pager off'],
         'exit': ['exit'],
-        'sys_descr': 'palo alto'
+        'sys_descr': 'palo alto',
+        'fingerprint': r'palo alto|pan-?os|^model: pa-',
+        'pager': r'(?<![^\n])lines \d+-\d+ ?$'
     },
 
     'cumulus': {
         'init': [''],
         'exit': ['exit'],
-        'sys_descr': 'cumulus'
+        'sys_descr': 'cumulus',
+        'fingerprint': r'cumulus'
     },
 
     'ftos': {
         'init': [''],
         'exit': ['exit'],
-        'sys_descr': 'Dell Networking OS'
+        'sys_descr': 'Dell Networking OS',
+        'fingerprint': r'dell (?:emc )?networking|force10|ftos',
+        'pager': r' ?--more-- ?$'
     },
 
     'checkpoint': {
         'init': [''],
         'exit': ['exit'],
-        'sys_descr': 'Linux.*cpx86_64'
+        'sys_descr': 'Linux.*cpx86_64',
+        'sys_descr_priority': -1,
+        'fingerprint': r'gaia|check ?point'
     },
 
     'tripplite': {
         'init': [''],
         'exit': ['exit'],
-        'sys_descr': 'Linux.*armv4tl'
+        'sys_descr': 'Linux.*armv4tl',
+        'sys_descr_priority': -1,
+        'fingerprint': r'tripp ?lite'
     }
 }
 
@@ -137,9 +218,12 @@ class Cling(object):
                  username='',
                  password='',
                  pexpect_timeout=10,
-                 pexpect_read_loop_timeout=0.1,
+                 pexpect_read_loop_timeout=None,
+                 pexpect_settle_timeout=0.01,
                  snmp_community='public',
                  snmp_version=2,
+                 snmp_cache_path=None,
+                 snmp_cache_ttl=86400,
                  pexpect_maxread=64000,
                  pexpect_searchwindowsize=5,
                  error_lookup_buffer=256,
@@ -149,7 +233,17 @@ class Cling(object):
                  identity_path=None,
                  extra_ssh_params='',
                  ssh_path='/usr/bin/ssh',
-                 simulation=False):
+                 ssh_control_dir=None,
+                 ssh_control_persist=600,
+                 simulation=False,
+                 metrics=None,
+                 record_path=None,
+                 replay_path=None,
+                 replay_speed=None,
+                 transport=None,
+                 encoding=None,
+                 codec_errors='replace',
+                 timeouts=None):
 
         self.hostname = hostname
         self.username = username
@@ -157,18 +251,50 @@ class Cling(object):
         self.personality = personality
         self.pexpect_timeout = pexpect_timeout
         self.pexpect_read_loop_timeout = pexpect_read_loop_timeout
+        self.pexpect_settle_timeout = pexpect_settle_timeout
         self.pexpect_maxread = pexpect_maxread
         self.pexpect_searchwindowsize = pexpect_searchwindowsize
         self.snmp_community = snmp_community
         self.snmp_version = snmp_version
-        self.error_lookup_buffer = error_lookup_buffer  # Error lookup buffer
+        self.snmp_cache_path = snmp_cache_path
+        self.snmp_cache_ttl = snmp_cache_ttl
+        # Error lookup buffer: errors are looked for in the last
+        # error_lookup_buffer characters of the output, or in the whole
+        # output as it is received if None
+        self.error_lookup_buffer = error_lookup_buffer
         self.max_login_attempts = max_login_attempts
         self.failed_login_retry_pause = failed_login_retry_pause
         self.pub_key_auth = pub_key_auth
         self.identity_path = identity_path
         self.extra_ssh_params = extra_ssh_params
         self.ssh_path = ssh_path
+        # ssh ControlMaster sockets shared by the logins to the host, see
+        # cling.multiplex
+        self.control_sockets = None
+        if ssh_control_dir:
+            self.control_sockets = multiplex.ControlSockets(
+                ssh_control_dir, ssh_control_persist, ssh_path)
         self.simulation = simulation
+        # cling.metrics.Metrics timing the session, disabled if None
+        self.metrics = metrics
+        # session recording written to record_path, and recording replayed
+        # in place of ssh, see cling.recording
+        self.record_path = record_path
+        self.replay_path = replay_path
+        self.replay_speed = replay_speed
+        self.recorder = None
+        # how the session gets its child, an ssh process on a pty by
+        # default, see cling.transport
+        self.transport = transport or transports.SpawnTransport()
+        # the output is decoded from encoding, UTF-8 by default on Python 3,
+        # left as it is received (str) on Python 2 by default
+        if encoding is None and sys.version_info[0] >= 3:
+            encoding = 'utf-8'
+        self.encoding = encoding
+        self.codec_errors = codec_errors
+        # cling.timeouts.TimeoutModel setting the timeouts of every command
+        # from the host's past commands, pexpect_timeout for all if None
+        self.timeouts = timeouts
         self.output_divider = '------------------\n'
 
         # Pexpect child object, initialised on login
@@ -176,16 +302,29 @@ class Cling(object):
 
         # snmp personality auto discovery
         if self.personality == 'snmp':
-            if netsnmp:
-                self._snmp_discover_personality()
-            else:
-                raise Error('%s: Failed to load netsnmp' % self.hostname)
+            self._snmp_discover_personality()
+
+        # login personality auto discovery, the session starts as generic
+        # and the personality is set once logged in, see _dologin()
+        self.auto_personality = self.personality == 'auto'
+        if self.auto_personality:
+            self.personality = 'generic'
 
         # bail if the personality is not known
         if self.personality not in PERSONALITIES:
             raise Error('%s: Unknown personality %s' % (
                 self.hostname, self.personality))
 
+        self._set_personality(self.personality)
+
+        # at this point we're ready for login()
+
+    def _set_personality(self, personality):
+        '''Applies the traits of a personality, also to a logged in
+        session'''
+
+        self.personality = personality
+
         # Spawn a device specific error handler
         self._error_handler = self._make_error_handler(self.personality)
 
@@ -193,6 +332,10 @@ class Cling(object):
         prompt = r'[#>\$%] ?$'
         self.init_commands = []
         self.exit_commands = []
+        self.fixed_delays = False
+        self.strip_backspaces = False
+        self.pager = None
+        self.pager_answer = ' '
 
         # override default traits with specifics
         if 'prompt' in PERSONALITIES[self.personality]:
@@ -201,20 +344,31 @@ class Cling(object):
             self.init_commands = PERSONALITIES[self.personality]['init']
         if 'exit' in PERSONALITIES[self.personality]:
             self.exit_commands = PERSONALITIES[self.personality]['exit']
+        if 'fixed_delays' in PERSONALITIES[self.personality]:
+            self.fixed_delays = PERSONALITIES[self.personality]['fixed_delays']
+        if 'strip_backspaces' in PERSONALITIES[self.personality]:
+            self.strip_backspaces = \
+                PERSONALITIES[self.personality]['strip_backspaces']
+        if 'pager' in PERSONALITIES[self.personality]:
+            self.pager = re.compile(PERSONALITIES[self.personality]['pager'],
+                                    flags=re.I)
+        if 'pager_answer' in PERSONALITIES[self.personality]:
+            self.pager_answer = PERSONALITIES[self.personality]['pager_answer']
 
         # compile case insensitive prompt to use with pexpect
         self.prompt = re.compile(prompt, flags=re.I)
 
-        # at this point we're ready for login()
+        if self.child is not None:
+            self.child.fixeddelays = self.fixed_delays
 
     def send(self, s='', hide_text=False):
         '''Sends string to the child, does not wait for cli prompt
         to be returned, raises Error if child has terminated'''
 
-        if not hide_text:
-            LOG.debug('%s: Sending: %s' % (self.hostname, s.rstrip()))
+        if hide_text:
+            log.payload(LOG, self.hostname, 'Sending', '***hidden***')
         else:
-            LOG.debug('%s: Sending: ***hidden***' % self.hostname)
+            log.payload(LOG, self.hostname, 'Sending', s.rstrip())
 
         try:
             self.child.send(s)
@@ -226,10 +380,10 @@ class Cling(object):
         '''Sends string + lineseparator to child, does not wait for cli prompt
         to be returned '''
 
-        if not hide_text:
-            LOG.debug('%s: Sending: %s' % (self.hostname, s))
+        if hide_text:
+            log.payload(LOG, self.hostname, 'Sending', '***hidden***')
         else:
-            LOG.debug('%s: Sending: ***hidden***' % self.hostname)
+            log.payload(LOG, self.hostname, 'Sending', s)
 
         try:
             self.child.sendline(s)
@@ -237,12 +391,22 @@ class Cling(object):
             raise Error('%s: child terminated [%s]' % (
                 self.hostname, self.child.before.rstrip()))
 
+    def _parse_meta_command(self, command):
+        '''Splits a command into its magic tag and the rest, returns
+        (tag, argument) with the tag in lower case, or (None, command)'''
+
+        m = META_TAG.match(command)
+        if m is None:
+            return None, command
+        if m.group(1):
+            return 'sleep', m.group(2)
+        return m.group(3).lower(), m.group(4)
+
     def _sleep_meta_command(self, command):
         '''Catch a sleep magic tag line '''
 
-        m = re.search(r'^<sleep (\d+)>$', command, flags=re.I)
-        if m:
-            seconds = m.group(1)
+        tag, seconds = self._parse_meta_command(command)
+        if tag == 'sleep':
             LOG.debug(
                 '%s: <sleeping for %s seconds>' % (self.hostname, seconds))
             time.sleep(int(seconds))
@@ -278,92 +442,422 @@ class Cling(object):
         '''Sends a command + newline to child, waits for cli prompt to be matched
         and returns output buffer minus the echoed command and cli prompt'''
 
+        tag, argument = self._parse_meta_command(command)
+
         # Catch <sleep > magic tags
-        if self._sleep_meta_command(command):
+        if tag == 'sleep':
+            self._sleep_meta_command(command)
             return ''
 
         # <send>command will send command without newline
-        m = re.search(r'^<send>(.+)$', command, flags=re.I)
-        if m:
-            command = m.group(1)
-            LOG.debug('%s: Send: "%s"' % (self.hostname, command))
+        if tag == 'send':
+            LOG.debug('%s: Send: "%s"' % (self.hostname, argument))
             try:
-                self.send(command)
+                self.send(argument)
             except Error as e:
                 raise Error(str(e))
             return ''
 
         # <force_exec>command will bypass the simulation mode
-        m = re.search(r'^<force_exec>(.+)$', command, flags=re.I)
-        if m:
-            command = m.group(1)
-            LOG.debug('%s: Forcing exec of: "%s"' % (self.hostname, command))
-            return self._run_command(command)
+        if tag == 'force_exec':
+            LOG.debug('%s: Forcing exec of: "%s"' % (self.hostname, argument))
+            return self._run_command(argument)
 
         # <ignore_err>command will bypass the error checking
-        m = re.search(r'^<ignore_err>(.+)$', command, flags=re.I)
-        if m:
-            command = m.group(1)
+        if tag == 'ignore_err':
             LOG.debug('%s: Ignoring possible errors on command: "%s"' % (
-                self.hostname, command))
-            return self._run_command(command, ignore_err=True)
+                self.hostname, argument))
+            return self._run_command(argument, ignore_err=True)
 
         # <send_line>command will send command
-        m = re.search(r'^<send_line>(.+)$', command, flags=re.I)
-        if m:
-            command = m.group(1)
-
-            LOG.debug('%s: Send: "%s"' % (self.hostname, command))
-
+        if tag == 'send_line':
+            LOG.debug('%s: Send: "%s"' % (self.hostname, argument))
             try:
-                self.send_line(command)
+                self.send_line(argument)
             except Error as e:
                 raise Error(str(e))
             return ''
 
         # normal command execution
-        self.send_line(command)
-        self._expect(self.prompt)
+        scanner = None
+        if not ignore_err and self.error_lookup_buffer is None:
+            scanner = self._error_handler.scanner()
+        self.child.scanner = scanner
+        start = self._adapt_timeouts([command])
+        try:
+            with self._timer('command.prompt_wait'):
+                self.send_line(command)
+                self._expect(self.prompt)
+        finally:
+            self.child.scanner = None
 
         out = self.child.before
-        if not ignore_err:
-            self._catch_error(out)
+        self._learn_timeouts(command, start, len(out))
+        with self._timer('command.error_scan'):
+            if scanner is not None:
+                self._raise_error(scanner.close())
+            elif not ignore_err:
+                self._catch_error(out)
+
+        with self._timer('command.clean_output'):
+            out = self._clean_output(command, out)
+        self._flush_metrics('command')
+        return out
+
+    def _timer(self, name):
+        '''Returns a context manager timing its block into self.metrics'''
+
+        if self.metrics is None:
+            return NULL_TIMER
+        return self.metrics.timer(name)
+
+    def _flush_metrics(self, scope):
+        if self.metrics is not None:
+            self.metrics.flush(scope)
+
+    def _adapt_timeouts(self, commands):
+        '''Sets the child's timeout and stall timeout for running the
+        commands from self.timeouts: the sum of their timeouts and the
+        longest stall timeout, or pexpect_timeout if one of them has not
+        been seen enough. Returns the time they start at, None without a
+        timeout model.'''
+
+        if self.timeouts is None:
+            return None
+        timeout, stall_timeout = 0, 0
+        for command in commands:
+            t, stall = self.timeouts.timeouts(
+                self.hostname, command_class(command), self.pexpect_timeout)
+            if stall is None:
+                timeout, stall_timeout = self.pexpect_timeout, None
+                break
+            timeout += t
+            stall_timeout = max(stall_timeout, stall)
+        self.child.timeout = timeout
+        self.child.stall_timeout = stall_timeout
+        self.child.read_gap = 0
+        return time.time()
+
+    def _learn_timeouts(self, command, start, size):
+        '''Adds the command started at start, that returned size characters,
+        to self.timeouts'''
+
+        if start is None:
+            return
+        self.timeouts.record(self.hostname, command_class(command),
+                             time.time() - start, self.child.read_gap, size)
+
+    def _clean_output(self, command, out):
+        '''Removes the echoed command and the cli prompt from the output'''
 
-        # for 'tmos' personality remove all <symbol><backspace> pairs
-        # from the output, f5 inserts those when echoing command back
-        if self.personality == 'tmos':
-            out = re.sub(r'.%s' % chr(8), '', out)
+        # remove all <symbol><backspace> pairs from the output, eg. f5
+        # inserts those when echoing command back
+        if self.strip_backspaces and '\x08' in out:
+            out = BACKSPACES.sub('', out)
+
+        # the cli prompt is the last line
+        end = out.rfind('\n') + 1
 
         # attempt to remove echo-ed back command
-        # .*? after command is needed as some devices
-        # append the command with spaces for some reason
-        out = re.sub(r'%s.*?\r\n' % re.escape(command), '', out)
+        echo = self._find_echo(out, command, 0, end)
+        if echo is None:
+            return out[:end]
+        start, stop = echo
+        if start == 0:
+            return out[stop:end]
+        return out[:start] + out[stop:end]
+
+    def _find_echo(self, out, command, start=0, end=None):
+        '''Looks for the echoed command between the start and end offsets of
+        out, returns the (start, end) offsets of the echo up to and including
+        the line separator or None'''
+
+        if end is None:
+            end = len(out)
+        pos = out.find(command, start, end)
+        while pos >= 0:
+            # some devices append the command with spaces for some reason,
+            # so anything up to the end of the line is part of the echo
+            eol = out.find('\n', pos + len(command), end)
+            if eol < 0:
+                return None
+            if eol > pos + len(command) and out[eol - 1] == '\r':
+                return pos, eol + 1
+            pos = out.find(command, pos + 1, end)
+        return None
+
+    def iter_command(self, command, force_execute=False, ignore_err=False):
+        '''Sends a command + newline to child and yields the output in chunks
+        as it is received, minus the echoed command and the cli prompt.
+
+        Only complete lines are yielded, the last (incomplete) line is held
+        back until it is either completed or matched as the cli prompt, so
+        memory use is bounded by the chunk size rather than by the size of
+        the output. Error detection is carried on a rolling window of the
+        last error_lookup_buffer characters once the prompt is matched, or
+        on every chunk as it is yielded if error_lookup_buffer is None.
+
+        Magic command tags and the simulation mode are handled as in
+        run_command(), the resulting output is yielded as a single chunk.
+        '''
 
-        # attempt to remove last string (cli prompt)
-        out = re.sub('[^\n]*?$', '', out)
-        return out
+        if (self.simulation and not force_execute) or META_TAG.match(command):
+            out = self.run_command(command, force_execute)
+            if out:
+                yield out
+            return
+
+        start = self._adapt_timeouts([command])
+        self.send_line(command)
+
+        child = self.child
+        pending = child.buffer
+        child.buffer = ''
+        window = ''
+        received = len(pending)
+        echoed = False
+        answered = False
+        scanner = None
+        if not ignore_err and self.error_lookup_buffer is None:
+            scanner = self._error_handler.scanner()
+
+        timeout = child.timeout
+        last_read = time.time()
+        if timeout is not None:
+            end_time = last_read + timeout
+        if child.read_loop_timeout is None:
+            settle_timeout = child.settle_timeout
+        else:
+            settle_timeout = 0
+        searchwindowsize = child.searchwindowsize
+
+        try:
+            while True:
+                # hand out complete lines, keep the last one as it may
+                # turn out to be the cli prompt
+                nl = pending.rfind('\n')
+                if nl < 0 and echoed and len(pending) > child.maxread:
+                    nl = len(pending) - child.maxread - 1
+                if nl >= 0:
+                    out, pending = pending[:nl + 1], pending[nl + 1:]
+                    if self.strip_backspaces and '\x08' in out:
+                        out = BACKSPACES.sub('', out)
+                    # line numbers count the echo, as in run_command()
+                    if scanner is not None:
+                        scanner.feed(out)
+                    if not echoed:
+                        echo = self._find_echo(out, command, 0,
+                                               out.find('\n') + 1)
+                        if echo is not None:
+                            out = out[:echo[0]] + out[echo[1]:]
+                        echoed = True
+                    if scanner is None and not ignore_err:
+                        window = (window + out)[-self.error_lookup_buffer:]
+                    if out:
+                        yield out
+
+                c = child.read_nonblocking(child.maxread, settle_timeout)
+                if c and answered:
+                    c = self._clean_page(c, answered)
+                    answered = False
+                if c:
+                    now = time.time()
+                    child.read_gap = max(child.read_gap, now - last_read)
+                    last_read = now
+                    received += len(c)
+                    pending += c
+                    if child.read_loop_timeout is not None:
+                        time.sleep(child.read_loop_timeout)
+                    continue
+
+                # the child went quiet, check if we're looking at the prompt
+                if searchwindowsize is None:
+                    tail = pending
+                else:
+                    tail = pending[-searchwindowsize:]
+                if self.prompt.search(tail):
+                    break
+
+                # or at a pager prompt, answered and dropped
+                if self.pager is not None:
+                    tail = pending[-PAGER_WINDOW:]
+                    pager = self.pager.search(tail)
+                    if pager is not None:
+                        pending = pending[:len(pending) - len(tail) +
+                                          pager.start()]
+                        LOG.debug('%s: answering the pager', self.hostname)
+                        self.send(self.pager_answer)
+                        answered = True
+                        continue
+
+                if timeout is not None:
+                    deadline = end_time
+                    # data is still coming, push the deadline back
+                    if child.stall_timeout is not None:
+                        deadline = max(deadline,
+                                       last_read + child.stall_timeout)
+                    timeout = deadline - time.time()
+                    if timeout < 0:
+                        raise Error(
+                            '%s: timeout pattern matching, search buffer '
+                            'was "%s"' % (self.hostname, pending))
+                c = child.read_nonblocking(child.maxread, timeout)
+                if c and answered:
+                    c = self._clean_page(c, answered)
+                    answered = False
+                if c:
+                    now = time.time()
+                    child.read_gap = max(child.read_gap, now - last_read)
+                    last_read = now
+                    received += len(c)
+                    pending += c
+        except pexpect.EOF:
+            raise Error('%s: child terminated "%s"' % (
+                self.hostname, pending.rstrip()))
+
+        self._learn_timeouts(command, start, received)
+        if scanner is not None:
+            scanner.feed(pending)
+            self._raise_error(scanner.close())
+        elif not ignore_err:
+            self._catch_error(window + pending)
+        self._flush_metrics('command')
+
+    def run_commands(self, commands, pipeline_depth=1, force_execute=False):
+        '''Runs a list of commands and returns the list of their outputs
+
+        With pipeline_depth > 1 up to pipeline_depth commands are sent ahead
+        without waiting for the cli prompt in between, which saves a round
+        trip per command on high latency links. The received stream is split
+        back into per-command outputs at the lines where the cli prompt is
+        followed by the echoed command, and each output is checked for
+        errors. Note that an error is only reported once the whole batch has
+        been received, so the commands sent after the failing one in the same
+        batch have been executed as well. Pipelining needs paging to be
+        turned off: a device paging an output would take the commands sent
+        ahead as answers to its pager prompt.
+
+        Commands with magic tags and commands in simulation mode are run one
+        at a time, as in run_command().
+        '''
+
+        outputs = []
+        batch = []
+        for command in commands:
+            if pipeline_depth <= 1 or META_TAG.match(command) or (
+                    self.simulation and not force_execute):
+                outputs.extend(self._run_pipelined(batch))
+                batch = []
+                outputs.append(self.run_command(command, force_execute))
+                continue
+            batch.append(command)
+            if len(batch) >= pipeline_depth:
+                outputs.extend(self._run_pipelined(batch))
+                batch = []
+        outputs.extend(self._run_pipelined(batch))
+        return outputs
+
+    def _run_pipelined(self, commands):
+        '''Sends all commands at once, waits until the output of the last
+        one has been received and returns the list of outputs'''
+
+        if len(commands) <= 1:
+            return [self._run_command(command) for command in commands]
+
+        self._adapt_timeouts(commands)
+        for command in commands:
+            self.send_line(command)
+
+        # keep reading until every command's output has been seen, the
+        # prompt may have been matched early while a command was running
+        out = ''
+        with self._timer('pipeline.prompt_wait'):
+            while True:
+                self._expect(self.prompt)
+                out += self.child.before
+                bounds = self._split_pipelined(out, commands)
+                if bounds is not None:
+                    break
+                out += self.child.after
+
+        outputs = []
+        for command, (start, end) in zip(commands, bounds):
+            output = out[start:end]
+            with self._timer('command.error_scan'):
+                self._catch_error(output)
+            with self._timer('command.clean_output'):
+                outputs.append(self._clean_output(command, output))
+        self._flush_metrics('pipeline')
+        return outputs
+
+    def _split_pipelined(self, out, commands):
+        '''Finds the output of each command in the output of a batch of
+        commands, returns a list of (start, end) offsets into out or None if
+        not all of the commands' echoes have been received yet'''
+
+        bounds = []
+        start = 0
+        for command in commands[1:]:
+            echo = re.compile(r'%s[ \t\r]*\n' % re.escape(command))
+            pos = start
+            while True:
+                m = echo.search(out, pos)
+                if m is None:
+                    return None
+                line_start = out.rfind('\n', start, m.start()) + 1
+                # the echo should follow the cli prompt
+                if line_start > start and self.prompt.search(
+                        out, line_start, m.start()):
+                    break
+                pos = m.start() + 1
+            # the prompt stays with the previous output, as in run_command()
+            bounds.append((start, m.start()))
+            start = m.start()
+        bounds.append((start, len(out)))
+        return bounds
 
     def _catch_error(self, out=None):
         '''Error catcher'''
 
+        # With error_lookup_buffer = None the whole output is scanned
+        if self.error_lookup_buffer is None:
+            scanner = self._error_handler.scanner()
+            scanner.feed(out)
+            self._raise_error(scanner.close())
+            return
+
         # Get the last self.error_lookup_buffer characters from the response buffer and
         # check if there is an error message in the response.
         # If so raise Exeption
         sample_out = out[-self.error_lookup_buffer:]
-        LOG.debug(
-            '%s: Looking for errors in %s' % (self.hostname, sample_out))
+        log.payload(LOG, self.hostname, 'Looking for errors in', sample_out)
         if self._error_handler.has_error(sample_out):
-            LOG.debug('%s: Oops... error condition met; %s' % (
-                self.hostname, sample_out))
+            if LOG.isEnabledFor(logging.DEBUG):
+                LOG.debug('%s: Oops... error condition met (%s); %s',
+                          self.hostname,
+                          self._error_handler.find_error(sample_out),
+                          log.truncate(sample_out))
             raise Error('%s: Command error: %s' % (self.hostname, sample_out))
         return
 
+    def _raise_error(self, match):
+        '''Raises Error for a rules.ErrorMatch found by an error scanner,
+        if any'''
+
+        if match is None:
+            return
+        LOG.debug('%s: Oops... error condition met (%s)', self.hostname,
+                  match)
+        raise Error('%s: Command error at line %d: %s' % (
+            self.hostname, match.line, match.context))
+
     def login(self):
         for attempt in range(0, self.max_login_attempts):
             try:
                 LOG.debug('%s: Attempt %s: Login to %s...' %
                           (self.hostname, attempt, self.hostname))
-                self._dologin()
+                with self._timer('login'):
+                    self._dologin()
                 LOG.debug('%s: Done logging-in to %s' % (
                     self.hostname, self.hostname))
                 return
@@ -384,11 +878,12 @@ class Cling(object):
                     )
                     time.sleep(self.failed_login_retry_pause)
 
-    def _dologin(self):
-        '''Spawns ssh or telnet, logins to the host
-        and runs the intialisation commands'''
+    def _ssh_command(self):
+        '''Builds the ssh command line to spawn'''
+
+        if self.replay_path:
+            return self._replay_command()
 
-        # build the ssh command to spawn
         ssh_command = [self.ssh_path]
 
         ssh_command.append('-o UserKnownHostsFile=/dev/null')
@@ -403,45 +898,98 @@ class Cling(object):
         if self.pub_key_auth and self.identity_path:
             ssh_command.append('-i %s' % self.identity_path)
 
+        if self.control_sockets is not None:
+            ssh_command.extend(
+                self.control_sockets.options(self.username, self.hostname))
+
         ssh_command.append('%s@%s' % (self.username, self.hostname))
 
         if self.extra_ssh_params:
             ssh_command.append(self.extra_ssh_params)
 
-        ssh_command = ' '.join(ssh_command)
+        return ' '.join(ssh_command)
+
+    def _preauthenticated(self):
+        '''Returns True if the session is authenticated before the cli
+        prompt, by the transport or through a running ssh ControlMaster: no
+        password prompt'''
+
+        if self.replay_path:
+            return False
+        if self.transport.authenticates:
+            return True
+        return (self.control_sockets is not None and
+                self.control_sockets.check(self.username, self.hostname))
+
+    def _replay_command(self):
+        '''Builds the command line replaying self.replay_path'''
+
+        script = os.path.splitext(os.path.abspath(recording.__file__))[0]
+        replay_command = [sys.executable, script + '.py', self.replay_path]
+        if self.replay_speed:
+            replay_command.append('--speed %s' % self.replay_speed)
+        return ' '.join(replay_command)
+
+    def _dologin(self):
+        '''Spawns ssh or telnet, logins to the host
+        and runs the intialisation commands'''
+
+        # log in with the generic prompt if the personality is to be
+        # discovered
+        if self.auto_personality:
+            self._set_personality('generic')
+
+        preauthenticated = self._preauthenticated()
 
         # spawn the process
-        self.child = self._spawn(ssh_command)
+        with self._timer('login.spawn'):
+            self.child = self._spawn(self._ssh_command())
+        start = self._adapt_timeouts([LOGIN])
+
+        # banner and cli prompt, for the personality auto discovery
+        login_text = ''
 
         # if pub_key_auth is True, then we ignore the password prompt
-        if not self.pub_key_auth:
+        if not self.pub_key_auth and not preauthenticated:
             p = re.compile(r'password: ', re.I)
 
             try:
-                self._expect(p)
+                with self._timer('login.password_prompt'):
+                    self._expect(p)
             # raise "connection failed" if no "password" could be seen
             except Error as e:
                 raise Error(
                     '%s: connection failed (%s)' % (self.hostname, e))
+            login_text = self.child.before
 
             try:
-                self.send_line(self.password, hide_text=True)
-                self._expect(self.prompt)
+                with self._timer('login.prompt'):
+                    self.send_line(self.password, hide_text=True)
+                    self._expect(self.prompt)
             # raise login failed if no cli prompt could be seen
             except Error as e:
                 raise Error('%s: login failed (%s)' % (self.hostname, e))
         else:
             try:
-                self._expect(self.prompt)
+                with self._timer('login.prompt'):
+                    self._expect(self.prompt)
             except Error as e:
                 raise Error('%s: login failed (%s)' % (self.hostname, e))
+        login_text += self.child.before + self.child.after
+        self._learn_timeouts(LOGIN, start, len(login_text))
+
+        if self.auto_personality:
+            with self._timer('login.auto_personality'):
+                self._discover_personality(login_text)
+        self._flush_metrics('login')
 
         # Set search window size - how many chars to look back for a matching prompt
         self.child.searchwindowsize = self.pexpect_searchwindowsize
 
         # run the init commands
-        for s in self.init_commands:
-            self.run_command(s)
+        with self._timer('login.init'):
+            for s in self.init_commands:
+                self.run_command(s)
 
     def logout(self):
         '''Sends  the exit commands to the terminal
@@ -457,16 +1005,45 @@ class Cling(object):
         except:
             pass
 
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+        if self.timeouts is not None:
+            self.timeouts.save()
+
+    def is_alive(self, timeout=5):
+        '''Cheap health check of a logged in session: sends an empty line
+        and waits up to timeout seconds for the cli prompt to come back'''
+
+        if self.child is None or self.child.closed:
+            return False
+        try:
+            self.child.sendline()
+            self.child.expect(self.prompt, timeout=timeout)
+        except (pexpect.TIMEOUT, pexpect.EOF, OSError):
+            LOG.debug('%s: session is not alive' % self.hostname)
+            return False
+        return True
+
     def _spawn(self, command):
         '''Spawns the shell command and returns pexpect child object'''
         LOG.debug('%s: spawning "%s"' % (self.hostname, command))
+        transport = self.transport
+        # recordings are played back by a process on a pty
+        if self.replay_path:
+            transport = transports.SpawnTransport()
         try:
-            child = pexpect.spawn(
-                command,
-                maxread=self.pexpect_maxread,
-                timeout=self.pexpect_timeout,
-                read_loop_timeout=self.pexpect_read_loop_timeout
-            )
+            child = transport.open(self, command)
+            child.settle_timeout = self.pexpect_settle_timeout
+            child.searchlookback = PROMPT_LOOKBACK
+            child.fixeddelays = self.fixed_delays
+            child.metrics = self.metrics
+            if self.record_path:
+                if self.recorder is not None:
+                    self.recorder.close()
+                self.recorder = recording.Recorder(self.record_path)
+                self.recorder.attach(child)
             return child
         except pexpect.EOF:
             raise Error('%s: child terminated "%s"' % (
@@ -476,12 +1053,14 @@ class Cling(object):
         '''Waits for the pattern to be matched in the input stream
         If no match has occured raises "timeout pattern matching" error
         If child process dies raises "child terminated" error'''
-        LOG.debug('%s: expecting %s' % (self.hostname, pattern.pattern))
+        LOG.debug('%s: expecting %s', self.hostname, pattern.pattern)
         try:
-            self.child.expect(pattern)
-            LOG.debug(
-                '%s: Before: "%s"' % (self.hostname, self.child.before))
-            LOG.debug('%s: After: "%s"' % (self.hostname, self.child.after))
+            if self.pager is None:
+                self.child.expect(pattern)
+            else:
+                self._expect_paged(pattern)
+            log.payload(LOG, self.hostname, 'Before', self.child.before)
+            log.payload(LOG, self.hostname, 'After', self.child.after)
         except pexpect.TIMEOUT:
             raise Error(
                 '%s: timeout pattern matching, search buffer was "%s"' % (
@@ -493,36 +1072,57 @@ class Cling(object):
             raise Error('%s: child terminated "%s"' % (self.hostname,
                                                        self.child.before.rstrip()))
 
+    def _expect_paged(self, pattern):
+        '''Waits for the pattern, answering the pager prompts received
+        before it. The pages are left in child.before, without the pager
+        prompts nor what they leave behind once answered.'''
+
+        child = self.child
+        searchwindowsize = child.searchwindowsize
+        if searchwindowsize is not None:
+            searchwindowsize = max(searchwindowsize, PAGER_WINDOW)
+        # nothing comes after a pager prompt until it is answered, don't
+        # wait for the output to settle
+        child.settle_exempt = (1,)
+        pages = []
+        try:
+            while True:
+                index = child.expect([pattern, self.pager],
+                                     searchwindowsize=searchwindowsize)
+                pages.append(self._clean_page(child.before, bool(pages)))
+                if index == 0:
+                    break
+                LOG.debug('%s: answering the pager', self.hostname)
+                self.send(self.pager_answer)
+        finally:
+            child.settle_exempt = ()
+        if len(pages) > 1:
+            child.before = ''.join(pages)
+
+    def _clean_page(self, page, answered):
+        '''Removes what the answered pager prompt left at the start of a
+        page, and the <symbol><backspace> pairs if the personality strips
+        them'''
+
+        if answered:
+            erase = PAGER_ERASE.match(page)
+            if erase is not None:
+                page = page[erase.end():]
+            if self.strip_backspaces and '\x08' in page:
+                page = BACKSPACES.sub('', page)
+        return page
+
     def _snmp_discover_personality(self):
-        '''Loads netsnmp mod and attempts to discover the host's personality
-        via snmp by querying sysDescr'''
-        varbind = netsnmp.snmpget(
-            netsnmp.Varbind('.1.3.6.1.2.1.1.1.0'),
-            DestHost=self.hostname,
-            Version=self.snmp_version,
-            Community=self.snmp_community,
-        )
-
-        if varbind[0] is None:
-            raise Error('%s: SNMP query failed' % self.hostname)
-
-        sys_descr = varbind[0]
-
-        for personality in PERSONALITIES:
-            # skip generic personality
-            if personality == 'generic':
-                continue
+        '''Attempts to discover the host's personality via snmp by querying
+        sysDescr, or from the discovery cache if snmp_cache_path is set'''
 
-            if re.search(
-                    PERSONALITIES[personality]['sys_descr'], sys_descr,
-                    flags=re.I
-            ):
-                self.personality = personality
-                break
-        else:
-            raise Error(
-                '%s: Unable to determine personality of "%s"' % (
-                    self.hostname, sys_descr))
+        # imported here as cling.discovery needs PERSONALITIES
+        from .discovery import Discovery
+        finder = Discovery(cache_path=self.snmp_cache_path,
+                           ttl=self.snmp_cache_ttl,
+                           snmp_community=self.snmp_community,
+                           snmp_version=self.snmp_version)
+        self.personality = finder.discover_host(self.hostname)
 
     def _run_command_ascii(self, command):
         '''Runs a command, prints the output buffer per byte and
@@ -550,28 +1150,84 @@ class Cling(object):
         self.send_line('disconnect')
         self.send_line()
 
+    def _discover_personality(self, login_text):
+        '''personality='auto': matches the fingerprints against the login
+        banner and cli prompt, runs the probe command if that is not enough
+        and applies the personality found'''
+
+        personality = self._match_fingerprint(login_text)
+        if personality is None:
+            command = self._probe_command(login_text)
+            LOG.debug('%s: probing personality with "%s"' % (
+                self.hostname, command))
+            self.send_line(command)
+            self._expect(self._probe_prompt())
+            out = self.child.before
+            # quit the pager rather than page through the output
+            if not self.prompt.search(self.child.after):
+                self.send('q')
+                self._expect(self.prompt)
+                out += self.child.before
+            personality = self._match_fingerprint(login_text + out)
+        self._apply_auto_personality(personality)
+
+    def _match_fingerprint(self, text):
+        '''Returns the personality whose fingerprint matches the login
+        banner, cli prompt and probe output in text, or None'''
+
+        # imported here as cling.discovery needs PERSONALITIES
+        from .discovery import compile_rules, match_personality
+        return match_personality(
+            text, compile_rules(PERSONALITIES, 'fingerprint', re.I | re.M))
+
+    def _probe_command(self, login_text):
+        '''Returns the probe command of personality='auto' for the cli
+        prompt the device logged in with'''
+
+        prompt_line = login_text[login_text.rfind('\n') + 1:].strip()
+        for regex, command in AUTO_PROBES:
+            if regex.search(prompt_line):
+                return command
+
+    def _probe_prompt(self):
+        '''Returns the pattern matching either the cli prompt or a pager
+        prompt, to wait for the output of the probe command'''
+
+        return re.compile(r'%s|%s' % (PAGER, self.prompt.pattern), re.I)
+
+    def _apply_auto_personality(self, personality):
+        if personality is None:
+            LOG.debug('%s: no personality matched, staying generic' % (
+                self.hostname))
+            return
+        LOG.debug('%s: discovered personality %s' % (
+            self.hostname, personality))
+        self._set_personality(personality)
+
     def _make_error_handler(self, personality):
         """
         Create an error handler.
 
         Spawn a device specific error handler to ease error handling. If a device
-        handler is not available the default is selected - no error handling.
+        handler is not available the default is selected, which looks for the
+        error rules of the personality in error_handler/data/.
         """
 
         # Attempt to import error handler class. All device handlers are
         # in "error_handler.<devicename>" and in a class named
         # "<PERSONALITY>ErrorHAndler", with the first letter capitalized.
         class_name = "%sErrorHandler" % personality.capitalize()
-        module_name = "cling.error_handler.%s" % personality
+        module = personality
+        module_name = "cling.error_handler.%s" % module
         try:
             dev_module_obj = __import__(module_name)
         except ImportError:
             class_name = "DefaultErrorHandler"
+            module = 'default'
             module_name = "cling.error_handler.default"
-            personality = 'default'
             dev_module_obj = __import__(module_name)
         handler_module_obj = getattr(
-            getattr(dev_module_obj, "error_handler"), personality)
+            getattr(dev_module_obj, "error_handler"), module)
         class_obj = getattr(handler_module_obj, class_name)
         handler_obj = class_obj(personality)
         LOG.debug('%s: Invoking %s error handler' % (
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+SNMP personality discovery.
+
+The personality of a device is told by its sysDescr, matched against the
+'sys_descr' patterns of PERSONALITIES. Discovery compiles the patterns once
+and tries them in a fixed order: higher 'sys_descr_priority' first (0 by
+default), then by personality name. It looks up whole host lists with the
+Reactor's worker processes and keeps the results in an on-disk cache, so
+that inventory runs do not query every device again for a fact that rarely
+changes:
+
+    finder = cling.Discovery(cache_path='/var/cache/cling/discovery.json',
+                             ttl=7 * 86400, num_workers=32)
+    for hostname, personality in finder.imap_unordered(hostnames):
+        if isinstance(personality, cling.Error):
+            ...
+
+Cached hosts are answered first, without SNMP. Failed lookups are not
+cached. The cache is a JSON file of {hostname: [personality, sysDescr,
+time discovered]}, rewritten atomically by save().
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from . import Error
+from .cli import PERSONALITIES
+from .reactor import Reactor, TaskFailed
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+# attempt to load netsnmp Python bindings, required for SNMP queries
+try:
+    import netsnmp
+except ImportError:
+    netsnmp = None
+
+__all__ = ['Discovery']
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(NullHandler())
+
+SYS_DESCR_OID = '.1.3.6.1.2.1.1.1.0'
+
+
+def compile_rules(personalities=None, trait='sys_descr', flags=re.I):
+    '''Returns the list of (personality, compiled pattern) of the
+    personalities that have the trait, in the order they are to be tried:
+    by descending <trait>_priority, then by name'''
+
+    if personalities is None:
+        personalities = PERSONALITIES
+    order = sorted(
+        (-traits.get(trait + '_priority', 0), name)
+        for name, traits in personalities.items() if trait in traits)
+    return [(name, re.compile(personalities[name][trait], flags))
+            for priority, name in order]
+
+
+def match_personality(sys_descr, rules):
+    '''Returns the first personality of rules whose pattern matches
+    sys_descr, or None'''
+
+    for personality, regex in rules:
+        if regex.search(sys_descr):
+            return personality
+    return None
+
+
+def snmp_sys_descr(hostname, community='public', version=2):
+    '''Queries the sysDescr of hostname'''
+
+    if netsnmp is None:
+        raise Error('%s: Failed to load netsnmp' % hostname)
+    varbind = netsnmp.snmpget(
+        netsnmp.Varbind(SYS_DESCR_OID),
+        DestHost=hostname,
+        Version=version,
+        Community=community,
+    )
+    if varbind[0] is None:
+        raise Error('%s: SNMP query failed' % hostname)
+    return varbind[0]
+
+
+class DiscoveryCache(object):
+    """sysDescr lookups kept on disk for ttl seconds"""
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        '''Reads the cache file, a missing or unreadable file is an empty
+        cache'''
+
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug('%s: not using discovery cache: %s' % (self.path, e))
+            entries = {}
+        with self._lock:
+            self._entries = entries
+
+    def get(self, hostname):
+        '''Returns the cached (personality, sysDescr) of hostname, or None
+        if it is not cached or has expired'''
+
+        with self._lock:
+            entry = self._entries.get(hostname)
+        if entry is None or entry[2] + self.ttl < time.time():
+            return None
+        return entry[0], entry[1]
+
+    def set(self, hostname, personality, sys_descr):
+        with self._lock:
+            self._entries[hostname] = [personality, sys_descr, time.time()]
+
+    def save(self):
+        '''Writes the unexpired entries to the cache file'''
+
+        limit = time.time() - self.ttl
+        with self._lock:
+            entries = dict((hostname, entry) for hostname, entry
+                           in self._entries.items() if entry[2] >= limit)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.discovery')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp, self.path)
+        except:
+            os.unlink(tmp)
+            raise
+
+
+class Discovery(object):
+
+    def __init__(self, cache_path=None, ttl=86400, num_workers=16,
+                 task_timeout=None, snmp_community='public', snmp_version=2,
+                 personalities=None, query=None):
+        '''cache_path: file to keep the results in, no cache if None
+        ttl: seconds a cached result is used for
+        num_workers: number of worker processes querying the hosts
+        task_timeout: seconds after which a host's query is given up
+        personalities: defaults to PERSONALITIES
+        query: function called with a hostname, returns its sysDescr;
+        defaults to an SNMP get with snmp_community and snmp_version'''
+
+        self.cache = None
+        if cache_path is not None:
+            self.cache = DiscoveryCache(cache_path, ttl)
+        self.num_workers = num_workers
+        self.task_timeout = task_timeout
+        self.snmp_community = snmp_community
+        self.snmp_version = snmp_version
+        self.rules = compile_rules(personalities)
+        self.query = query or self._snmp_query
+
+    def _snmp_query(self, hostname):
+        return snmp_sys_descr(hostname, self.snmp_community, self.snmp_version)
+
+    def _match(self, hostname, sys_descr):
+        personality = match_personality(sys_descr, self.rules)
+        if personality is None:
+            return Error('%s: Unable to determine personality of "%s"' % (
+                hostname, sys_descr))
+        if self.cache is not None:
+            self.cache.set(hostname, personality, sys_descr)
+        return personality
+
+    def _cached(self, hostname):
+        if self.cache is None:
+            return None
+        entry = self.cache.get(hostname)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def discover_host(self, hostname):
+        '''Returns the personality of a single host, queried in this
+        process. Raises Error if it can not be determined.'''
+
+        personality = self._cached(hostname)
+        if personality is not None:
+            LOG.debug('%s: cached personality %s' % (hostname, personality))
+            return personality
+        personality = self._match(hostname, self.query(hostname))
+        if isinstance(personality, Error):
+            raise personality
+        if self.cache is not None:
+            self.cache.save()
+        return personality
+
+    def imap_unordered(self, hostnames):
+        '''Yields (hostname, personality) tuples, the cached hosts first and
+        then the others as the workers query them. If the personality of a
+        host can not be determined, it is an Error instance (not raised),
+        a cling.reactor.TaskFailed if the query failed. The cache is saved
+        once all the hosts are done.'''
+
+        pending = []
+        for hostname in hostnames:
+            personality = self._cached(hostname)
+            if personality is None:
+                pending.append(hostname)
+            else:
+                yield hostname, personality
+        LOG.debug('%d host(s) to query' % len(pending))
+
+        if pending:
+            reactor = Reactor(pending, self.query,
+                              num_workers=min(self.num_workers, len(pending)),
+                              task_timeout=self.task_timeout)
+            for hostname, result in reactor.imap_unordered():
+                if not isinstance(result, TaskFailed):
+                    result = self._match(hostname, result)
+                yield hostname, result
+
+        if self.cache is not None:
+            self.cache.save()
+
+    def discover(self, hostnames):
+        '''Returns a dict of hostname: personality, see imap_unordered()'''
+
+        return dict(self.imap_unordered(hostnames))
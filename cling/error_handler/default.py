@@ -4,10 +4,13 @@
 Generic error handler.
 
 As handling of device errors is done differently among vendors, a variety of
-error detection mechanisms can be incorporated. For example, in Cisco devices
-the usage of an error list and a simple heuristic method is sufficient.
-Juniper devices may require more sophisticated handling. In all cases, new
-modules should be added in a
+error detection mechanisms can be incorporated. For most devices a list of
+error patterns is sufficient: these are kept in the
+
+"data/<personality>.rules"
+
+file and are picked up by this handler, see rules.py. Devices that require
+more sophisticated handling can have a module of their own, in a
 
 "<personality>.py"
 
@@ -18,10 +21,14 @@ file. Inside this file a subclass of DefaultErrorHandler should be created as:
 (first leter capital).
 """
 
+from . import rules
+
+
 class DefaultErrorHandler(object):
 
     def __init__(self, personality = None):
         self.personality = personality
+        self.rules = rules.load(personality or 'default')
 
     def has_error(self, output):
         """ The actual error detector
@@ -29,4 +36,17 @@ class DefaultErrorHandler(object):
         It can be really simple with string in list matching to very complex
         with regexps or even API calls
         """
-        return False
+        return self.find_error(output) is not None
+
+    def find_error(self, output):
+        """ Returns a rules.ErrorMatch telling which error rule matched the
+        output and where, or None
+        """
+        return self.rules.search(output)
+
+    def scanner(self):
+        """ Returns a rules.ErrorScanner, used to look for errors in the
+        whole output of a command while it is received. Handlers that
+        override has_error() should override this as well.
+        """
+        return rules.ErrorScanner(self.rules)
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*- vim:fileencoding=utf-8:
+
+"""
+Error rule engine.
+
+The error rules of a personality are regular expressions kept in the
+
+"data/<personality>.rules"
+
+file, one rule per line:
+
+    <rule name> <flags> <regular expression>
+
+where flags are any of "i" (ignore case), "m" (multiline) and "s" (dot
+matches all), or "-" for none. Blank lines and lines starting with "#" are
+ignored, "include <personality>" adds the rules of another personality.
+
+load() compiles the rules of a personality into a RuleSet once and caches
+it. RuleSet.search() looks for all of the rules in a command's output and
+reports the rule that matched first, where and on which line. An
+ErrorScanner does the same for output that is fed to it as it is received,
+looking at every complete line once; there "^" and "$" match at the start
+and end of every line.
+"""
+
+import os
+import re
+import threading
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+FLAGS = {'i': re.I, 'm': re.M, 's': re.S}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class RuleError(Exception):
+    """A rules file could not be parsed"""
+
+    pass
+
+
+class ErrorMatch(object):
+    """An error rule that matched a command's output"""
+
+    def __init__(self, rule, output, start, end, offset=0, lines=0):
+        '''rule: name of the rule
+        output: the (part of the) output the rule was searched in
+        start, end: offsets of the match in output
+        offset, lines: length and number of line separators of the output
+        that came before, when it is scanned piece by piece'''
+
+        self.rule = rule
+        self.start = offset + start
+        self.end = offset + end
+        self.text = output[start:end]
+        self.line = lines + output.count('\n', 0, start) + 1
+        # the whole line(s) the match is on
+        eol = output.find('\n', end)
+        if eol < 0:
+            eol = len(output)
+        self.context = output[output.rfind('\n', 0, start) + 1:eol].strip()
+
+    def __str__(self):
+        return 'rule %s at line %d: %s' % (
+            self.rule, self.line, self.text.strip())
+
+    def __repr__(self):
+        return '<ErrorMatch %s>' % self
+
+
+class RuleSet(object):
+    """The compiled error rules of a personality"""
+
+    def __init__(self, name, rules):
+        '''name: name of the rule set, usually the personality
+        rules: list of (rule name, compiled regular expression)'''
+
+        self.name = name
+        self.rules = rules
+        self._line_rules = None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def line_rules(self):
+        '''Returns the rules compiled with re.M, for ErrorScanner'''
+
+        if self._line_rules is None:
+            self._line_rules = [
+                (rule, re.compile(regex.pattern, regex.flags | re.M))
+                for rule, regex in self.rules]
+        return self._line_rules
+
+    def search(self, output, pos=0):
+        '''Returns an ErrorMatch for the rule that matches output first,
+        starting at offset pos, or None. If several rules match at the same
+        offset, the one listed first wins.'''
+
+        first = None
+        for rule, regex in self.rules:
+            m = regex.search(output, pos)
+            if m is not None and (first is None or m.start() < first[1]):
+                first = (rule, m.start(), m.end())
+        if first is None:
+            return None
+        return ErrorMatch(first[0], output, first[1], first[2])
+
+
+class ErrorScanner(object):
+    """Looks for the rules of a RuleSet in output that is fed to it in
+    pieces, as it is received. Only complete lines are searched, each of them
+    once, so the whole output is scanned at O(n) cost however it is split;
+    the last, incomplete line is searched by close(). Scanning stops at the
+    first error found."""
+
+    def __init__(self, ruleset, maxline=65536):
+        '''ruleset: the RuleSet to look for
+        maxline: an incomplete line is searched anyway once it gets this
+        long, so that output without line separators is not held back'''
+
+        self.rules = ruleset.line_rules()
+        self.maxline = maxline
+        # the first error found
+        self.match = None
+        # length and number of line separators of the output scanned so far
+        self.offset = 0
+        self.lines = 0
+        self._partial = ''
+
+    def feed(self, data):
+        '''Scans the lines data completes, returns the first error found
+        so far as an ErrorMatch, or None'''
+
+        if self.match is not None or not self.rules:
+            return self.match
+        data = self._partial + data
+        end = data.rfind('\n') + 1
+        if not end:
+            if len(data) < self.maxline:
+                self._partial = data
+                return None
+            end = len(data)
+        self._partial = data[end:]
+        self._scan(data, end)
+        return self.match
+
+    def close(self):
+        '''Scans the last, incomplete line, returns the first error found
+        as an ErrorMatch, or None'''
+
+        if self.match is None and self._partial and self.rules:
+            self._scan(self._partial, len(self._partial))
+        self._partial = ''
+        return self.match
+
+    def _scan(self, data, end):
+        first = None
+        for rule, regex in self.rules:
+            m = regex.search(data, 0, end)
+            if m is not None and (first is None or m.start() < first[1]):
+                first = (rule, m.start(), m.end())
+        if first is not None:
+            self.match = ErrorMatch(first[0], data, first[1], first[2],
+                                    self.offset, self.lines)
+        self.offset += end
+        self.lines += data.count('\n', 0, end)
+
+
+def parse(lines, name, include=None):
+    '''Parses the lines of a rules file, returns the list of (rule name,
+    compiled regular expression). include is called with a personality to
+    get the rules an "include" line refers to.'''
+
+    rules = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 2)
+        if fields[0] == 'include' and len(fields) == 2 and include:
+            rules.extend(include(fields[1]))
+            continue
+        if len(fields) != 3:
+            raise RuleError('%s line %d: expected "<rule name> <flags> '
+                            '<regular expression>"' % (name, lineno))
+        rule, flags, pattern = fields
+        re_flags = 0
+        for flag in flags.strip('-'):
+            if flag not in FLAGS:
+                raise RuleError('%s line %d: unknown flag %s' % (
+                    name, lineno, flag))
+            re_flags |= FLAGS[flag]
+        try:
+            rules.append((rule, re.compile(pattern, re_flags)))
+        except re.error as e:
+            raise RuleError('%s line %d: %s' % (name, lineno, e))
+    return rules
+
+
+def _read(personality, seen=()):
+    if personality in seen:
+        raise RuleError('%s: include loop' % personality)
+    path = os.path.join(DATA_DIR, '%s.rules' % personality)
+    if not os.path.exists(path):
+        if seen:
+            raise RuleError('%s: included rules %s not found' % (
+                seen[-1], personality))
+        return []
+    with open(path) as f:
+        return parse(f, os.path.basename(path),
+                     lambda name: _read(name, seen + (personality,)))
+
+
+def load(personality):
+    '''Returns the cached RuleSet of a personality, empty if the
+    personality has no rules file'''
+
+    with _cache_lock:
+        ruleset = _cache.get(personality)
+        if ruleset is None:
+            ruleset = _cache[personality] = RuleSet(personality,
+                                                    _read(personality))
+        return ruleset
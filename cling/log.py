@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Logging of the data exchanged with devices.
+
+Cling logs what it sends and receives at DEBUG level. A command's output can
+be megabytes, so payloads are only formatted when the logger is enabled for
+DEBUG, and are cut down to PAYLOAD_LIMIT characters, head and tail, in the
+module loggers ("cling.cli", "cling.aio").
+
+The full data goes to the "cling.transcript" logger instead. It does not
+propagate to the root logger and is off until given a handler, eg. a
+rotating file with:
+
+    cling.log.log_transcript('/var/log/cling/transcript.log')
+"""
+
+import logging
+import logging.handlers
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+__all__ = ['log_transcript', 'payload', 'truncate']
+
+# characters of a payload kept in the module loggers
+PAYLOAD_LIMIT = 512
+
+TRANSCRIPT = logging.getLogger('cling.transcript')
+TRANSCRIPT.addHandler(NullHandler())
+TRANSCRIPT.propagate = False
+
+
+def truncate(data, limit=None):
+    '''Returns data, or its head and tail around a note of how many
+    characters were left out if it is longer than limit (PAYLOAD_LIMIT by
+    default). Anything but a string, eg. pexpect_ng.EOF, is returned as is.'''
+
+    if limit is None:
+        limit = PAYLOAD_LIMIT
+    if not isinstance(data, (bytes, type(u''))) or len(data) <= limit:
+        return data
+    head = limit // 2
+    return '%s[... %d characters ...]%s' % (
+        data[:head], len(data) - limit, data[len(data) - (limit - head):])
+
+
+def payload(logger, hostname, label, data):
+    '''Logs '<hostname>: <label>: "<data>"' at DEBUG level, data truncated
+    on logger and in full on the transcript logger. Costs two level checks
+    when neither is enabled.'''
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s: %s: "%s"', hostname, label, truncate(data))
+    if TRANSCRIPT.isEnabledFor(logging.DEBUG):
+        TRANSCRIPT.debug('%s: %s: "%s"', hostname, label, data)
+
+
+def log_transcript(path, max_bytes=10 * 1024 * 1024, backup_count=5):
+    '''Writes the transcript logger to path, rotated every max_bytes with
+    backup_count old files kept. Returns the handler, to be removed from
+    TRANSCRIPT to stop.'''
+
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    TRANSCRIPT.addHandler(handler)
+    TRANSCRIPT.setLevel(logging.DEBUG)
+    return handler
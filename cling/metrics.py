@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""
+Latency and throughput metrics of Cling sessions.
+
+A Metrics object set as Cling(metrics=...) times the stages of the login
+and of every command and counts what the pexpect_ng spawn does underneath,
+and hands the figures to a sink:
+
+    histogram = cling.metrics.Histogram()
+    ch = cling.Cling(hostname='router1', personality='ios',
+                     metrics=cling.metrics.Metrics(histogram))
+    ...
+    print(histogram.report())
+
+A sink is any callable taking (name, value, kind), kind being 'timer' (value
+in seconds) or 'counter'. Histogram keeps the figures in memory and
+StatsdFile writes them out as StatsD lines.
+
+The stages are timed as they end: login.spawn, login.password_prompt (ssh
+handshake up to the password prompt), login.prompt, login.auto_personality,
+login.init and login for the whole login(); command.prompt_wait,
+command.error_scan and command.clean_output for every command. The spawn
+accumulates read_calls, bytes_read and the time spent in select_wait,
+search and sleep, and these are handed to the sink per command (command.*)
+and for the login (login.*).
+
+With metrics=None, the default, all of this costs an attribute check.
+"""
+
+import threading
+import time
+
+__all__ = ['Metrics', 'Histogram', 'StatsdFile']
+
+
+class _Timer(object):
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        self.metrics.timing(self.name, time.time() - self.start)
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+# timer of a disabled Metrics
+NULL_TIMER = _NullTimer()
+
+
+class Metrics(object):
+    """Timers and counters of one session, handed to a sink"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        # accumulated until the next flush()
+        self.counters = {}
+        self.times = {}
+
+    def incr(self, name, n=1):
+        '''Adds n to the counter name'''
+
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        '''Adds seconds to the accumulated time name'''
+
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def timing(self, name, seconds):
+        '''Hands a timing to the sink'''
+
+        self.sink(name, seconds, 'timer')
+
+    def timer(self, name):
+        '''Returns a context manager handing the time its block took to
+        the sink'''
+
+        return _Timer(self, name)
+
+    def flush(self, scope):
+        '''Hands the counters and times accumulated since the last flush to
+        the sink as <scope>.<name>, and resets them'''
+
+        counters, self.counters = self.counters, {}
+        times, self.times = self.times, {}
+        for name in sorted(counters):
+            self.sink('%s.%s' % (scope, name), counters[name], 'counter')
+        for name in sorted(times):
+            self.sink('%s.%s' % (scope, name), times[name], 'timer')
+
+
+class Histogram(object):
+    """In-memory sink: counters are summed, timings are counted into buckets
+    of powers of two microseconds. Can be shared by sessions in threads."""
+
+    def __init__(self):
+        # name -> [count, total, min, max, {bucket: count}]
+        self.timers = {}
+        # name -> [count, total]
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, name, value, kind):
+        with self._lock:
+            if kind == 'counter':
+                counter = self.counters.setdefault(name, [0, 0])
+                counter[0] += 1
+                counter[1] += value
+                return
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0, value, value, {}]
+            timer[0] += 1
+            timer[1] += value
+            timer[2] = min(timer[2], value)
+            timer[3] = max(timer[3], value)
+            bucket = int(value * 1e6).bit_length()
+            timer[4][bucket] = timer[4].get(bucket, 0) + 1
+
+    def percentile(self, name, p):
+        '''Returns an upper bound of the p-th percentile of the timer name,
+        in seconds'''
+
+        with self._lock:
+            count, total, low, high, buckets = self.timers[name]
+            rank = count * p / 100.0
+            seen = 0
+            for bucket in sorted(buckets):
+                seen += buckets[bucket]
+                if seen >= rank:
+                    return min(high, (1 << bucket) / 1e6)
+            return high
+
+    def report(self):
+        '''Returns a text table of the timers and counters'''
+
+        lines = []
+        for name in sorted(self.timers):
+            count, total, low, high, buckets = self.timers[name]
+            lines.append(
+                '%-32s n %6d  avg %9.3f ms  min %9.3f  p50 %9.3f  p99 %9.3f '
+                ' max %9.3f' % (
+                    name, count, total * 1e3 / count, low * 1e3,
+                    self.percentile(name, 50) * 1e3,
+                    self.percentile(name, 99) * 1e3, high * 1e3))
+        for name in sorted(self.counters):
+            count, total = self.counters[name]
+            lines.append('%-32s n %6d  avg %11.1f     total %d' % (
+                name, count, float(total) / count, total))
+        return '\n'.join(lines)
+
+
+class StatsdFile(object):
+    """Sink writing StatsD lines, "<prefix>.<name>:<value>|ms" for timings
+    and "<prefix>.<name>:<value>|c" for counters, to a file or a named pipe
+    read by a StatsD relay"""
+
+    def __init__(self, path, prefix='cling'):
+        self.prefix = prefix
+        self.file = open(path, 'a', 1)
+        self._lock = threading.Lock()
+
+    def __call__(self, name, value, kind):
+        if kind == 'counter':
+            line = '%s.%s:%d|c\n' % (self.prefix, name, value)
+        else:
+            line = '%s.%s:%.3f|ms\n' % (self.prefix, name, value * 1e3)
+        with self._lock:
+            self.file.write(line)
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+OpenSSH connection sharing.
+
+With Cling(ssh_control_dir=...), the first login to a host starts an ssh
+ControlMaster that stays in the background for ssh_control_persist seconds
+after the last session using it has ended, and the logins that follow go
+through its socket: no key exchange nor authentication, the session is
+opened on the already authenticated transport.
+
+ControlSockets keeps one socket per user and host in the directory, named
+after a hash of "user@host" so that the path fits the unix socket length
+limit. A socket left behind by a master that is gone (reboot, killed ssh)
+makes ssh give up on multiplexing, so check() asks the master with
+"ssh -O check" and removes the socket if it does not answer within
+control_timeout seconds. cleanup() stops the masters of a directory and
+removes their sockets:
+
+    cling.multiplex.ControlSockets('/var/run/cling/ssh').cleanup()
+"""
+
+import errno
+import hashlib
+import logging
+import os
+import shlex
+import stat
+import subprocess
+import time
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+__all__ = ['ControlSockets']
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(NullHandler())
+
+
+class ControlSockets(object):
+    """ssh ControlMaster sockets of a directory, one per user and host"""
+
+    def __init__(self, directory, persist=600, ssh_path='/usr/bin/ssh',
+                 control_timeout=5):
+        self.directory = directory
+        self.persist = persist
+        self.ssh_path = ssh_path
+        self.control_timeout = control_timeout
+
+    def path(self, username, hostname):
+        '''Returns the socket path of username@hostname, creating the
+        directory, only accessible by the user, if needed'''
+
+        try:
+            os.makedirs(self.directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        name = hashlib.sha1(
+            ('%s@%s' % (username, hostname)).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name[:20])
+
+    def options(self, username, hostname):
+        '''Returns the ssh options sharing the connection to
+        username@hostname'''
+
+        return ['-o ControlMaster=auto',
+                '-o ControlPath=%s' % self.path(username, hostname),
+                '-o ControlPersist=%s' % self.persist]
+
+    def _control(self, path, command):
+        '''Runs "ssh -S path -O command", returns True if it succeeded
+        within control_timeout seconds'''
+
+        args = shlex.split(self.ssh_path) + [
+            '-S', path, '-O', command, 'cling']
+        try:
+            with open(os.devnull, 'r+') as devnull:
+                process = subprocess.Popen(args, stdin=devnull,
+                                           stdout=devnull, stderr=devnull)
+        except OSError as e:
+            LOG.debug('%s: %s failed (%s)', path, command, e)
+            return False
+        deadline = time.time() + self.control_timeout
+        while process.poll() is None:
+            if time.time() >= deadline:
+                LOG.debug('%s: %s timed out', path, command)
+                process.kill()
+                process.wait()
+                return False
+            time.sleep(0.01)
+        return process.returncode == 0
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def _check_path(self, path):
+        try:
+            mode = os.stat(path).st_mode
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        if stat.S_ISSOCK(mode) and self._control(path, 'check'):
+            return True
+        LOG.debug('%s: removing stale control socket', path)
+        self._remove(path)
+        return False
+
+    def check(self, username, hostname):
+        '''Returns True if a master to username@hostname is running.
+        Removes its socket if the master is gone.'''
+
+        return self._check_path(self.path(username, hostname))
+
+    def exit(self, username, hostname):
+        '''Stops the master to username@hostname, if any'''
+
+        path = self.path(username, hostname)
+        if self._check_path(path):
+            self._control(path, 'exit')
+            self._remove(path)
+
+    def cleanup(self):
+        '''Stops the masters of the directory and removes their sockets,
+        and whatever stale sockets are left'''
+
+        try:
+            names = os.listdir(self.directory)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if self._check_path(path):
+                self._control(path, 'exit')
+                self._remove(path)
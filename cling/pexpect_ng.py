@@ -79,7 +79,8 @@ try:
     import errno
     import traceback
     import signal
-except ImportError, e:
+    import codecs
+except ImportError as e:
     raise ImportError(str(e) + """
 
 A critical module was not found. Probably this operating system does not
@@ -87,8 +88,36 @@ support it. Pexpect is intended for UNIX-like operating systems.""")
 
 __version__ = '2.4'
 __revision__ = '$Revision: 516 $'
-__all__ = ['ExceptionPexpect', 'EOF', 'TIMEOUT', 'spawn', 'run', 'which',
-           'split_command_line', '__version__', '__revision__']
+__all__ = ['ExceptionPexpect', 'EOF', 'TIMEOUT', 'spawn', 'channel_spawn',
+           'run', 'which', 'split_command_line', '__version__', '__revision__']
+
+# pidfd_open(2) (Linux 5.3+) gives a file descriptor that becomes readable
+# when the process exits, which lets close() and terminate() wait for the
+# child in select() instead of sleeping. Python 3.9+ has os.pidfd_open(),
+# older Pythons go through libc's syscall(). The syscall number is the same
+# on all architectures but alpha.
+_NR_pidfd_open = 434
+# close_range(2) (Linux 5.9+) closes all the file descriptors of a range in
+# one call, see _close_fds().
+_NR_close_range = 436
+
+# Data is read from and written to the child as bytes. Python 3 strings, and
+# Python 2 unicode strings, are text and get encoded, see spawn's encoding.
+if sys.version_info[0] >= 3:
+    text_type = str
+else:
+    text_type = unicode
+string_types = (bytes, text_type)
+_LINESEP = os.linesep.encode('ascii')
+_PATTERN_TYPE = type(re.compile(''))
+try:
+    import ctypes
+    if sys.platform.startswith('linux') and os.uname()[4] != 'alpha':
+        _libc = ctypes.CDLL(None, use_errno=True)
+    else:
+        _libc = None
+except (ImportError, OSError):
+    _libc = None
 
 # Exception classes used by this module.
 class ExceptionPexpect(Exception):
@@ -142,6 +171,92 @@ class TIMEOUT(ExceptionPexpect):
 ##class MAXBUFFER(ExceptionPexpect):
 ##    """Raised when a scan buffer fills before matching an expected pattern."""
 
+
+class _codec_mixin(object):
+    """This keeps what is received as bytes and hands it out as text of
+    the given encoding, if any. The before and after attributes hold the raw
+    bytes of a match, which are decoded when the attribute is first read, so
+    that the output nobody reads is never decoded. Text sent and text
+    patterns are encoded; matching always runs on bytes. """
+
+    def _set_encoding(self, encoding, codec_errors='strict'):
+
+        self.encoding = encoding
+        self.codec_errors = codec_errors
+        self._before = None
+        self._before_text = None
+        self._after = None
+        self._after_text = None
+        # Patterns recompiled as bytes patterns, by text pattern.
+        self._bytes_patterns = {}
+        if encoding is None:
+            self._decoder = None
+            self._scan_decoder = None
+        else:
+            # Reads are cut anywhere, possibly inside a character, so data
+            # decoded as it is read goes through incremental decoders, that
+            # keep what is left of a character for the next read.
+            decoder = codecs.getincrementaldecoder(encoding)
+            self._decoder = decoder(codec_errors)
+            self._scan_decoder = decoder(codec_errors)
+
+    def _decode(self, data):
+
+        """This returns data as text in text mode (encoding set), anything
+        but bytes, eg. EOF, as is. """
+
+        if self.encoding is None or not isinstance(data, bytes):
+            return data
+        return data.decode(self.encoding, self.codec_errors)
+
+    def _encode(self, s):
+
+        """This returns text s as bytes, encoded with the encoding (UTF-8 in
+        bytes mode), anything else as is. """
+
+        if not isinstance(s, text_type):
+            return s
+        return s.encode(self.encoding or 'utf-8', self.codec_errors)
+
+    def _bytes_pattern(self, pattern):
+
+        """This returns the compiled regular expression pattern as a bytes
+        pattern, recompiling its encoded text once. Note that \\w, \\d and
+        the like only match ASCII characters in bytes patterns. """
+
+        if not isinstance(pattern.pattern, text_type):
+            return pattern
+        compiled = self._bytes_patterns.get(pattern)
+        if compiled is None:
+            compiled = re.compile(self._encode(pattern.pattern),
+                                  pattern.flags & ~re.UNICODE)
+            self._bytes_patterns[pattern] = compiled
+        return compiled
+
+    def _get_before(self):
+        if self._before_text is None:
+            self._before_text = self._decode(self._before)
+        return self._before_text
+
+    def _set_before(self, value):
+        self._before = self._encode(value)
+        self._before_text = None
+        if self.encoding is not None and isinstance(value, text_type):
+            self._before_text = value
+
+    before = property(_get_before, _set_before)
+
+    def _get_after(self):
+        if self._after_text is None:
+            self._after_text = self._decode(self._after)
+        return self._after_text
+
+    def _set_after(self, value):
+        self._after = self._encode(value)
+        self._after_text = None
+
+    after = property(_get_after, _set_after)
+
 def run(command, timeout=-1, withexitstatus=False, events=None, extra_args=None, logfile=None, cwd=None, env=None):
     """
     This function runs the given command; waits for it to finish; then
@@ -220,8 +335,8 @@ def run(command, timeout=-1, withexitstatus=False, events=None, extra_args=None,
     else:
         child = spawn(command, timeout=timeout, maxread=2000, logfile=logfile, cwd=cwd, env=env)
     if events is not None:
-        patterns = events.keys()
-        responses = events.values()
+        patterns = list(events.keys())
+        responses = list(events.values())
     else:
         patterns = None  # We assume that EOF or TIMEOUT will save us.
         responses = None
@@ -230,29 +345,29 @@ def run(command, timeout=-1, withexitstatus=False, events=None, extra_args=None,
     while 1:
         try:
             index = child.expect(patterns)
-            if type(child.after) in types.StringTypes:
+            if isinstance(child.after, string_types):
                 child_result_list.append(child.before + child.after)
             else:  # child.after may have been a TIMEOUT or EOF, so don't cat those.
                 child_result_list.append(child.before)
-            if type(responses[index]) in types.StringTypes:
+            if isinstance(responses[index], string_types):
                 child.send(responses[index])
             elif type(responses[index]) is types.FunctionType:
                 callback_result = responses[index](locals())
                 sys.stdout.flush()
-                if type(callback_result) in types.StringTypes:
+                if isinstance(callback_result, string_types):
                     child.send(callback_result)
                 elif callback_result:
                     break
             else:
                 raise TypeError('The callback must be a string or function type.')
             event_count = event_count + 1
-        except TIMEOUT, e:
+        except TIMEOUT as e:
             child_result_list.append(child.before)
             break
-        except EOF, e:
+        except EOF as e:
             child_result_list.append(child.before)
             break
-    child_result = ''.join(child_result_list)
+    child_result = child._decode(b'').join(child_result_list)
     if withexitstatus:
         child.close()
         return (child_result, child.exitstatus)
@@ -260,12 +375,12 @@ def run(command, timeout=-1, withexitstatus=False, events=None, extra_args=None,
         return child_result
 
 
-class spawn(object):
+class spawn(_codec_mixin):
     """This is the main class interface for Pexpect. Use this class to start
     and control child applications. """
 
-    def __init__(self, command, args=[], timeout=30, read_loop_timeout=0.2, maxread=2000, searchwindowsize=None,
-                 logfile=None, cwd=None, env=None):
+    def __init__(self, command, args=[], timeout=30, read_loop_timeout=None, maxread=2000, searchwindowsize=None,
+                 logfile=None, cwd=None, env=None, encoding=None, codec_errors='strict'):
 
         """This is the constructor. The command parameter may be a string that
         includes a command and any arguments to the command. For example::
@@ -307,6 +422,28 @@ class spawn(object):
         output are read back from the child. This feature is useful in
         conjunction with searchwindowsize.
 
+        The read_loop_timeout attribute selects how expect() waits for the
+        child. When it is None (the default) expect() blocks in select() on
+        the child's file descriptor and wakes up as soon as new data arrives
+        or the timeout expires, so a pattern is matched as soon as it is
+        received. A match is only accepted once the child has been quiet for
+        settle_timeout seconds (10 ms by default), so that prompt characters
+        which happen to end a chunk of output are not mistaken for the
+        prompt. Set settle_timeout to 0 to accept matches immediately, or
+        put the index of a pattern in settle_exempt to accept its matches
+        immediately, eg. a pager prompt the child sends nothing after until
+        it is answered. When read_loop_timeout is a number, expect() polls
+        the child and sleeps read_loop_timeout seconds after every read.
+        This is the legacy pexpect_ng behaviour and is kept for devices that
+        trickle their output in slowly.
+
+        The stall_timeout attribute, None by default, keeps expect() waiting
+        past its timeout for as long as the child sends data: the deadline is
+        pushed back to stall_timeout seconds after the last data received,
+        so that a long output is only given up on once it has stalled. The
+        read_gap attribute keeps the longest time expect() has waited for
+        data since it was last set to 0.
+
         The searchwindowsize attribute sets the how far back in the incomming
         seach buffer Pexpect will search for pattern matches. Every time
         Pexpect reads some data from the child it will append the data to the
@@ -317,6 +454,14 @@ class spawn(object):
         effect the size of the incomming data buffer. You will still have
         access to the full buffer after expect() returns.
 
+        If searchwindowsize is None, the searchlookback attribute can keep
+        data that has already been searched without a match from being
+        searched again from the beginning: a regular expression match then
+        starts at most searchlookback bytes before the data that arrived
+        since the last search, which keeps expect() linear in the size of the
+        output. A longer match is missed, so it is None by default, to search
+        the whole buffer every time.
+
         The logfile member turns on or off logging. All input and output will
         be copied to the given file object. Set logfile to None to stop
         logging. This is the default. Set logfile to sys.stdout to echo
@@ -362,6 +507,12 @@ class spawn(object):
         delaybeforesend to 0 to return to the old behavior. Most Linux machines
         don't like this to be below 0.03. I don't know why.
 
+        Setting fixeddelays to False drops delaybeforesend altogether and
+        turns delayafterclose and delayafterterminate into upper bounds:
+        close() and terminate() wait for the child to exit (on a pidfd where
+        the kernel supports it) and return as soon as it has, rather than
+        always sleeping that long.
+
         Note that spawn is clever about finding commands on your path.
         It uses the same logic that "which" uses to find executables.
 
@@ -373,7 +524,18 @@ class spawn(object):
         signalstatus will store the signal value and exitstatus will be None.
         If you need more detail you can also read the self.status member which
         stores the status returned by os.waitpid. You can interpret this using
-        os.WIFEXITED/os.WEXITSTATUS or os.WIFSIGNALED/os.TERMSIG. """
+        os.WIFEXITED/os.WEXITSTATUS or os.WIFSIGNALED/os.TERMSIG.
+
+        The data exchanged with the child is bytes. With encoding None (the
+        default) before, after, buffer and what read_nonblocking() and the
+        other read methods return are bytes too, the plain str of Python 2.
+        With an encoding, eg. 'utf-8' or 'latin-1', they are text: the
+        matches are still searched for in the raw bytes, text patterns being
+        encoded, and before and after are only decoded when read; the read
+        methods decode incrementally, so that a character split between two
+        reads comes out whole. codec_errors is the decoding error handler.
+        Text given to send() is encoded in either mode, with UTF-8 in bytes
+        mode. The logfiles always get the raw bytes. """
 
         self.STDIN_FILENO = pty.STDIN_FILENO
         self.STDOUT_FILENO = pty.STDOUT_FILENO
@@ -382,10 +544,9 @@ class spawn(object):
         self.stdout = sys.stdout
         self.stderr = sys.stderr
 
+        self._set_encoding(encoding, codec_errors)
         self.searcher = None
         self.ignorecase = False
-        self.before = None
-        self.after = None
         self.match = None
         self.match_index = None
         self.terminated = True
@@ -397,20 +558,28 @@ class spawn(object):
         self.child_fd = -1  # initially closed
         self.timeout = timeout
         self.read_loop_timeout = read_loop_timeout
+        self.settle_timeout = 0.01  # Quiet time required after a match in event driven mode. Time in seconds.
+        self.settle_exempt = ()  # Indexes of the patterns matched without waiting for settle_timeout.
+        self.stall_timeout = None  # Keep expect() going past its timeout while data came within stall_timeout seconds.
+        self.read_gap = 0  # Longest time expect() waited for data since it was set to 0. Time in seconds.
         self.delimiter = EOF
         self.logfile = logfile
         self.logfile_read = None  # input from child (read_nonblocking)
         self.logfile_send = None  # output to send (send, sendline)
         self.maxread = maxread  # max bytes to read at one time into buffer
-        self.buffer = ''  # This is the read buffer. See maxread.
+        self._buffer = b''  # This is the read buffer, raw. See maxread.
         self.searchwindowsize = searchwindowsize  # Anything before searchwindowsize point is preserved, but not searched.
+        self.searchlookback = None  # Without searchwindowsize, how far back into already searched data a match may start, None for no limit.
+        self.scanner = None  # Object whose feed() method expect_loop() passes every chunk of data read from the child, once.
+        self.metrics = None  # Object with incr() and add_time() methods counting reads and timing waits, searches and sleeps, see cling.metrics.
         # Most Linux machines don't like delaybeforesend to be below 0.03 (30 ms).
         self.delaybeforesend = 0.05  # Sets sleep time used just before sending data to child. Time in seconds.
         self.delayafterclose = 0.1  # Sets delay in close() method to allow kernel time to update process status. Time in seconds.
         self.delayafterterminate = 0.1  # Sets delay in terminate() method to allow kernel time to update process status. Time in seconds.
+        self.fixeddelays = True  # If False, send() does not sleep and close()/terminate() return as soon as the child has exited.
+        self.lazyreap = sys.platform.startswith('linux')  # Rely on read() for EOF and only check on the child when no data comes in, see read_nonblocking().
         self.softspace = False  # File-like object.
         self.name = '<' + repr(self) + '>'  # File-like object.
-        self.encoding = None  # File-like object.
         self.closed = True  # File-like object.
         self.cwd = cwd
         self.env = env
@@ -470,6 +639,8 @@ class spawn(object):
         s.append('child_fd: ' + str(self.child_fd))
         s.append('closed: ' + str(self.closed))
         s.append('timeout: ' + str(self.timeout))
+        s.append('read_loop_timeout: ' + str(self.read_loop_timeout))
+        s.append('settle_timeout: ' + str(self.settle_timeout))
         s.append('delimiter: ' + str(self.delimiter))
         s.append('logfile: ' + str(self.logfile))
         s.append('logfile_read: ' + str(self.logfile_read))
@@ -477,9 +648,14 @@ class spawn(object):
         s.append('maxread: ' + str(self.maxread))
         s.append('ignorecase: ' + str(self.ignorecase))
         s.append('searchwindowsize: ' + str(self.searchwindowsize))
+        s.append('searchlookback: ' + str(self.searchlookback))
+        s.append('scanner: ' + str(self.scanner))
+        s.append('metrics: ' + str(self.metrics))
         s.append('delaybeforesend: ' + str(self.delaybeforesend))
         s.append('delayafterclose: ' + str(self.delayafterclose))
         s.append('delayafterterminate: ' + str(self.delayafterterminate))
+        s.append('fixeddelays: ' + str(self.fixeddelays))
+        s.append('lazyreap: ' + str(self.lazyreap))
         return '\n'.join(s)
 
     def _spawn(self, command, args=[]):
@@ -528,7 +704,7 @@ class spawn(object):
         if self.use_native_pty_fork:
             try:
                 self.pid, self.child_fd = pty.fork()
-            except OSError, e:
+            except OSError as e:
                 raise ExceptionPexpect('Error! pty.fork() failed: ' + str(e))
         else:  # Use internal __fork_pty
             self.pid, self.child_fd = self.__fork_pty()
@@ -544,12 +720,7 @@ class spawn(object):
                 # This is a serious limitation, but not a show stopper.
                 pass
             # Do not allow child to inherit open file descriptors from parent.
-            max_fd = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
-            for i in range(3, max_fd):
-                try:
-                    os.close(i)
-                except OSError:
-                    pass
+            _close_fds(3)
 
             # I don't know why this works, but ignoring SIGHUP fixes a
             # problem when trying to start a Java daemon with sudo
@@ -586,11 +757,11 @@ class spawn(object):
 
         parent_fd, child_fd = os.openpty()
         if parent_fd < 0 or child_fd < 0:
-            raise ExceptionPexpect, "Error! Could not open pty with os.openpty()."
+            raise ExceptionPexpect("Error! Could not open pty with os.openpty().")
 
         pid = os.fork()
         if pid < 0:
-            raise ExceptionPexpect, "Error! Failed os.fork()."
+            raise ExceptionPexpect("Error! Failed os.fork().")
         elif pid == 0:
             # Child.
             os.close(parent_fd)
@@ -632,7 +803,7 @@ class spawn(object):
             fd = os.open("/dev/tty", os.O_RDWR | os.O_NOCTTY);
             if fd >= 0:
                 os.close(fd)
-                raise ExceptionPexpect, "Error! We are not disconnected from a controlling tty."
+                raise ExceptionPexpect("Error! We are not disconnected from a controlling tty.")
         except:
             # Good! We are disconnected from a controlling tty.
             pass
@@ -640,14 +811,14 @@ class spawn(object):
         # Verify we can open child pty.
         fd = os.open(child_name, os.O_RDWR);
         if fd < 0:
-            raise ExceptionPexpect, "Error! Could not open child pty, " + child_name
+            raise ExceptionPexpect("Error! Could not open child pty, " + child_name)
         else:
             os.close(fd)
 
         # Verify we now have a controlling tty.
         fd = os.open("/dev/tty", os.O_WRONLY)
         if fd < 0:
-            raise ExceptionPexpect, "Error! Could not open controlling tty, /dev/tty"
+            raise ExceptionPexpect("Error! Could not open controlling tty, /dev/tty")
         else:
             os.close(fd)
 
@@ -669,8 +840,8 @@ class spawn(object):
         if not self.closed:
             self.flush()
             os.close(self.child_fd)
-            time.sleep(self.delayafterclose)  # Give kernel time to update process status.
-            if self.isalive():
+            # Give kernel time to update process status.
+            if not self.__exited(self.delayafterclose):
                 if not self.terminate(force):
                     raise ExceptionPexpect('close() could not terminate the child using terminate()')
             self.child_fd = -1
@@ -717,7 +888,7 @@ class spawn(object):
         while True:
             if not self.getecho():
                 return True
-            if timeout < 0 and timeout is not None:
+            if timeout is not None and timeout < 0:
                 return False
             if timeout is not None:
                 timeout = end_time - time.time()
@@ -775,6 +946,15 @@ class spawn(object):
         # and blocked on some platforms. TCSADRAIN is probably ideal if it worked.
         termios.tcsetattr(self.child_fd, termios.TCSANOW, attr)
 
+    def _get_buffer(self):
+        return self._decode(self._buffer)
+
+    def _set_buffer(self, value):
+        self._buffer = self._encode(value)
+
+    # The read buffer, the data received after the last match.
+    buffer = property(_get_buffer, _set_buffer)
+
     def read_nonblocking(self, size=1, timeout=-1):
 
         """This reads at most size characters from the child application. It
@@ -795,7 +975,17 @@ class spawn(object):
         It will not wait for 30 seconds for another 99 characters to come in.
 
         This is a wrapper around os.read(). It uses select.select() to
-        implement the timeout. """
+        implement the timeout. With an encoding, the data is decoded, and
+        fewer characters than bytes read may be returned. """
+
+        s = self._read_nonblocking(size, timeout)
+        if self._decoder is None:
+            return s
+        return self._decoder.decode(s)
+
+    def _read_nonblocking(self, size=1, timeout=-1):
+
+        """This is read_nonblocking() returning the bytes read. """
 
         if self.closed:
             raise ValueError('I/O operation on closed file in read_nonblocking().')
@@ -808,7 +998,12 @@ class spawn(object):
         # from the child_fd -- it will block forever or until TIMEOUT.
         # For this case, I test isalive() before doing any reading.
         # If isalive() is false, then I pretend that this is the same as EOF.
-        if not self.isalive():
+        # Linux does report EOF on the pty (lazyreap), so there the child is
+        # only checked on when no data came in, saving the waitpid() calls
+        # on every read.
+        if self.lazyreap:
+            pass
+        elif not self.isalive():
             r, w, e = self.__select([self.child_fd], [], [], 0)  # timeout of 0 means "poll"
             if not r:
                 self.flag_eof = True
@@ -830,17 +1025,20 @@ class spawn(object):
                 self.flag_eof = True
                 raise EOF('End of File (EOF) in read_nonblocking(). Very pokey platform.')
             else:
-                return ''
+                return b''
 
         if self.child_fd in r:
             try:
-                s = os.read(self.child_fd, size)
-            except OSError, e:  # Linux does this
+                s = self._read(size)
+            except OSError as e:  # Linux does this
                 self.flag_eof = True
                 raise EOF('End Of File (EOF) in read_nonblocking(). Exception style platform.')
-            if s == '':  # BSD style
+            if not s:  # BSD style
                 self.flag_eof = True
                 raise EOF('End Of File (EOF) in read_nonblocking(). Empty string style platform.')
+            if self.metrics is not None:
+                self.metrics.incr('read_calls')
+                self.metrics.incr('bytes_read', len(s))
 
             if self.logfile is not None:
                 self.logfile.write(s)
@@ -853,6 +1051,21 @@ class spawn(object):
 
         raise ExceptionPexpect('Reached an unexpected state in read_nonblocking().')
 
+    def _read(self, size):
+
+        """This reads at most size bytes from the child, once select() has
+        found child_fd readable. Subclasses talking to something else than a
+        pty override it along with _write(). """
+
+        return os.read(self.child_fd, size)
+
+    def _write(self, s):
+
+        """This writes s to the child and returns the number of bytes
+        written. """
+
+        return os.write(self.child_fd, s)
+
     def read(self, size=-1):  # File-like object.
 
         """This reads at most "size" bytes from the file (less if the read hits
@@ -862,7 +1075,7 @@ class spawn(object):
         immediately. """
 
         if size == 0:
-            return ''
+            return self._decode(b'')
         if size < 0:
             self.expect(self.delimiter)  # delimiter default is EOF
             return self.before
@@ -892,10 +1105,10 @@ class spawn(object):
         object. If size is 0 then an empty string is returned. """
 
         if size == 0:
-            return ''
+            return self._decode(b'')
         index = self.expect(['\r\n', self.delimiter])  # delimiter default is EOF
         if index == 0:
-            return self.before + '\r\n'
+            return self.before + self.after
         else:
             return self.before
 
@@ -912,10 +1125,12 @@ class spawn(object):
         """
 
         result = self.readline()
-        if result == "":
+        if not result:
             raise StopIteration
         return result
 
+    __next__ = next
+
     def readlines(self, sizehint=-1):  # File-like object.
 
         """This reads until EOF using readline() and returns a list containing
@@ -950,16 +1165,18 @@ class spawn(object):
 
         """This sends a string to the child process. This returns the number of
         bytes written. If a log file was set then the data is also written to
-        the log. """
+        the log. Text is encoded, see the encoding argument of spawn. """
 
-        time.sleep(self.delaybeforesend)
+        s = self._encode(s)
+        if self.fixeddelays:
+            self.__sleep(self.delaybeforesend)
         if self.logfile is not None:
             self.logfile.write(s)
             self.logfile.flush()
         if self.logfile_send is not None:
             self.logfile_send.write(s)
             self.logfile_send.flush()
-        c = os.write(self.child_fd, s)
+        c = self._write(s)
         return c
 
     def sendline(self, s=''):
@@ -967,9 +1184,7 @@ class spawn(object):
         """This is like send(), but it adds a line feed (os.linesep). This
         returns the number of bytes written. """
 
-        n = self.send(s)
-        n = n + self.send(os.linesep)
-        return n
+        return self.send(self._encode(s) + _LINESEP)
 
     def sendcontrol(self, char):
 
@@ -1061,36 +1276,62 @@ class spawn(object):
             return True
         try:
             self.kill(signal.SIGHUP)
-            time.sleep(self.delayafterterminate)
-            if not self.isalive():
+            if self.__exited(self.delayafterterminate):
                 return True
             self.kill(signal.SIGCONT)
-            time.sleep(self.delayafterterminate)
-            if not self.isalive():
+            if self.__exited(self.delayafterterminate):
                 return True
             self.kill(signal.SIGINT)
-            time.sleep(self.delayafterterminate)
-            if not self.isalive():
+            if self.__exited(self.delayafterterminate):
                 return True
             if force:
                 self.kill(signal.SIGKILL)
-                time.sleep(self.delayafterterminate)
-                if not self.isalive():
+                if self.__exited(self.delayafterterminate):
                     return True
                 else:
                     return False
             return False
-        except OSError, e:
+        except OSError as e:
             # I think there are kernel timing issues that sometimes cause
             # this to happen. I think isalive() reports True, but the
             # process is dead to the kernel.
             # Make one last attempt to see if the kernel is up to date.
-            time.sleep(self.delayafterterminate)
-            if not self.isalive():
+            if self.__exited(self.delayafterterminate):
                 return True
             else:
                 return False
 
+    def __exited(self, delay):
+
+        """This is used by close() and terminate() to give the child time to
+        exit. With fixeddelays it sleeps 'delay' seconds, otherwise it waits
+        at most 'delay' seconds for the child to exit. Returns True if the
+        child is no longer alive. """
+
+        if self.fixeddelays:
+            self.__sleep(delay)
+            return not self.isalive()
+
+        end_time = time.time() + delay
+        pidfd = _pidfd_open(self.pid)
+        try:
+            # Without a pidfd, poll with an exponential backoff; a SIGCHLD
+            # handler would replace the application's own.
+            backoff = 0.001
+            while self.isalive():
+                timeout = end_time - time.time()
+                if timeout <= 0:
+                    return False
+                if pidfd is not None:
+                    self.__select([pidfd], [], [], timeout)
+                else:
+                    self.__sleep(min(backoff, timeout))
+                    backoff = backoff * 2
+            return True
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+
     def wait(self):
 
         """This waits until the child exits. This is a blocking call. This will
@@ -1140,8 +1381,8 @@ class spawn(object):
 
         try:
             pid, status = os.waitpid(self.pid, waitpid_options)
-        except OSError, e:  # No child processes
-            if e[0] == errno.ECHILD:
+        except OSError as e:  # No child processes
+            if e.args[0] == errno.ECHILD:
                 raise ExceptionPexpect(
                     'isalive() encountered condition where "terminated" is 0, but there was no child process. Did someone else call waitpid() on our process?')
             else:
@@ -1150,11 +1391,11 @@ class spawn(object):
         # I have to do this twice for Solaris. I can't even believe that I figured this out...
         # If waitpid() returns 0 it means that no child process wishes to
         # report, and the value of status is undefined.
-        if pid == 0:
+        if pid == 0 and not self.lazyreap:
             try:
                 pid, status = os.waitpid(self.pid, waitpid_options)  ### os.WNOHANG) # Solaris!
-            except OSError, e:  # This should never happen...
-                if e[0] == errno.ECHILD:
+            except OSError as e:  # This should never happen...
+                if e.args[0] == errno.ECHILD:
                     raise ExceptionPexpect(
                         'isalive() encountered condition that should never happen. There was no child process. Did someone else call waitpid() on our process?')
                 else:
@@ -1222,7 +1463,7 @@ class spawn(object):
 
         if patterns is None:
             return []
-        if type(patterns) is not types.ListType:
+        if type(patterns) is not list:
             patterns = [patterns]
 
         compile_flags = re.DOTALL  # Allow dot to match \n
@@ -1230,13 +1471,13 @@ class spawn(object):
             compile_flags = compile_flags | re.IGNORECASE
         compiled_pattern_list = []
         for p in patterns:
-            if type(p) in types.StringTypes:
+            if isinstance(p, string_types):
                 compiled_pattern_list.append(re.compile(p, compile_flags))
             elif p is EOF:
                 compiled_pattern_list.append(EOF)
             elif p is TIMEOUT:
                 compiled_pattern_list.append(TIMEOUT)
-            elif type(p) is type(re.compile('')):
+            elif type(p) is _PATTERN_TYPE:
                 compiled_pattern_list.append(p)
             else:
                 raise TypeError(
@@ -1335,9 +1576,12 @@ class spawn(object):
         may help if you are trying to optimize for speed, otherwise just use
         the expect() method.  This is called by expect(). If timeout==-1 then
         the self.timeout value is used. If searchwindowsize==-1 then the
-        self.searchwindowsize value is used. """
+        self.searchwindowsize value is used. Text patterns are matched as
+        bytes patterns, see _bytes_pattern(). """
 
-        return self.expect_loop(searcher_re(pattern_list), timeout, searchwindowsize)
+        pattern_list = [self._bytes_pattern(p) if type(p) is _PATTERN_TYPE else p
+                        for p in pattern_list]
+        return self.expect_loop(searcher_re(pattern_list, self.searchlookback), timeout, searchwindowsize)
 
     def expect_exact(self, pattern_list, timeout=-1, searchwindowsize=-1):
 
@@ -1353,8 +1597,9 @@ class spawn(object):
         This method is also useful when you don't want to have to worry about
         escaping regular expression characters that you want to match."""
 
-        if type(pattern_list) in types.StringTypes or pattern_list in (TIMEOUT, EOF):
+        if isinstance(pattern_list, string_types) or pattern_list in (TIMEOUT, EOF):
             pattern_list = [pattern_list]
+        pattern_list = [self._encode(p) for p in pattern_list]
         return self.expect_loop(searcher_string(pattern_list), timeout, searchwindowsize)
 
     def expect_loop(self, searcher, timeout=-1, searchwindowsize=-1):
@@ -1369,49 +1614,66 @@ class spawn(object):
 
         if timeout == -1:
             timeout = self.timeout
+        last_read = time.time()
         if timeout is not None:
-            end_time = time.time() + timeout
+            end_time = last_read + timeout
         if searchwindowsize == -1:
             searchwindowsize = self.searchwindowsize
 
         try:
-            incoming = self.buffer
-            freshlen = len(incoming)
+            incoming = receive_buffer(self._buffer)
             while True:  # Keep reading until exception or return.
 
-                if timeout < 0 and timeout is not None:
-                    index = searcher.search(incoming, freshlen, searchwindowsize)
+                if timeout is not None and timeout < 0:
+                    index = self.__search(incoming, searcher, searchwindowsize)
                     if index >= 0:
-                        self.buffer = incoming[searcher.end:]
-                        self.before = incoming[: searcher.start]
-                        self.after = incoming[searcher.start: searcher.end]
-                        self.match = searcher.match
-                        self.match_index = index
-                        return self.match_index
+                        return self.__set_match(incoming, searcher, index)
                     raise TIMEOUT('Timeout exceeded in expect_any().')
 
                 # Read Data
-                c = self.read_nonblocking(self.maxread, 0)
+                c = self._read_nonblocking(self.maxread, 0)
                 freshlen = len(c)
 
                 if freshlen == 0:
-                    index = searcher.search(incoming, freshlen, searchwindowsize)
-                    if index >= 0:
-                        self.buffer = incoming[searcher.end:]
-                        self.before = incoming[: searcher.start]
-                        self.after = incoming[searcher.start: searcher.end]
-                        self.match = searcher.match
-                        self.match_index = index
-                        return self.match_index
-
-                time.sleep(self.read_loop_timeout)
-
-                incoming = incoming + c
+                    index = self.__search(incoming, searcher, searchwindowsize)
+                    if index >= 0 and (index in self.settle_exempt or not self.__unsettled()):
+                        return self.__set_match(incoming, searcher, index)
+
+                    if self.read_loop_timeout is None and index < 0:
+                        # Nothing to read and no match yet; block until the
+                        # child sends more data or the deadline passes.
+                        if timeout is not None:
+                            self.__select([self.child_fd], [], [], max(timeout, 0))
+                        else:
+                            self.__select([self.child_fd], [], [])
+
+                if self.read_loop_timeout is not None:
+                    self.__sleep(self.read_loop_timeout)
+
+                incoming.append(c)
+                if freshlen:
+                    now = time.time()
+                    if now - last_read > self.read_gap:
+                        self.read_gap = now - last_read
+                    last_read = now
+                    # Data is still coming, push the deadline back.
+                    if self.stall_timeout is not None and timeout is not None:
+                        end_time = max(end_time, now + self.stall_timeout)
+                if freshlen and self.scanner is not None:
+                    if self._scan_decoder is None:
+                        self.scanner.feed(c)
+                    else:
+                        self.scanner.feed(self._scan_decoder.decode(c))
                 if timeout is not None:
                     timeout = end_time - time.time()
-        except EOF, e:
-            self.buffer = ''
-            self.before = incoming
+        except EOF as e:
+            # The child may have exited before settle_timeout has passed
+            # over a match, which is still a match.
+            index = self.__search(incoming, searcher, searchwindowsize)
+            if index >= 0:
+                return self.__set_match(incoming, searcher, index)
+            self._buffer = b''
+            self.before = incoming.getvalue()
             self.after = EOF
             index = searcher.eof_index
             if index >= 0:
@@ -1422,9 +1684,9 @@ class spawn(object):
                 self.match = None
                 self.match_index = None
                 raise EOF(str(e) + '\n' + str(self))
-        except TIMEOUT, e:
-            self.buffer = incoming
-            self.before = incoming
+        except TIMEOUT as e:
+            self._buffer = incoming.getvalue()
+            self.before = self._buffer
             self.after = TIMEOUT
             index = searcher.timeout_index
             if index >= 0:
@@ -1436,18 +1698,49 @@ class spawn(object):
                 self.match_index = None
                 raise TIMEOUT(str(e) + '\n' + str(self))
         except:
-            self.before = incoming
+            self.before = incoming.getvalue()
             self.after = None
             self.match = None
             self.match_index = None
             raise
 
+    def __set_match(self, incoming, searcher, index):
+
+        """This is used by expect_loop() to split the receive buffer around a
+        successful match. The buffer is copied into a string exactly once. """
+
+        data = incoming.getvalue()
+        self._buffer = data[searcher.end:]
+        self.before = data[: searcher.start]
+        self.after = data[searcher.start: searcher.end]
+        if hasattr(searcher.match, 're'):
+            # The searcher matched against the receive buffer itself, redo
+            # the match at the same position so that match.group() and
+            # friends return plain strings.
+            self.match = searcher.match.re.match(data, searcher.start)
+        else:
+            self.match = searcher.match
+        self.match_index = index
+        return self.match_index
+
+    def __unsettled(self):
+
+        """This is used by expect_loop() in event driven mode. It returns True
+        if the child sends more data within settle_timeout seconds of a
+        match, in which case the match was only a chunk boundary that happened
+        to look like the pattern (e.g. a '*>' in a BGP table). """
+
+        if self.read_loop_timeout is not None or not self.settle_timeout:
+            return False
+        r, w, e = self.__select([self.child_fd], [], [], self.settle_timeout)
+        return bool(r)
+
     def getwinsize(self):
 
         """This returns the terminal window size of the child tty. The return
         value is a tuple of (rows, cols). """
 
-        TIOCGWINSZ = getattr(termios, 'TIOCGWINSZ', 1074295912L)
+        TIOCGWINSZ = getattr(termios, 'TIOCGWINSZ', 1074295912)
         s = struct.pack('HHHH', 0, 0, 0, 0)
         x = fcntl.ioctl(self.fileno(), TIOCGWINSZ, s)
         return struct.unpack('HHHH', x)[0:2]
@@ -1469,7 +1762,7 @@ class spawn(object):
         # Newer versions of Linux have totally different values for TIOCSWINSZ.
         # Note that this fix is a hack.
         TIOCSWINSZ = getattr(termios, 'TIOCSWINSZ', -2146929561)
-        if TIOCSWINSZ == 2148037735L:  # L is not required in Python >= 2.2.
+        if TIOCSWINSZ == 2148037735:
             TIOCSWINSZ = -2146929561  # Same bits, but with sign.
         # Note, assume ws_xpixel and ws_ypixel are zero.
         s = struct.pack('HHHH', r, c, 0, 0)
@@ -1511,13 +1804,13 @@ class spawn(object):
         """
 
         # Flush the buffer.
-        self.stdout.write(self.buffer)
         self.stdout.flush()
-        self.buffer = ''
+        self.__interact_writen(self.STDOUT_FILENO, self._buffer)
+        self._buffer = b''
         mode = tty.tcgetattr(self.STDIN_FILENO)
         tty.setraw(self.STDIN_FILENO)
         try:
-            self.__interact_copy(escape_character, input_filter, output_filter)
+            self.__interact_copy(self._encode(escape_character), input_filter, output_filter)
         finally:
             tty.tcsetattr(self.STDIN_FILENO, tty.TCSAFLUSH, mode)
 
@@ -1526,7 +1819,7 @@ class spawn(object):
         """This is used by the interact() method.
         """
 
-        while data != '' and self.isalive():
+        while data and self.isalive():
             n = os.write(fd, data)
             data = data[n:]
 
@@ -1561,6 +1854,27 @@ class spawn(object):
                     break
                 self.__interact_writen(self.child_fd, data)
 
+    def __search(self, incoming, searcher, searchwindowsize):
+
+        """This runs the searcher over the receive buffer, timing it into
+        self.metrics if set. """
+
+        if self.metrics is None:
+            return incoming.search(searcher, searchwindowsize)
+        start = time.time()
+        try:
+            return incoming.search(searcher, searchwindowsize)
+        finally:
+            self.metrics.add_time('search', time.time() - start)
+
+    def __sleep(self, seconds):
+
+        """This sleeps, timing the sleep into self.metrics if set. """
+
+        time.sleep(seconds)
+        if self.metrics is not None:
+            self.metrics.add_time('sleep', seconds)
+
     def __select(self, iwtd, owtd, ewtd, timeout=None):
 
         """This is a wrapper around select.select() that ignores signals. If
@@ -1574,9 +1888,15 @@ class spawn(object):
             end_time = time.time() + timeout
         while True:
             try:
-                return select.select(iwtd, owtd, ewtd, timeout)
-            except select.error, e:
-                if e[0] == errno.EINTR:
+                if self.metrics is None:
+                    return select.select(iwtd, owtd, ewtd, timeout)
+                start = time.time()
+                try:
+                    return select.select(iwtd, owtd, ewtd, timeout)
+                finally:
+                    self.metrics.add_time('select_wait', time.time() - start)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
                     # if we loop back we have to subtract the amount of time we already waited.
                     if timeout is not None:
                         timeout = end_time - time.time()
@@ -1609,6 +1929,128 @@ class spawn(object):
 # End of spawn class
 ##############################################################################
 
+class channel_spawn(spawn):
+    """This is a spawn talking to an in-process channel instead of a child
+    process on a pty: any object with fileno(), recv(), sendall() and
+    close(), such as a socket or a paramiko Channel. fileno() must become
+    readable when data can be recv()'d, and recv() must return '' at the end
+    of the stream. expect(), send() and the rest of the spawn interface work
+    the same; there is no process, so no pid, exit status nor terminal
+    settings. """
+
+    def __init__(self, channel, timeout=30, read_loop_timeout=None,
+                 maxread=2000, searchwindowsize=None, logfile=None,
+                 encoding=None, codec_errors='strict'):
+
+        spawn.__init__(self, None, timeout=timeout,
+                       read_loop_timeout=read_loop_timeout, maxread=maxread,
+                       searchwindowsize=searchwindowsize, logfile=logfile,
+                       encoding=encoding, codec_errors=codec_errors)
+        self.channel = channel
+        self.child_fd = channel.fileno()
+        self.name = '<channel %r>' % (channel,)
+        # The end of the stream is only ever seen by recv().
+        self.lazyreap = True
+        self.terminated = False
+        self.closed = False
+
+    def _read(self, size):
+
+        try:
+            return self.channel.recv(size)
+        except EnvironmentError:
+            # A reset connection ends the stream, as EOF does.
+            return b''
+
+    def _write(self, s):
+
+        self.channel.sendall(s)
+        return len(s)
+
+    def close(self, force=True):
+
+        """This closes the channel. """
+
+        if not self.closed:
+            self.channel.close()
+            self.child_fd = -1
+            self.closed = True
+            self.terminated = True
+
+    def isatty(self):
+
+        return False
+
+    def isalive(self):
+
+        """This returns True until the channel has been closed or has
+        reached the end of the stream. """
+
+        return not self.closed and not self.flag_eof
+
+    def terminate(self, force=False):
+
+        self.close()
+        return True
+
+    def wait(self):
+
+        raise ExceptionPexpect('There is no child process to wait for on a channel.')
+
+    def kill(self, sig):
+
+        raise ExceptionPexpect('There is no child process to signal on a channel.')
+
+
+class receive_buffer(object):
+    """This is the input buffer used by the spawn.expect_loop() method. Data
+    read from the child is appended to a bytearray, so that collecting a large
+    output costs O(n) rather than copying the whole buffer on every read.
+
+    Attributes:
+
+        data    - bytearray holding all data received so far
+        scanned - number of bytes at the start of 'data' that have already
+                  been searched without a match
+    """
+
+    def __init__(self, initial=b''):
+
+        """This creates a receive buffer holding 'initial' (typically the
+        spawn's leftover buffer), none of which has been searched yet. """
+
+        self.data = bytearray(initial)
+        self.scanned = 0
+
+    def __len__(self):
+
+        return len(self.data)
+
+    def append(self, s):
+
+        """This appends freshly read data to the buffer. """
+
+        self.data += s
+
+    def search(self, searcher, searchwindowsize=None):
+
+        """This runs 'searcher' over the buffer, telling it how much data is
+        fresh since the previous search. If nothing matches, the cursor is
+        moved to the end of the buffer. Returns the searcher's result. """
+
+        freshlen = len(self.data) - self.scanned
+        index = searcher.search(self.data, freshlen, searchwindowsize)
+        if index < 0:
+            self.scanned = len(self.data)
+        return index
+
+    def getvalue(self):
+
+        """This returns the buffer contents as bytes. """
+
+        return bytes(self.data)
+
+
 class searcher_string(object):
     """This is a plain string search helper for the spawn.expect_any() method.
 
@@ -1633,7 +2075,7 @@ class searcher_string(object):
         self.eof_index = -1
         self.timeout_index = -1
         self._strings = []
-        for n, s in zip(range(len(strings)), strings):
+        for n, s in enumerate(strings):
             if s is EOF:
                 self.eof_index = n
                 continue
@@ -1654,7 +2096,7 @@ class searcher_string(object):
         if self.timeout_index >= 0:
             ss.append((self.timeout_index, '    %d: TIMEOUT' % self.timeout_index))
         ss.sort()
-        ss = zip(*ss)[1]
+        ss = list(zip(*ss))[1]
         return '\n'.join(ss)
 
     def search(self, buffer, freshlen, searchwindowsize=None):
@@ -1683,6 +2125,11 @@ class searcher_string(object):
         # rescanning until we've read three more bytes.
         #
         # Sadly, I don't know enough about this interesting topic. /grahn
+        #
+        # An Aho-Corasick automaton does scan the input once for all N
+        # strings, but stepped byte by byte in Python it is many times
+        # slower than N calls to the C find(), and so is an alternation of
+        # the strings in the re module (see benchmarks/bench_searchers.py).
 
         for index, s in self._strings:
             if searchwindowsize is None:
@@ -1722,16 +2169,19 @@ class searcher_re(object):
 
     """
 
-    def __init__(self, patterns):
+    def __init__(self, patterns, lookback=None):
 
         """This creates an instance that searches for 'patterns' Where
         'patterns' may be a list or other sequence of compiled regular
-        expressions, or the EOF or TIMEOUT types."""
+        expressions, or the EOF or TIMEOUT types. 'lookback' limits how far
+        before the fresh data a match may start when no searchwindowsize is
+        given; None means the whole buffer is searched."""
 
+        self.lookback = lookback
         self.eof_index = -1
         self.timeout_index = -1
         self._searches = []
-        for n, s in zip(range(len(patterns)), patterns):
+        for n, s in enumerate(patterns):
             if s is EOF:
                 self.eof_index = n
                 continue
@@ -1752,7 +2202,7 @@ class searcher_re(object):
         if self.timeout_index >= 0:
             ss.append((self.timeout_index, '    %d: TIMEOUT' % self.timeout_index))
         ss.sort()
-        ss = zip(*ss)[1]
+        ss = list(zip(*ss))[1]
         return '\n'.join(ss)
 
     def search(self, buffer, freshlen, searchwindowsize=None):
@@ -1768,12 +2218,21 @@ class searcher_re(object):
 
         absurd_match = len(buffer)
         first_match = absurd_match
-        # 'freshlen' doesn't help here -- we cannot predict the
-        # length of a match, and the re module provides no help.
+        # We cannot predict the length of a match, and the re module
+        # provides no help, so 'freshlen' is only used together with
+        # 'lookback' as an upper bound on how far back a match may start.
         if searchwindowsize is None:
-            searchstart = 0
+            if self.lookback is None:
+                searchstart = 0
+            else:
+                searchstart = max(0, len(buffer) - freshlen - self.lookback)
         else:
             searchstart = max(0, len(buffer) - searchwindowsize)
+        # The patterns are searched one at a time: merging them into a single
+        # alternation of named groups would scan the buffer only once, but
+        # the re module then tries every branch at every position instead of
+        # skipping ahead to each pattern's literal prefix, which benchmarks
+        # several times slower (see benchmarks/bench_searchers.py).
         for index, s in self._searches:
             match = s.search(buffer, searchstart)
             if match is None:
@@ -1783,6 +2242,10 @@ class searcher_re(object):
                 first_match = n
                 the_match = match
                 best_index = index
+                if n == searchstart:
+                    # nothing can match earlier, and on a tie the lower
+                    # index wins
+                    break
         if first_match == absurd_match:
             return -1
         self.start = first_match
@@ -1791,6 +2254,54 @@ class searcher_re(object):
         return best_index
 
 
+def _pidfd_open(pid):
+
+    """This returns a pidfd for the process 'pid', or None if the platform does
+    not support them. See pidfd_open(2). """
+
+    if hasattr(os, 'pidfd_open'):
+        try:
+            return os.pidfd_open(pid)
+        except OSError:
+            return None
+    if _libc is None:
+        return None
+    fd = _libc.syscall(_NR_pidfd_open, pid, 0)
+    if fd < 0:
+        return None
+    return fd
+
+
+def _close_fds(low):
+
+    """This closes the file descriptors from 'low' up, in the child after
+    fork(). Closing every descriptor below RLIMIT_NOFILE costs one close() per
+    descriptor, a million with a limit of 1M, so only the open ones are closed
+    where the platform tells them: all at once with close_range(2), else those
+    listed in /proc/self/fd on older Linux kernels. Other platforms get
+    os.closerange() up to the limit. """
+
+    if _libc is not None:
+        if _libc.syscall(_NR_close_range, low, ctypes.c_uint(0xffffffff), 0) == 0:
+            return
+        try:
+            fds = os.listdir('/proc/self/fd')
+        except OSError:
+            fds = None
+        if fds is not None:
+            # The listing includes the descriptor listdir() used, closed by now.
+            for fd in fds:
+                fd = int(fd)
+                if fd >= low:
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
+            return
+    max_fd = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    os.closerange(low, max_fd)
+
+
 def which(filename):
     """This takes a given filename; tries to find it in the environment path;
     then checks if it is executable. This returns the full path to the filename
@@ -1801,7 +2312,7 @@ def which(filename):
         if os.access(filename, os.X_OK):
             return filename
 
-    if not os.environ.has_key('PATH') or os.environ['PATH'] == '':
+    if 'PATH' not in os.environ or os.environ['PATH'] == '':
         p = os.defpath
     else:
         p = os.environ['PATH']
@@ -1809,7 +2320,7 @@ def which(filename):
     # Oddly enough this was the one line that made Pexpect
     # incompatible with Python 1.5.2.
     # pathlist = p.split (os.pathsep)
-    pathlist = string.split(p, os.pathsep)
+    pathlist = p.split(os.pathsep)
 
     for path in pathlist:
         f = os.path.join(path, filename)
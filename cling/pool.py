@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pool of logged in Cling sessions.
+
+Logging in is by far the most expensive part of a short Cling job: the ssh
+handshake, the password prompt and the init commands all cost round trips.
+SessionPool keeps sessions logged in between jobs and hands them out per
+host, personality and Cling arguments: a session is only handed out again
+to a caller asking for the same username, password, transport and so on,
+whether they come from the pool's defaults or from the call:
+
+    pool = cling.SessionPool(username='admin', password='secret')
+    with pool.session('router1.example.com', personality='ios') as ch:
+        print(ch.run_command('show version'))
+
+Sessions idle for longer than max_idle seconds are logged out, sessions
+handed out again are checked with Cling.is_alive() first and replaced with
+a fresh login if the check fails.
+"""
+
+import contextlib
+import logging
+import threading
+import time
+
+from . import Error
+from .cli import Cling
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+__all__ = ['SessionPool']
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(NullHandler())
+
+
+class SessionPool(object):
+
+    def __init__(self, max_idle=300, probe_timeout=5, **cling_kwargs):
+        '''max_idle: seconds after which an unused session is logged out
+        probe_timeout: seconds to wait for the prompt in the health check
+        cling_kwargs: default Cling arguments (username, password, ...)'''
+
+        self.max_idle = max_idle
+        self.probe_timeout = probe_timeout
+        self.cling_kwargs = cling_kwargs
+        # (hostname, personality, username, settings) ->
+        # [(session, last used), ...], see _settings()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _settings(cling_kwargs):
+        '''Returns a hashable digest of the Cling arguments, the repr of the
+        values that can't be hashed'''
+
+        settings = []
+        for name, value in sorted(cling_kwargs.items()):
+            try:
+                hash(value)
+            except TypeError:
+                value = repr(value)
+            settings.append((name, value))
+        return tuple(settings)
+
+    @staticmethod
+    def _key(session):
+        # the key acquire() was called with: the personality found by 'auto'
+        # or 'snmp' is not the one asked for
+        key = getattr(session, '_pool_key', None)
+        if key is not None:
+            return key
+        personality = session.personality
+        if session.auto_personality:
+            personality = 'auto'
+        # the arguments of a session not from acquire() are unknown, it is
+        # not handed out again
+        return session.hostname, personality, session.username, None
+
+    def acquire(self, hostname, personality='generic', **kwargs):
+        '''Returns a logged in session to hostname, reusing an idle one if
+        it is still healthy. kwargs override the pool's Cling arguments.'''
+
+        self.evict_idle()
+
+        cling_kwargs = dict(self.cling_kwargs, **kwargs)
+        key = (hostname, personality, cling_kwargs.get('username', ''),
+               self._settings(cling_kwargs))
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                session, last_used = idle.pop()
+            if session.is_alive(self.probe_timeout):
+                LOG.debug('%s: reusing session' % hostname)
+                return session
+            self._logout(session)
+
+        LOG.debug('%s: no idle session, logging in' % hostname)
+        session = Cling(hostname=hostname, personality=personality,
+                        **cling_kwargs)
+        session._pool_key = key
+        session.login()
+        return session
+
+    def release(self, session, discard=False):
+        '''Returns a session to the pool, or logs it out if discard is set'''
+
+        if discard:
+            self._logout(session)
+            return
+        with self._lock:
+            self._idle.setdefault(self._key(session), []).append(
+                (session, time.time()))
+
+    @contextlib.contextmanager
+    def session(self, hostname, personality='generic', **kwargs):
+        '''Context manager around acquire() and release(), the session is
+        discarded if the block raises, as its state is then unknown'''
+
+        session = self.acquire(hostname, personality, **kwargs)
+        try:
+            yield session
+        except:
+            self.release(session, discard=True)
+            raise
+        self.release(session)
+
+    def evict_idle(self):
+        '''Logs out the sessions that have been idle for over max_idle'''
+
+        expired = []
+        limit = time.time() - self.max_idle
+        with self._lock:
+            for key, idle in list(self._idle.items()):
+                expired.extend(s for s, last_used in idle if last_used < limit)
+                idle[:] = [(s, t) for s, t in idle if t >= limit]
+                if not idle:
+                    del self._idle[key]
+        for session in expired:
+            self._logout(session)
+
+    def close(self):
+        '''Logs out all idle sessions'''
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for sessions in idle.values():
+            for session, last_used in sessions:
+                self._logout(session)
+
+    def _logout(self, session):
+        LOG.debug('%s: logging out pooled session' % session.hostname)
+        if session.child is None or session.child.closed:
+            return
+        try:
+            session.logout()
+        except (Error, OSError):
+            pass
@@ -1,7 +1,10 @@
 #-*- coding: utf-8 -*-
 
+import errno
 import multiprocessing
 import logging
+import select
+import time
 try:  # Python 2.7+
     from logging import NullHandler
 except ImportError:
@@ -9,54 +12,159 @@ except ImportError:
         def emit(self, record):
             pass
 
+from . import Error
+
 LOG = logging.getLogger(__name__)
 LOG.addHandler(NullHandler())
 
-class Reactor(object):
 
-    def __init__(self, tasks, func, num_workers=1):
-        self.tasks = multiprocessing.Queue()
+class TaskFailed(Error):
+    """A task raised an exception, timed out or took its worker down"""
+
+    def __init__(self, task, reason):
+        super(TaskFailed, self).__init__('%s: %s' % (task, reason))
+        self.task = task
+        self.reason = reason
+
 
-        for task in tasks:
-            self.tasks.put(task)
-        self.tasks_len = len(tasks)
-        LOG.debug('put %s task(s) in the queue' % len(tasks))
+class Reactor(object):
 
-        self.results = multiprocessing.Queue()
+    def __init__(self, tasks, func, num_workers=1, task_timeout=None):
+        self.tasks = tasks
         self.func = func
         self.num_workers = num_workers
+        self.task_timeout = task_timeout
+        self.results = []
 
-    def worker(self):
+    def worker(self, conn):
         while True:
-            task = self.tasks.get()
+            task = conn.recv()
             if task is None:
                 return
-            else:
-                self.results.put(self.func(task))
+            try:
+                result = (True, self.func(task))
+            except Exception as e:
+                result = (False, '%s: %s' % (e.__class__.__name__, e))
+            try:
+                conn.send(result)
+            except Exception as e:  # result could not be pickled
+                conn.send((False, '%s: %s' % (e.__class__.__name__, e)))
 
-    def run(self):
-        workers = []
-        for i in range(self.num_workers):
-            workers.append(multiprocessing.Process(target=self.worker))
+    def _start_worker(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=self.worker,
+                                          args=(child_conn,))
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def imap_unordered(self):
+        '''Runs func over the tasks and yields (task, result) tuples as the
+        workers finish them. Tasks are handed to the workers one at a time,
+        so neither the tasks nor the results are held in memory all at once.
+
+        If a task raises an exception, runs for longer than task_timeout
+        seconds or its worker dies, the result is a TaskFailed instance. A
+        timed out worker is killed and replaced with a fresh one.'''
 
-        for w in workers:
-            w.start()
+        tasks = iter(self.tasks)
+        idle = [self._start_worker() for i in range(self.num_workers)]
+        busy = {}
+        LOG.debug('started %s worker(s)' % len(idle))
 
-        LOG.debug('started %s worker(s)' % len(workers))
+        try:
+            while True:
+                # hand out tasks to the idle workers
+                while idle:
+                    try:
+                        task = next(tasks)
+                    except StopIteration:
+                        break
+                    w = idle.pop()
+                    w.assign(task, self.task_timeout)
+                    busy[w.conn.fileno()] = w
+                if not busy:
+                    break
 
-        for i in range(self.num_workers):
-            self.tasks.put(None)
+                deadlines = [w.deadline for w in busy.values()
+                             if w.deadline is not None]
+                if deadlines:
+                    wait = max(0, min(deadlines) - time.time())
+                else:
+                    wait = None
+                try:
+                    ready = select.select(list(busy), [], [], wait)[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
 
-        self.tasks.close()
-        self.tasks.join_thread()
+                for fd in ready:
+                    w = busy.pop(fd)
+                    task = w.task
+                    try:
+                        ok, result = w.conn.recv()
+                    except (EOFError, IOError):
+                        LOG.debug('worker for %s died' % (task,))
+                        w.kill()
+                        ok, result = False, 'worker died'
+                        w = self._start_worker()
+                    w.task = w.deadline = None
+                    idle.append(w)
+                    if not ok:
+                        result = TaskFailed(task, result)
+                    yield task, result
 
-        results = []
-        for i in range(self.tasks_len):
-            results.append(self.results.get())
-        self.results = results
+                now = time.time()
+                for fd, w in list(busy.items()):
+                    if w.deadline is not None and w.deadline <= now:
+                        task = w.task
+                        LOG.debug('%s timed out after %s seconds' % (
+                            task, self.task_timeout))
+                        del busy[fd]
+                        w.kill()
+                        idle.append(self._start_worker())
+                        yield task, TaskFailed(
+                            task, 'timed out after %s seconds' %
+                            self.task_timeout)
+        finally:
+            for w in idle:
+                w.stop()
+            for w in busy.values():
+                w.kill()
 
-        for w in workers:
-            w.join()
+    def run(self):
+        self.results = [result for task, result in self.imap_unordered()]
 
         LOG.debug('all tasks processed, all workers exited, received %s results'
                   % len(self.results))
+
+
+class _Worker(object):
+    '''Parent side bookkeeping of a worker process'''
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.task = None
+        self.deadline = None
+
+    def assign(self, task, timeout=None):
+        self.task = task
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self.conn.send(task)
+
+    def stop(self):
+        '''Lets the worker exit once it's done'''
+        try:
+            self.conn.send(None)
+        except IOError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Session recording and replay.
+
+Recorder keeps what is read from an ssh process' pty, byte for byte and
+time stamped, and the points where data was sent to it, in a compact binary
+file (gzip compressed if the name ends with ".gz"). Only the length of the
+sent data is kept, not the data, so passwords don't end up in recordings.
+
+Played back with
+
+    python cling/recording.py <recording> [--speed FACTOR]
+
+in place of ssh, a recording goes through the same spawn and expect loop a
+live session does: the data that followed a send is only written once the
+same number of bytes has been received again, at the recorded pace divided
+by FACTOR or, by default, as fast as possible. Cling does this with
+Cling(record_path=...) and Cling(replay_path=..., replay_speed=...).
+
+The file is a header line followed by records of a kind ('r' for read,
+'s' for send), the time since the start of the session as a double and a
+length, all in network byte order, each 'r' record followed by its data.
+This module only uses the standard library, so that it runs as a script.
+"""
+
+import gzip
+import optparse
+import os
+import struct
+import termios
+import time
+
+MAGIC = b'CLINGREC1\n'
+
+RECORD = struct.Struct('!cdI')
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+class _Stream(object):
+    """File-like object passing what is written to it to the recorder"""
+
+    def __init__(self, recorder, kind):
+        self.recorder = recorder
+        self.kind = kind
+
+    def write(self, data):
+        self.recorder.record(self.kind, data)
+
+    def flush(self):
+        pass
+
+
+class Recorder(object):
+    """Records a pexpect_ng spawn through its logfile_read and
+    logfile_send"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = _open(path, 'wb')
+        self.file.write(MAGIC)
+        self.start = time.time()
+        # file-like objects for spawn.logfile_read and spawn.logfile_send
+        self.reads = _Stream(self, b'r')
+        self.sends = _Stream(self, b's')
+
+    def record(self, kind, data):
+        if self.file is None:
+            return
+        self.file.write(RECORD.pack(kind, time.time() - self.start,
+                                    len(data)))
+        if kind == b'r':
+            self.file.write(data)
+
+    def attach(self, child):
+        child.logfile_read = self.reads
+        child.logfile_send = self.sends
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_records(path):
+    '''Yields the (kind, time, data) records of a recording, data being the
+    length of the data sent for 's' records'''
+
+    f = _open(path, 'rb')
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s: not a session recording' % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            kind, stamp, length = RECORD.unpack(header)
+            if kind == b'r':
+                yield kind, stamp, f.read(length)
+            else:
+                yield kind, stamp, length
+    finally:
+        f.close()
+
+
+def _write(data):
+    while data:
+        data = data[os.write(1, data):]
+
+
+def replay(path, speed=None):
+    '''Plays a recording back on stdin/stdout, see the module docstring'''
+
+    # pass the bytes through as recorded
+    if os.isatty(0):
+        attr = termios.tcgetattr(0)
+        attr[1] &= ~termios.OPOST
+        attr[3] &= ~(termios.ECHO | termios.ICANON)
+        attr[6][termios.VMIN] = 1
+        attr[6][termios.VTIME] = 0
+        termios.tcsetattr(0, termios.TCSANOW, attr)
+
+    base, recorded_base = time.time(), 0.0
+    for kind, stamp, data in read_records(path):
+        if kind == b's':
+            # wait for the same number of bytes to be sent
+            while data > 0:
+                received = os.read(0, data)
+                if not received:
+                    return
+                data -= len(received)
+            base, recorded_base = time.time(), stamp
+            continue
+        if speed:
+            delay = base + (stamp - recorded_base) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        _write(data)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog <recording> [--speed N]')
+    parser.add_option('--speed', type='float', default=None,
+                      help='replay at the recorded pace divided by N '
+                           '(default: as fast as possible)')
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected a recording')
+    replay(args[0], opts.speed)
+
+
+if __name__ == '__main__':
+    main()
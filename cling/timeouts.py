@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+Adaptive timeouts learned from the commands run.
+
+pexpect_timeout is a single number for every host and command, so it ends
+up set for the slowest command of the slowest device, and a dead device
+holds its session for that long. A TimeoutModel set as Cling(timeouts=...)
+keeps, per host and command class, how long the last commands took, the
+longest time they went without output and how much output they returned,
+and gives every command its own timeouts:
+
+    model = cling.timeouts.TimeoutModel('/var/cache/cling/timeouts.json')
+    ch = cling.Cling(hostname='router1', personality='ios', timeouts=model)
+
+    timeout         factor times the percentile-th percentile of the
+                    durations, at least min_timeout
+    stall timeout   factor times the percentile-th percentile of the longest
+                    waits for output, at least min_timeout
+
+The expect() deadline is the timeout, pushed back to the stall timeout
+after the last output received for as long as output keeps coming: a
+traceroute or a "show tech" longer than usual runs to the end, while a
+device that has stopped answering is given up once both have expired. Both
+are capped by max_timeout, if set. Until min_samples commands of a class
+have been seen on a host, the command runs with pexpect_timeout, as without
+a model.
+
+The class of a command is its leading keywords, see command_class(); the
+login is the LOGIN class. The cache is a JSON file of {hostname: {class:
+[[duration, longest wait, bytes], ...]}}, the last `samples` commands of
+each class, rewritten atomically by save(), which Cling calls on logout.
+What other processes saved meanwhile is merged in, so that Reactor
+workers can share the file.
+"""
+
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+__all__ = ['TimeoutModel', 'command_class', 'LOGIN']
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(NullHandler())
+
+# class of the login, from the spawn to the cli prompt
+LOGIN = '<login>'
+
+# keywords of a command class, see command_class()
+KEYWORD = re.compile(r'^[a-z][a-z_-]*$')
+
+
+def command_class(command, keywords=3):
+    '''Returns the class of command: its first keywords words, lower case,
+    up to the first argument, a word with digits or punctuation in it, eg.
+    "show ip route" for "show ip route 10.0.0.0/8", "traceroute" for
+    "traceroute 192.0.2.1". LOGIN is a class of its own.'''
+
+    if command == LOGIN:
+        return LOGIN
+    words = []
+    for word in command.lower().split()[:keywords]:
+        if not KEYWORD.match(word):
+            break
+        words.append(word)
+    return ' '.join(words)
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+class TimeoutModel(object):
+    """Durations of commands per host and command class, and the timeouts
+    they call for. Can be shared by sessions in threads."""
+
+    def __init__(self, cache_path=None, percentile=99, factor=3,
+                 min_timeout=2, max_timeout=None, samples=50, min_samples=5):
+        self.path = cache_path
+        self.percentile = percentile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.samples = samples
+        self.min_samples = min_samples
+        # hostname -> class -> [[duration, longest wait, bytes], ...]
+        self._entries = {}
+        # (hostname, class) recorded since the last save()
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self.load()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            LOG.debug('%s: not using timeout cache: %s' % (self.path, e))
+            return {}
+
+    def load(self):
+        '''Reads the cache file, a missing or unreadable file is an empty
+        cache'''
+
+        if self.path is None:
+            return
+        entries = self._read()
+        with self._lock:
+            self._entries = entries
+            self._dirty.clear()
+
+    def save(self):
+        '''Writes the samples to the cache file, along with those saved by
+        other processes since it was read'''
+
+        if self.path is None:
+            return
+        with self._lock:
+            entries = self._read()
+            for hostname, klass in self._dirty:
+                entries.setdefault(hostname, {})[klass] = \
+                    self._entries[hostname][klass]
+            self._entries = entries
+            self._dirty.clear()
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.timeouts')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.rename(tmp, self.path)
+            except:
+                os.unlink(tmp)
+                raise
+
+    def record(self, hostname, klass, duration, longest_wait, size):
+        '''Adds a command of the class that took duration seconds, went at
+        most longest_wait seconds without output and returned size
+        characters'''
+
+        with self._lock:
+            runs = self._entries.setdefault(hostname, {}).setdefault(
+                klass, [])
+            runs.append([round(duration, 3), round(longest_wait, 3), size])
+            del runs[:-self.samples]
+            self._dirty.add((hostname, klass))
+
+    def _runs(self, hostname, klass):
+        with self._lock:
+            runs = list(self._entries.get(hostname, {}).get(klass, ()))
+        if len(runs) < self.min_samples:
+            return None
+        return runs
+
+    def _bound(self, seconds):
+        seconds = max(self.min_timeout, self.factor * seconds)
+        if self.max_timeout is not None:
+            seconds = min(self.max_timeout, seconds)
+        return seconds
+
+    def timeouts(self, hostname, klass, default):
+        '''Returns the (timeout, stall timeout) of a command of the class,
+        (default, None) if too few have been seen'''
+
+        runs = self._runs(hostname, klass)
+        if runs is None:
+            return default, None
+        return (self._bound(_percentile([r[0] for r in runs],
+                                        self.percentile)),
+                self._bound(_percentile([r[1] for r in runs],
+                                        self.percentile)))
+
+    def stats(self, hostname, klass):
+        '''Returns the median and percentile-th percentile of the durations
+        and of the longest waits for output, and the median output rate in
+        characters per second of the commands of the class, or None if too
+        few have been seen'''
+
+        runs = self._runs(hostname, klass)
+        if runs is None:
+            return None
+        durations = [r[0] for r in runs]
+        waits = [r[1] for r in runs]
+        return {
+            'samples': len(runs),
+            'duration_p50': _percentile(durations, 50),
+            'duration_p%d' % self.percentile: _percentile(durations,
+                                                           self.percentile),
+            'wait_p50': _percentile(waits, 50),
+            'wait_p%d' % self.percentile: _percentile(waits,
+                                                       self.percentile),
+            'rate': _percentile([r[2] / max(r[0], 0.001) for r in runs], 50),
+        }
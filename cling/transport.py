@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+Transports: how a Cling session gets its pexpect_ng child.
+
+The default, SpawnTransport, forks a pty and runs the ssh command line
+Cling builds. The other transports connect a channel in the Python process
+and wrap it in a pexpect_ng.channel_spawn, so that the session runs
+without a fork, an exec and an ssh process per session, with the same
+send()/expect() contract and the same prompt and error handling:
+
+    ch = cling.Cling(hostname='router1', username='admin', password='x',
+                     personality='ios',
+                     transport=cling.transport.ParamikoTransport())
+
+A transport has an open(session, command) method returning the child, and
+an authenticates attribute: True if the session is logged in by the time it
+is open, so that Cling does not wait for a password prompt.
+
+ChannelTransport takes any function returning a channel (fileno(), recv(),
+sendall() and close()) for a session; SocketTransport connects to a TCP
+port, eg. a console server's raw port or benchmarks/fake_device.py
+--listen; ParamikoTransport opens an ssh shell channel with paramiko, which
+is only needed for that transport.
+"""
+
+import logging
+import socket
+
+from . import Error
+from . import pexpect_ng as pexpect
+
+try:  # Python 2.7+
+    from logging import NullHandler
+except ImportError:
+    class NullHandler(logging.Handler):
+        def emit(self, record):
+            pass
+
+# attempt to load paramiko, required for ParamikoTransport
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+__all__ = ['SpawnTransport', 'ChannelTransport', 'SocketTransport',
+           'ParamikoTransport']
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(NullHandler())
+
+
+class SpawnTransport(object):
+    """Runs the command line on a pty, the default"""
+
+    authenticates = False
+
+    def open(self, session, command):
+        return pexpect.spawn(
+            command,
+            maxread=session.pexpect_maxread,
+            timeout=session.pexpect_timeout,
+            read_loop_timeout=session.pexpect_read_loop_timeout,
+            encoding=session.encoding,
+            codec_errors=session.codec_errors
+        )
+
+
+class ChannelTransport(object):
+    """Runs the session over the channel connect(session) returns"""
+
+    def __init__(self, connect, authenticates=False):
+        self.connect = connect
+        self.authenticates = authenticates
+
+    def open(self, session, command):
+        channel = self.connect(session)
+        return pexpect.channel_spawn(
+            channel,
+            maxread=session.pexpect_maxread,
+            timeout=session.pexpect_timeout,
+            read_loop_timeout=session.pexpect_read_loop_timeout,
+            encoding=session.encoding,
+            codec_errors=session.codec_errors
+        )
+
+
+class SocketTransport(ChannelTransport):
+    """Runs the session over a TCP connection to port of the host"""
+
+    def __init__(self, port, authenticates=False):
+        super(SocketTransport, self).__init__(self._connect, authenticates)
+        self.port = port
+
+    def _connect(self, session):
+        try:
+            sock = socket.create_connection((session.hostname, self.port),
+                                            session.pexpect_timeout)
+        except socket.error as e:
+            raise Error('%s: connection failed (%s)' % (session.hostname, e))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(None)
+        return sock
+
+
+class _ParamikoChannel(object):
+    """Shell channel closing its ssh client with it"""
+
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def recv(self, size):
+        return self.channel.recv(size)
+
+    def sendall(self, data):
+        self.channel.sendall(data)
+
+    def close(self):
+        self.channel.close()
+        self.client.close()
+
+
+class ParamikoTransport(ChannelTransport):
+    """Runs the session on an ssh shell channel opened with paramiko,
+    authenticated with the session's password, or its identity_path key
+    and the ssh agent if pub_key_auth is set"""
+
+    def __init__(self, port=22, term='vt100', width=511, height=24):
+        if paramiko is None:
+            raise Error('Failed to load paramiko')
+        super(ParamikoTransport, self).__init__(self._connect, True)
+        self.port = port
+        self.term = term
+        self.width = width
+        self.height = height
+
+    def _connect(self, session):
+        client = paramiko.SSHClient()
+        # as ssh -o StrictHostKeyChecking=no
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(
+                session.hostname, port=self.port,
+                username=session.username,
+                password=session.password or None,
+                key_filename=(session.identity_path
+                              if session.pub_key_auth else None),
+                look_for_keys=session.pub_key_auth,
+                allow_agent=session.pub_key_auth,
+                timeout=session.pexpect_timeout)
+            channel = client.invoke_shell(self.term, self.width, self.height)
+        except (paramiko.SSHException, socket.error) as e:
+            client.close()
+            raise Error('%s: connection failed (%s)' % (session.hostname, e))
+        LOG.debug('%s: paramiko shell channel open', session.hostname)
+        return _ParamikoChannel(client, channel)
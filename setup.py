@@ -11,6 +11,7 @@ setup(
     name='cling',
     version=cling.__version__,
     packages=find_packages('.'),
+    package_data={'cling.error_handler': ['data/*.rules']},
     description=('Cling(CLI next gen) is a Python module for automating '
                  'network device command line interface interaction'),
     author='Anton Gavrik, Leonidas Poulopoulos, Michael Lim, Kinnar Dattani',